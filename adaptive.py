@@ -1,10 +1,24 @@
+import random
+import time
 from pox.core import core
 import pox.openflow.discovery
 import pox.openflow.libopenflow_01 as of
 from pox.lib.recoco import Timer
-from pox.lib.packet.ethernet import ETHER_BROADCAST, ETHER_ANY
 import pox.host_tracker
-import random
+from misc.failover import FailoverManager
+from misc.graph import Topology
+from misc.paths import PathEngine
+from misc.directory import HostDirectory
+from misc.loadbalance import pick_core, path_cost, weighted_choice
+from misc.elephants import ElephantDetector
+from misc.admission import AdmissionControl
+from misc.tracing import FlowTracer
+from misc.dampening import LinkDampener
+from misc.maccodec import to_int, to_eth, BROADCAST, ANY
+from misc.capacity import CapacityManager
+from misc.dedup import FloodDedup
+from misc.shard import ShardChannel, owner
+from misc.warmstart import WarmStart, RestoredLinkEvent, link_key, LINK, MAC, HOST, LOAD
 
 
 # TODO Share known redirections between core switches.
@@ -14,11 +28,51 @@ import random
 
 log = core.getLogger()
 
+# Idle timeout of the flows matching an IP 5-tuple, in seconds
+FINE_IDLE_TIMEOUT = 10
+
+
+def match_key(match):
+    """
+    Return a hashable identifier of a flow match, the same for the installed flow and its statistics.
+    """
+    return (match.dl_src, match.dl_dst, match.dl_type, match.nw_src, match.nw_dst, match.nw_proto, match.tp_src,
+            match.tp_dst)
+
+
+def fine_match(raw_packet):
+    """
+    Return a match on the IP 5-tuple (and the MAC addresses) of a TCP or UDP packet, None for the other packets.
+    """
+    ip = raw_packet.find('ipv4')
+    transport = raw_packet.find('tcp') or raw_packet.find('udp')
+    if ip is None or transport is None:
+        return None
+
+    match = of.ofp_match()
+    match.dl_src = raw_packet.src
+    match.dl_dst = raw_packet.dst
+    match.dl_type = raw_packet.IP_TYPE
+    match.nw_src = ip.srcip
+    match.nw_dst = ip.dstip
+    match.nw_proto = ip.protocol
+    match.tp_src = transport.srcport
+    match.tp_dst = transport.dstport
+    return match
+
+
 class AdaptiveSwitchController():
-    def __init__(self, connection):
+    def __init__(self, connection, failover=None, admission=None, tracer=None, capacity=None):
         self.connection = connection
         self.dpid = connection.dpid
         self.timer = None
+        self.failover = failover
+        self.admission = admission
+        self.tracer = tracer
+        self.capacity = capacity
+        self.fine_flows = set()   # Match keys of the fine flows installed on the switch
+        if capacity is not None:
+            capacity.watch(connection)
 
         # Add listeners
         self.connection.addListeners(self)
@@ -35,32 +89,69 @@ class AdaptiveSwitchController():
         action = of.ofp_action_output(port=out_port)
         msg.actions.append(action)
         self.connection.send(msg)
+        if self.tracer is not None:
+            self.tracer.packet_out(self.connection)
 
-    def _forward_and_update(self, raw_packet, of_packet, out_port):
+    def _forward_and_update(self, raw_packet, of_packet, out_port, match=None):
         """
         Send the packet on the specified port and define a flow rule for the following
-        packets having the same source, destination and type.
+        packets having the same source, destination and type. A finer match (see fine_match) can be given
+        instead, its flow expires when idle.
         """
         # Forward packet
         self._send_packet_out(of_packet, out_port)
 
         # Update switch flows
         msg = of.ofp_flow_mod()
-        match = of.ofp_match()
-        match.dl_src = raw_packet.src
-        match.dl_dst = raw_packet.dst
-        match.type = raw_packet.type
+        if self.capacity is not None and self.capacity.reserve(self.dpid):
+            # Under flow table pressure, a single rule per destination aggregates all the sources
+            match = of.ofp_match()
+            match.dl_dst = raw_packet.dst
+        elif match is None:
+            match = of.ofp_match()
+            match.dl_src = raw_packet.src
+            match.dl_dst = raw_packet.dst
+            match.type = raw_packet.type
+        else:
+            msg.idle_timeout = FINE_IDLE_TIMEOUT
+            msg.flags = of.OFPFF_SEND_FLOW_REM
+            self.fine_flows.add(match_key(match))
+        if self.failover is not None:
+            # The failover decision of the flow is forgotten when the flow goes away
+            msg.flags = of.OFPFF_SEND_FLOW_REM
         msg.match = match
         msg.actions.append(of.ofp_action_output(port = out_port))
         self.connection.send(msg)
+        if self.tracer is not None:
+            self.tracer.flow_mod(self.connection)
+
+        # Keep a backup for the new flow
+        if self.failover is not None:
+            self._record_decision(match, out_port)
+
+    def _record_decision(self, match, out_port):
+        """
+        Register the flow installed on the switch in the failover manager.
+        """
+        self.failover.record(self.connection, match_key(match), match, out_port, [(self.dpid, out_port)])
+
+    def _handle_FlowRemoved(self, event):
+        """
+        Callback invoked when a flow has expired or has been deleted on the switch.
+        """
+        match = event.ofp.match
+        if match.nw_proto is not None:
+            self.fine_flows.discard(match_key(match))
+        if self.failover is not None:
+            self.failover.forget(self.dpid, match_key(match))
 
 
 class AdaptiveCoreSwitchController(AdaptiveSwitchController):
-    def __init__(self, connection, interval):
-        AdaptiveSwitchController.__init__(self, connection)
+    def __init__(self, connection, interval, failover=None, admission=None, tracer=None, capacity=None):
+        AdaptiveSwitchController.__init__(self, connection, failover, admission, tracer, capacity)
         
         self.interval = interval
-        self.mac_to_port = {}
+        self.mac_to_port = {}   # MAC address as a 48-bit int -> port
 
         # Start to request stats if core switch
         self._request_port_stats()
@@ -83,67 +174,288 @@ class AdaptiveCoreSwitchController(AdaptiveSwitchController):
         # Update MAC to port mapping
         raw_packet = event.parsed
         of_packet = event.ofp
-        self.mac_to_port[raw_packet.src] = of_packet.in_port
+        src, dst = to_int(raw_packet.src), to_int(raw_packet.dst)
+        if self.tracer is not None:
+            self.tracer.packet_in(event)
+        if self.admission is not None and not self.admission.admit(event, self._handle_PacketIn,
+                                                                   dst in self.mac_to_port):
+            if self.tracer is not None:
+                self.tracer.rejected(event)
+            return
+        self.mac_to_port[src] = of_packet.in_port
         
         # Define the behavior of the switch
-        if raw_packet.dst in self.mac_to_port:
-            out_port = self.mac_to_port[raw_packet.dst]
+        out_port = self.mac_to_port.get(dst)
+        if out_port is not None:
             self._forward_and_update(raw_packet, of_packet, out_port)
         else:
             self._send_packet_out(of_packet, of.OFPP_ALL)
 
 
 class AdaptiveEdgeSwitchController(AdaptiveSwitchController):
-    def __init__(self, connection, core_ports, links, hosts, ports):
-        AdaptiveSwitchController.__init__(self, connection)
+    def __init__(self, connection, core_ports, links, directory, failover=None, edge_to_core=None, paths=None,
+                 directed_loads=None, interval=None, granularity='l2', fine_budget=1000, admission=None,
+                 tracer=None, capacity=None, dedup=None):
+        AdaptiveSwitchController.__init__(self, connection, failover, admission, tracer, capacity)
+        self.interval = interval
+        self.granularity = granularity
+        self.fine_budget = fine_budget
 
         self.core_ports = core_ports
         self.links = links
-        self.hosts = hosts
-        self.ports = ports
+        self.directory = directory
+        self.edge_to_core = edge_to_core if edge_to_core is not None else {}
+        self.paths = paths if paths is not None else PathEngine(Topology(core_ports))
+        self.directed_loads = directed_loads if directed_loads is not None else {}
+
+        # Precomputed port sets of the PacketIn path
+        core_ports = frozenset(core_ports)
+        ports = [p.port_no for p in connection.features.ports if p.port_no < of.OFPP_MAX]
+        self.host_ports = tuple(p for p in ports if p not in core_ports)
+        self._core_ports = core_ports
+        self._port_count = len(ports)
+        self._uplink_keys = ()
+        self._links_seen = -1
+
+        # Broadcasts reach the hosts of every edge switch from the ingress one, see FloodDedup
+        self.dedup = dedup
+        if dedup is not None:
+            dedup.register(self)
+
+        # Start to request flow stats to find the elephant flows
+        if interval is not None:
+            self._request_flow_stats()
+
+    def _request_flow_stats(self):
+        """
+        Ask to an edge switch for its flow statistics. The response is handled by the main controller instance.
+        """
+        # Request
+        self.connection.send(of.ofp_stats_request(body=of.ofp_flow_stats_request()))
+
+        # Schedule next execution
+        self.timer = Timer(self.interval, self._request_flow_stats)
+
+    def _uplinks(self):
+        """
+        Return the load of the active links between this edge switch and the core switches, by port.
+        """
+        # The links are never removed from the shared map (their load becomes None), its size tells if one was added
+        if len(self.links) != self._links_seen:
+            self._links_seen = len(self.links)
+            self._uplink_keys = tuple(t for t in self.links if t[0] == self.dpid)
+        links = self.links
+        return {t[1]: links[t] for t in self._uplink_keys if links[t] is not None}
+
+    def _host_edge(self, mac):
+        """
+        Return the dpid of the edge switch the host is connected to, None if unknown.
+        """
+        location = self.directory.locate(mac)
+        return location[0] if location is not None else None
+
+    def _pick_core(self, links, dst):
+        """
+        Return the core port whose path to the destination has the least loaded bottleneck, between the uplink from
+        this edge switch and the downlink from the core to the destination edge switch. Only the uplink is
+        considered if the destination is unknown.
+        """
+        return pick_core(*self._path_loads(links, dst))
+
+    def _hash_core(self, links, match):
+        """
+        Return the core port of a connection, chosen by hashing its 5-tuple with the ports weighted by the inverse of
+        the load of their path. Like pick_core(), only the cores with a link to the destination edge switch are
+        candidates, if there are any.
+        """
+        uplinks, downlinks = self._path_loads(links, to_int(match.dl_dst))
+        ports = [p for p in uplinks if p in downlinks] if downlinks else None
+        weights = {p: 1.0 / (1.0 + path_cost(p, uplinks, downlinks)) for p in ports or uplinks}
+        return weighted_choice(match_key(match), weights)
+
+    def _path_loads(self, links, dst):
+        """
+        Return the load of the uplink and of the downlink to the destination edge switch (None if unknown) of every
+        core port.
+        """
+        uplinks = {}
+        for port in links:
+            core = self.edge_to_core.get((self.dpid, port))
+            uplinks[port] = self.directed_loads[core][0] if core in self.directed_loads else links[port]
+
+        dst_edge = self._host_edge(dst)
+        downlinks = None
+        if dst_edge is not None and dst_edge != self.dpid:
+            downlinks = {}
+            for port in links:
+                core = self.edge_to_core.get((self.dpid, port))
+                if core is None:
+                    continue
+                # The least loaded of the links from the core to the destination edge switch
+                loads = [self.directed_loads[(core[0], p)][1] for p in self.paths.next_hops(core[0], dst_edge)
+                         if (core[0], p) in self.directed_loads]
+                if loads:
+                    downlinks[port] = min(loads)
+
+        return uplinks, downlinks
+
+    def _path_endpoints(self, out_port, dst_edge):
+        """
+        Return the link endpoints used by a flow leaving through a core port towards the destination edge switch.
+        """
+        endpoints = [(self.dpid, out_port)]
+        core = self.edge_to_core.get((self.dpid, out_port))
+        if core is not None:
+            endpoints.extend((core[0], port) for port in sorted(self.paths.next_hops(core[0], dst_edge))[:1])
+        return endpoints
+
+    def _record_decision(self, match, out_port):
+        """
+        Register the flow installed on the switch in the failover manager. Flows going to a core switch get the least
+        loaded other core as backup.
+        """
+        if out_port not in self.core_ports:
+            return
+
+        dst_edge = self._host_edge(to_int(match.dl_dst))
+        candidates = {p: l for p, l in self._uplinks().items() if p != out_port}
+        backup_port = min(candidates, key=candidates.get) if candidates else None
+        backup_endpoints = self._path_endpoints(backup_port, dst_edge) if backup_port is not None else ()
+
+        self.failover.record(self.connection, match_key(match), match, out_port,
+                             self._path_endpoints(out_port, dst_edge), backup_port, backup_endpoints)
+
+    def _move_elephant(self, stat, out_port, rate, detector, now):
+        """
+        Move a heavy flow to the core whose path is the least loaded, if the gain is worth it.
+
+        Parameters:
+        -----------
+        stat: ofp_flow_stats
+            Statistics of the flow.
+        out_port: int
+            Core port currently used by the flow.
+        rate: float
+            Rate of the flow in bytes per second.
+        detector: ElephantDetector
+            Decides if the flow can be moved.
+        now: float
+            Current time.
+        """
+        links = self._uplinks()
+        if out_port not in links or len(links) < 2:
+            return
+
+        uplinks, downlinks = self._path_loads(links, to_int(stat.match.dl_dst))
+        # The loads are measured over one interval
+        contribution = rate * self.interval
+        candidates = {p: l for p, l in uplinks.items() if p != out_port}
+        if downlinks is not None:
+            # Only the cores with a link to the destination edge switch can deliver the flow
+            candidates = {p: l for p, l in candidates.items() if p in downlinks}
+        if not candidates:
+            return
+        new_port = pick_core(candidates, downlinks)
+        current_cost = path_cost(out_port, uplinks, downlinks)
+        new_cost = path_cost(new_port, uplinks, downlinks)
+
+        key = match_key(stat.match)
+        if not detector.should_move(self.dpid, key, current_cost, new_cost, contribution, now):
+            return
+
+        msg = of.ofp_flow_mod(command=of.OFPFC_MODIFY_STRICT)
+        msg.match = stat.match
+        msg.priority = stat.priority
+        msg.actions.append(of.ofp_action_output(port=new_port))
+        self.connection.send(msg)
+        detector.moved(self.dpid, key, now)
+        log.info("Switch #{} - elephant {} -> {} ({:.0f} B/s) moved from port {} to port {}".format(
+            self.dpid, stat.match.dl_src, stat.match.dl_dst, rate, out_port, new_port))
+
+        # Account for the move until the next measures
+        for port, sign in ((out_port, -1), (new_port, 1)):
+            core = self.edge_to_core.get((self.dpid, port))
+            if core in self.directed_loads:
+                self.directed_loads[core][0] += sign * contribution
+
+        if self.failover is not None:
+            self._record_decision(stat.match, new_port)
 
     def _host_broadcast_packet_out(self, of_packet):
         """
         Send the packet to all hosts directly connected to the edge switch.
         """
-        out_ports = set(self.connection.ports.keys()[:-1]) - set(self.core_ports)
-        for port in out_ports:
+        for port in self.host_ports:
             self._send_packet_out(of_packet, port)
 
+    def tree_ports(self, tree):
+        """
+        Return:
+        -------
+            The ports a broadcast is sent on by the flood plans, the host ports.
+        """
+        return self.host_ports
+
     def _handle_PacketIn(self, event):
         """
         Callback invoked when a packet out request has been received.
         """
         raw_packet = event.parsed
         of_packet = event.ofp
-        links = {t[1]: self.links[t] for t in self.links if t[0] == self.dpid}
-        hosts = self.hosts[self.dpid] if self.dpid in self.hosts else set()
-        ports = self.ports[self.dpid] if self.dpid in self.ports else dict()
+        src, dst = to_int(raw_packet.src), to_int(raw_packet.dst)
+        # The broadcasts already sent to the hosts of every edge switch are dropped when they come back from a core
+        from_core = of_packet.in_port in self._core_ports
+        if self.dedup is not None and self.dedup.duplicate(self, of_packet, None, from_core):
+            return
+        if self.tracer is not None:
+            self.tracer.packet_in(event)
+        if self.admission is not None and not self.admission.admit(event, self._handle_PacketIn,
+                                                                   self.directory.locate(dst) is not None):
+            if self.tracer is not None:
+                self.tracer.rejected(event)
+            return
+        links = self._uplinks()
+
+        # A packet coming from a host port tells where the host is (and if it has moved)
+        if not from_core:
+            self.directory.learn(src, self.dpid, of_packet.in_port)
+        hosts = self.directory.hosts(self.dpid)
 
         # If the destination is a direct host
-        if raw_packet.dst in hosts and \
-            raw_packet.dst in ports:
+        host_port = hosts.get(dst)
+        if host_port is not None:
             # Send to host and create flow
-            self._forward_and_update(raw_packet, of_packet, ports[raw_packet.dst])
+            self._forward_and_update(raw_packet, of_packet, host_port)
         else:
+            # Connections get their own flow while the flow table budget allows it
+            match = None
+            if self.granularity == 'l4' and len(self.fine_flows) < self.fine_budget:
+                match = fine_match(raw_packet)
+
             # Pick a core to handle the new flow
-            if links:
-                out_port = min(links, key=links.get)
+            if links and match is not None:
+                out_port = self._hash_core(links, match)
+            elif links:
+                out_port = self._pick_core(links, dst)
             else:
                 out_port = random.choice(self.core_ports)
             
-            # If the destination is a foreign host
-            if raw_packet.dst != ETHER_BROADCAST and \
-                raw_packet.dst != ETHER_ANY and \
-                raw_packet.dst not in hosts and \
-                (len(hosts) + len(self.core_ports) == len(self.connection.ports) - 1):
+            # If the destination is a foreign host (a packet from a core is never sent back to the fabric, a core
+            # flooding an unknown destination would get it back from every edge switch)
+            if not from_core and \
+                dst != BROADCAST and \
+                dst != ANY and \
+                (len(hosts) + len(self._core_ports) == self._port_count):
                 # Send to THE ONE and create flow
-                self._forward_and_update(raw_packet, of_packet, out_port)
+                self._forward_and_update(raw_packet, of_packet, out_port, match)
             # If the destination is unknown and previous hop is core
-            elif of_packet.in_port in self.core_ports:
+            elif from_core:
                 # Broadcast locally
                 self._host_broadcast_packet_out(of_packet)
             # If the destination is unknown and previous hop is host 
+            elif self.dedup is not None and self.dedup.flood(self, of_packet, None):
+                # Broadcast to the hosts of every edge switch at once
+                pass
             else:
                 # Broadcast locally and send to THE ONE
                 self._send_packet_out(of_packet, out_port)
@@ -151,20 +463,60 @@ class AdaptiveEdgeSwitchController(AdaptiveSwitchController):
 
 
 class AdaptiveController():
-    def __init__(self, core_ids, interval):
+    def __init__(self, core_ids, interval, host_max_age=600, elephant_threshold=None, granularity='l2',
+                 fine_budget=1000, admission_rate=None):
         self.core_ids = core_ids
         self.interval = interval
+        self.granularity = granularity
+        self.fine_budget = fine_budget
         self.switch_controllers = {}
         self.core_to_edge = {}
         self.edge_links = {}
         self.prev_edge_links = {}
-        self.edge_hosts = {}
-        self.edge_host_ports = {}
+        self.directory = HostDirectory(host_max_age, self._host_moved)
+        self.edge_to_core = {}
+        # Links between the core and the edge switches, and the next hops of the cores towards each edge switch
+        self.topology = Topology(core_ids)
+        self.paths = PathEngine(self.topology)
+        # Core port -> [load from the edge, load to the edge, rx bytes, tx bytes] of the link to an edge switch
+        self.directed_loads = {}
+        self.failover = FailoverManager()
+        # Moves the heavy flows of the edge switches, disabled without threshold
+        self.elephants = ElephantDetector(elephant_threshold) if elephant_threshold else None
+        # Admission layer in front of the PacketIn handlers, disabled without rate
+        self.admission = AdmissionControl(admission_rate, burst=max(1.0, admission_rate / 5.0),
+                                          host_port=self._host_port) if admission_rate else None
+        # Flow setup latency tracer, see enable_tracing()
+        self.tracer = None
+        # Dampening of the flapping links, see enable_dampening()
+        self.dampener = None
+        # Flow table capacity manager, see enable_capacity()
+        self.capacity = None
+        # Broadcasts sent to every edge switch at once, see enable_dedup()
+        self.dedup = None
+
+        # State restored from a snapshot, until confirmed by the network
+        self.warm_start = None
+        self._provisional_links = set()
+        self._provisional_hosts = set()
+        self._restored_macs = {}
+
+        # dpid -> {match key: packet count} of the flows of the edge switches at their last statistics
+        self._flow_packets = {}
+
+        # Sharded deployment, see shard.py
+        self.shard_count = 1
+        self.shard_index = 0
+        self.channel = None
+
+        # Remove the hosts not seen for a while
+        Timer(host_max_age / 2.0, self._age_hosts, recurring=True)
 
         # Add listeners
         core.openflow.addListenerByName("ConnectionUp", self._handle_ConnectionUp)
-        core.openflow_discovery.addListenerByName("LinkEvent", self._handle_LinkEvent)
+        core.openflow_discovery.addListenerByName("LinkEvent", self._handle_DiscoveryLinkEvent)
         core.openflow.addListenerByName("PortStatsReceived", self._handle_PortStatsReceived)
+        core.openflow.addListenerByName("FlowStatsReceived", self._handle_FlowStatsReceived)
         core.host_tracker.addListenerByName("HostEvent", self._handle_HostEvent)
 
     def _handle_ConnectionUp(self, event):
@@ -173,40 +525,87 @@ class AdaptiveController():
         """
         # Create the coresponding switch controller instance to handle the new connection
         dpid = event.connection.dpid
+        if owner(dpid, self.shard_count) != self.shard_index:
+            log.debug("Switch #{} belongs to another shard".format(dpid))
+            return
         if dpid in self.core_ids:
-            switch_controller = AdaptiveCoreSwitchController(event.connection, self.interval)
+            switch_controller = AdaptiveCoreSwitchController(event.connection, self.interval, self.failover,
+                                                             self.admission, self.tracer, self.capacity)
+            switch_controller.mac_to_port.update(self._restored_macs.pop(dpid, {}))
         else:
             switch_controller = AdaptiveEdgeSwitchController(event.connection, self.core_ids, \
-            self.edge_links, self.edge_hosts, self.edge_host_ports)
+            self.edge_links, self.directory, self.failover, self.edge_to_core, self.paths, self.directed_loads, \
+            self.interval if self.elephants is not None else None, self.granularity, self.fine_budget, self.admission, \
+            self.tracer, self.capacity, self.dedup)
         self.switch_controllers[dpid] = switch_controller
 
+    def _handle_DiscoveryLinkEvent(self, event):
+        """
+        Callback invoked when openflow.discovery reports a link, goes through the dampening layer if enabled.
+        """
+        # The failover convergence is measured from the reception of the event
+        event.received = time.time()
+        if self.dampener is not None:
+            self.dampener.handle(event)
+        else:
+            self._handle_LinkEvent(event)
+
     def _handle_LinkEvent(self, event):
         """
         Callback invoked when a link has been removed or added to the network.
         """
+        # Share the links seen by this shard
+        if self.channel is not None and not getattr(event, 'remote', False):
+            link = event.link
+            self.channel.publish('link', (link.dpid1, link.port1, link.dpid2, link.port2, event.added))
+
         # Split the link into core and edge parts
         raw = event.link.uni
         if raw.dpid1 in self.core_ids:
             core, edge = (raw.dpid1, raw.port1), (raw.dpid2, raw.port2)
         else:
             core, edge = (raw.dpid2, raw.port2), (raw.dpid1, raw.port1)
+        self._provisional_links.discard(link_key(raw))
 
         # Update the maps
         if event.added:
             self.core_to_edge[core] = edge
-            self.edge_links[edge] = 0
-            self.prev_edge_links[edge] = 0
+            self.edge_to_core[edge] = core
+            self.topology.add_link(raw.dpid1, raw.dpid2, raw.port1, raw.port2)
+            self.paths.link_changed(raw.dpid1, raw.dpid2, event.added)
+            # Keep the load history of a link which is already up (e.g. restored from a snapshot)
+            if self.edge_links.get(edge) is None:
+                self.edge_links[edge] = 0
+                self.prev_edge_links[edge] = 0
+            self.directed_loads.setdefault(core, [0, 0, None, None])
+            self.failover.link_added(core, edge)
         elif event.removed:
+            # Both directions of a link are reported
+            if self.core_to_edge.get(core) == edge:
+                self.topology.remove_link(raw.dpid1, raw.dpid2, raw.port1, raw.port2)
+                self.paths.link_changed(raw.dpid1, raw.dpid2, event.added)
             self.core_to_edge[core] = None
+            self.edge_to_core[edge] = None
+            self.directed_loads.pop(core, None)
             self.edge_links[edge] = None
             self.prev_edge_links[edge] = None
 
+            # Move the flows using the link to their backup before anything else
+            self.failover.link_removed(core, edge, getattr(event, 'received', None))
+
+            # The core switch can not reach the hosts behind this port anymore
+            switch_controller = self.switch_controllers.get(core[0])
+            if isinstance(switch_controller, AdaptiveCoreSwitchController):
+                for mac in [m for m, p in switch_controller.mac_to_port.items() if p == core[1]]:
+                    del switch_controller.mac_to_port[mac]
+
     def _handle_PortStatsReceived(self, event):
         """
         Callback invoked when a switch statistics response has arrived to the controller.
         """
         # Update link stats for all relevant ports (i.e. not the 65534 at index 0)
         dpid = event.connection.dpid
+        loads = []
         for s in event.stats[1:]:
             core = (dpid, s.port_no)
             if core in self.core_to_edge:
@@ -216,23 +615,290 @@ class AdaptiveController():
                     self.edge_links[edge] = total - self.prev_edge_links[edge]
                     self.prev_edge_links[edge] = total
 
+                    # The core port receives the traffic from the edge and sends the traffic to the edge
+                    directed = self.directed_loads.get(core)
+                    if directed is not None:
+                        if directed[2] is not None:
+                            directed[0] = s.rx_bytes - directed[2]
+                            directed[1] = s.tx_bytes - directed[3]
+                        directed[2], directed[3] = s.rx_bytes, s.tx_bytes
+                        directed = list(directed)
+                    loads.append((edge, self.edge_links[edge], total, core, directed))
+
+        # Share the loads measured by this shard
+        if self.channel is not None and loads:
+            self.channel.publish('loads', loads)
+
+    def _handle_FlowStatsReceived(self, event):
+        """
+        Callback invoked when the flow statistics of an edge switch have arrived. The sources of the active flows are
+        refreshed in the host directory, and the heavy flows going to a core switch are moved to a less loaded core.
+        """
+        switch_controller = self.switch_controllers.get(event.connection.dpid)
+        if not isinstance(switch_controller, AdaptiveEdgeSwitchController):
+            return
+        self._refresh_hosts(event.connection.dpid, event.stats)
+        if self.elephants is None:
+            return
+        # The replies to the capacity manager do not follow the interval of the elephant detector
+        if self.capacity is not None and self.capacity.requested(event):
+            return
+
+        # Only the flows going to a core switch can be moved
+        now = time.time()
+        flows = {}
+        for stat in event.stats:
+            ports = [a.port for a in stat.actions if isinstance(a, of.ofp_action_output)]
+            if len(ports) == 1 and ports[0] in switch_controller.core_ports:
+                flows[match_key(stat.match)] = (stat, ports[0])
+
+        elephants = self.elephants.update(event.connection.dpid,
+                                          [(key, flow[0].byte_count) for key, flow in flows.items()], now)
+        for key, rate in elephants:
+            stat, out_port = flows[key]
+            switch_controller._move_elephant(stat, out_port, rate, self.elephants, now)
+
     def _handle_HostEvent(self, event):
         """
-        Callback invoked when a new host has been discovered in the network.
+        Callback invoked when a new host has been discovered in the network, or has left it.
+        """
+        mac = to_int(event.entry.macaddr)
+        if event.leave:
+            if self.directory.remove(mac) is not None:
+                self._invalidate_host(mac)
+            return
+
+        self._add_host(event.entry.dpid, mac, event.entry.port)
+
+        # Share the hosts discovered by this shard
+        if self.channel is not None:
+            self.channel.publish('host', (event.entry.dpid, mac, event.entry.port))
+
+    def _add_host(self, dpid, mac, port):
+        """
+        Record a host connected to an edge switch.
+        """
+        self._provisional_hosts.discard((dpid, mac))
+        self.directory.learn(mac, dpid, port)
+
+    def _host_port(self, dpid, port):
+        """
+        Return True if a port of a switch leads to hosts, a port of an edge switch not connected to a core switch.
+        """
+        switch_controller = self.switch_controllers.get(dpid)
+        return isinstance(switch_controller, AdaptiveEdgeSwitchController) and port in switch_controller.host_ports
+
+    def _host_moved(self, mac, previous, current):
+        """
+        Callback invoked by the host directory when a host has moved.
+        """
+        log.info("Host {} moved from switch #{}:{} to switch #{}:{}".format(to_eth(mac), previous[0], previous[1],
+                                                                           current[0], current[1]))
+        self._invalidate_host(mac)
+
+    def _refresh_hosts(self, dpid, stats):
+        """
+        Refresh in the host directory the sources of the flows of an edge switch which have matched packets since its
+        previous statistics: the flows are permanent, so an active host does not send PacketIns anymore.
+        """
+        previous = self._flow_packets.get(dpid, {})
+        counts = {}
+        now = time.time()
+        for stat in stats:
+            key = match_key(stat.match)
+            counts[key] = stat.packet_count
+            if stat.match.dl_src is not None and stat.packet_count > previous.get(key, 0):
+                self.directory.touch(to_int(stat.match.dl_src), now)
+        self._flow_packets[dpid] = counts
+
+    def _age_hosts(self):
+        """
+        Remove the hosts not seen for a while and their flows. The hosts are seen through their PacketIns and the
+        statistics of their flows, requested here if the elephant detector does not poll them already.
+        """
+        for mac, dpid, port in self.directory.age():
+            log.debug("Host {} on switch #{}:{} expired".format(to_eth(mac), dpid, port))
+            self._invalidate_host(mac)
+
+        if self.elephants is None:
+            for switch_controller in self.switch_controllers.values():
+                if isinstance(switch_controller, AdaptiveEdgeSwitchController):
+                    switch_controller.connection.send(of.ofp_stats_request(body=of.ofp_flow_stats_request()))
+
+    def _invalidate_host(self, mac):
+        """
+        Remove the flows and the learned ports leading to a host, so that they are computed again.
+        """
+        # The matches, and the failover keys built from them, hold EthAddr objects
+        eth = to_eth(mac)
+        msg = of.ofp_flow_mod(command=of.OFPFC_DELETE)
+        msg.match.dl_dst = eth
+        for switch_controller in self.switch_controllers.values():
+            switch_controller.connection.send(msg)
+            if isinstance(switch_controller, AdaptiveCoreSwitchController):
+                switch_controller.mac_to_port.pop(mac, None)
+        self.failover.forget_where(lambda key: key[1] == eth)
+
+    def enable_dampening(self, half_life):
+        """
+        Hold the links which flap until they settle, so that the new flows are not steered onto them.
+
+        Parameters:
+        -----------
+        half_life: float
+            Delay in seconds for the flap penalty of a link to decay by half, see LinkDampener.
+        """
+        self.dampener = LinkDampener(self._handle_LinkEvent, half_life)
+
+    def enable_capacity(self, max_entries=None, interval=5):
+        """
+        Manage the flow tables of the switches connecting from now on: the coldest flows are evicted before the tables
+        are full, and coarser rules are installed under pressure, see CapacityManager.
+
+        Parameters:
+        -----------
+        max_entries: int
+            Capacity of the flow tables, None to use the one reported by the switches.
+        interval: float
+            Delay in seconds between two polls of the table and flow statistics.
+        """
+        self.capacity = CapacityManager(interval, max_entries=max_entries, on_evicted=self._flow_evicted)
+
+    def _flow_evicted(self, dpid, match):
+        """
+        Forget a flow evicted by the capacity manager. Its failover decision would otherwise install it again on the
+        next link failure, a modify without matching flow being an add in OpenFlow 1.0.
+        """
+        key = match_key(match)
+        switch_controller = self.switch_controllers.get(dpid)
+        if switch_controller is not None:
+            switch_controller.fine_flows.discard(key)
+        self.failover.forget(dpid, key)
+
+    def enable_dedup(self, window):
+        """
+        Sends the broadcasts of the hosts to the hosts of every edge switch connecting from now on, instead of going
+        through a core switch, and drops their echoes, see FloodDedup. All the edge switches must be handled by this
+        controller.
+
+        Parameters:
+        -----------
+        window: float
+            Delay in seconds during which a broadcast reaching the controller again is an echo.
         """
-        # Update host tracking
-        dpid = event.entry.dpid
-        if dpid not in self.edge_hosts:
-            self.edge_hosts[dpid] = set()
-        self.edge_hosts[dpid].add(event.entry.macaddr)
+        self.dedup = FloodDedup(None, window)
 
-        # Update host port
-        if dpid not in self.edge_host_ports:
-            self.edge_host_ports[dpid] = {}
-        self.edge_host_ports[dpid][event.entry.macaddr] = event.entry.port
+    def enable_tracing(self, path, sample=1):
+        """
+        Traces the flow setup latency of the switch controllers created from now on, see tracing.py.
+
+        Parameters:
+        -----------
+        path: str
+            File the histograms are dumped to when POX goes down.
+        sample: int
+            Only one PacketIn out of sample is traced.
+        """
+        self.tracer = FlowTracer('adaptive', path, sample)
 
+    def enable_sharding(self, count, index, path=None):
+        """
+        Run the controller as one shard of a sharded deployment: only the switches of this shard are handled, the
+        links, hosts and link loads are shared with the other shards. The channel is created at path, None for the
+        default one (see shard.socket_path()).
+        """
+        self.shard_count = count
+        self.shard_index = index
+        self.channel = ShardChannel(path, index == 0, core.callLater)
+        self.channel.subscribe('link', self._handle_shared_link)
+        self.channel.subscribe('host', lambda host: self._add_host(*host))
+        self.channel.subscribe('loads', self._handle_shared_loads)
+
+    def _handle_shared_link(self, link):
+        """
+        Handle a link seen by another shard.
+        """
+        event = RestoredLinkEvent(*link)
+        event.remote = True
+        self._handle_LinkEvent(event)
 
-def launch(core_ids, interval):
+    def _handle_shared_loads(self, loads):
+        """
+        Update the link loads measured by another shard.
+        """
+        for edge, load, total, core_port, directed in loads:
+            if self.edge_links.get(edge) is not None:
+                self.edge_links[edge] = load
+                self.prev_edge_links[edge] = total
+            if directed is not None and core_port in self.directed_loads:
+                self.directed_loads[core_port] = directed
+
+    def enable_warm_start(self, path, interval, grace):
+        """
+        Restore the state saved in a snapshot file and start saving the state periodically. The restored links and
+        hosts are provisional: the ones not confirmed by openflow.discovery or host_tracker within the grace period
+        are removed.
+        """
+        self.warm_start = WarmStart(path, interval, self._dump_state)
+
+        for kind, fields in self.warm_start.load():
+            if kind == LINK:
+                event = RestoredLinkEvent(fields[0], fields[1], fields[2], fields[3], True)
+                self._handle_LinkEvent(event)
+                self._provisional_links.add(event.link.key())
+            elif kind == LOAD:
+                self.edge_links[(fields[0], fields[1])] = fields[2]
+                self.prev_edge_links[(fields[0], fields[1])] = fields[3]
+            elif kind == HOST:
+                self.directory.learn(fields[1], fields[0], fields[2])
+                self._provisional_hosts.add((fields[0], fields[1]))
+            elif kind == MAC:
+                self._restored_macs.setdefault(fields[0], {})[fields[1]] = fields[2]
+
+        Timer(grace, self._expire_provisional)
+
+    def _dump_state(self):
+        """
+        Return the records describing the links, their load, the hosts and the learned MAC addresses.
+        """
+        for core_port, edge in self.core_to_edge.items():
+            if edge is not None:
+                yield LINK, (core_port[0], core_port[1], edge[0], edge[1])
+        for edge, load in self.edge_links.items():
+            if load is not None and self.prev_edge_links.get(edge) is not None:
+                yield LOAD, (edge[0], edge[1], load, self.prev_edge_links[edge])
+        for mac, location in self.directory.locations.items():
+            yield HOST, (location[0], mac, location[1])
+        for dpid, switch_controller in self.switch_controllers.items():
+            if isinstance(switch_controller, AdaptiveCoreSwitchController):
+                for mac, port in switch_controller.mac_to_port.items():
+                    yield MAC, (dpid, mac, port)
+
+    def _expire_provisional(self):
+        """
+        Remove the restored links and hosts that have not been confirmed. The links between switches of different shards
+        are kept: the LLDP packets are only matched by the shard of the switch that sent them.
+        """
+        for key in list(self._provisional_links):
+            if owner(key[0], self.shard_count) != owner(key[2], self.shard_count):
+                continue
+            log.info("Restored link {} not confirmed, removed".format(key))
+            self._handle_LinkEvent(RestoredLinkEvent(key[0], key[1], key[2], key[3], False))
+        self._provisional_links.clear()
+
+        for dpid, mac in self._provisional_hosts:
+            log.info("Restored host {} on switch #{} not confirmed, removed".format(to_eth(mac), dpid))
+            location = self.directory.locate(mac)
+            if location is not None and location[0] == dpid:
+                self.directory.remove(mac)
+        self._provisional_hosts.clear()
+        self._restored_macs = {}
+
+
+def launch(core_ids, interval, warm_start=None, warm_start_interval=10, warm_start_grace=30, shards=None, shard_index=0,
+           shard_socket=None, host_max_age=600, elephant_threshold=None, granularity="l2",
+           fine_budget=1000, admission_rate=None, trace=None, trace_sample=1, dampening_half_life=None,
+           table_capacity=None, capacity_interval=5, dedup_window=0):
     """
     Launch the adaptive routing component.
     """
@@ -251,5 +917,24 @@ def launch(core_ids, interval):
     print("Arguments: core_ids={} interval={}".format(core_ids, interval))
     
     # Register controller
-    controller = AdaptiveController(core_ids, interval)
+    if granularity not in ('l2', 'l4'):
+        raise ValueError('The match granularity must be l2 or l4. (e.g. --granularity=l4)')
+    controller = AdaptiveController(core_ids, interval, float(host_max_age),
+                                    float(elephant_threshold) if elephant_threshold else None, granularity,
+                                    int(fine_budget), float(admission_rate) if admission_rate else None)
+    if dampening_half_life and float(dampening_half_life) > 0:
+        controller.enable_dampening(float(dampening_half_life))
+    if trace:
+        controller.enable_tracing(trace, int(trace_sample))
+    if table_capacity:
+        # 'auto' uses the capacity reported by the switches
+        controller.enable_capacity(None if table_capacity == 'auto' else int(table_capacity), float(capacity_interval))
+    if float(dedup_window) > 0:
+        if shards:
+            raise ValueError('The broadcasts can only be sent to every edge switch without shards. (e.g. --dedup_window=0)')
+        controller.enable_dedup(float(dedup_window))
+    if shards:
+        controller.enable_sharding(int(shards), int(shard_index), shard_socket)
+    if warm_start:
+        controller.enable_warm_start(warm_start, float(warm_start_interval), float(warm_start_grace))
     core.register(controller)
@@ -0,0 +1,226 @@
+import time
+from collections import deque
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.recoco import Timer
+from pox.lib.packet.ethernet import ethernet
+from misc.maccodec import to_int
+
+log = core.getLogger()
+
+# Priority classes of the PacketIns
+HIGH = 0    # ARP and packets to a known destination
+LOW = 1     # Everything else (mostly floods)
+
+
+class TokenBucket(object):
+    """
+    Token bucket refilled at a constant rate up to a maximum burst.
+    """
+
+    def __init__(self, rate, burst):
+        """
+        Initializes a full bucket.
+
+        Parameters:
+        -----------
+        rate: float
+            Number of tokens added per second.
+        burst: float
+            Maximum number of tokens.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = None
+
+    def refill(self, now):
+        """
+        Adds the tokens earned since the last refill.
+        """
+        if self.last is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def take(self, now, reserve=0):
+        """
+        Takes a token if more than reserve tokens are available.
+
+        Return:
+        -------
+            True if a token has been taken.
+        """
+        self.refill(now)
+        if self.tokens - 1 >= reserve:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class AdmissionControl(object):
+    """
+    Admission layer in front of the PacketIn handlers. Each switch has a token bucket: the high priority PacketIns can
+    use all the tokens while the low priority ones leave a reserve for them. The PacketIns without token wait in a
+    bounded queue per switch and class, and are handled when tokens are available again. A source sending too many
+    PacketIns from a host port of a switch gets a temporary drop flow on this port. The ports between switches carry the
+    flood copies of every source and are never blocked.
+    """
+
+    def __init__(self, rate=1000, burst=200, reserve=0.2, queue_size=500, source_rate=200, block_time=10,
+                 drain_interval=0.05, host_port=None):
+        """
+        Initializes the admission layer and starts draining the queues.
+
+        Parameters:
+        -----------
+        rate: float
+            PacketIns per second admitted for each switch.
+        burst: float
+            Maximum burst of PacketIns admitted for each switch.
+        reserve: float
+            Fraction of the burst kept for the high priority PacketIns.
+        queue_size: int
+            Maximum number of PacketIns waiting per switch and class, the next ones are dropped.
+        source_rate: float
+            PacketIns per second a source can send through a switch before being blocked.
+        block_time: int
+            Duration in seconds of the drop flow of a blocked source.
+        drain_interval: float
+            Delay in seconds between two attempts to handle the waiting PacketIns.
+        host_port: callable
+            Called with a dpid and a port, True if the port leads to hosts. The sources are only blocked on these ports,
+            None to never block them.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.reserve = reserve * burst
+        self.queue_size = queue_size
+        self.source_rate = source_rate
+        self.block_time = block_time
+        self.host_port = host_port
+
+        self._buckets = {}      # dpid -> TokenBucket
+        self._queues = {}       # dpid -> (high priority queue, low priority queue) of (event, handler)
+        self._sources = {}      # (dpid, MAC address as an int) -> TokenBucket
+        self._blocked = {}      # (dpid, MAC address as an int) -> end of the block
+
+        # Metrics
+        self.admitted = 0
+        self.deferred = 0
+        self.dropped = 0
+        self.blocked_sources = 0
+
+        self.timer = Timer(drain_interval, self._drain, recurring=True)
+
+    def admit(self, event, handler, known=False):
+        """
+        Decides if a PacketIn can be handled now.
+
+        Parameters:
+        -----------
+        event: Event
+            The PacketIn event.
+        handler: callable
+            The PacketIn handler, called later with the event if it has to wait.
+        known: bool
+            True if the destination of the packet is known by the switch controller.
+
+        Return:
+        -------
+            True if the handler can go on, False if the PacketIn has been queued or dropped.
+        """
+        if getattr(event, 'admitted', False):
+            return True
+
+        now = time.time()
+        dpid = event.connection.dpid
+        packet = event.parsed
+
+        # Blocked sources are dropped, abusive ones get blocked, on the host ports only
+        if self.host_port is not None and self.host_port(dpid, event.port):
+            source = (dpid, to_int(packet.src))
+            if source in self._blocked:
+                if self._blocked[source] > now:
+                    self.dropped += 1
+                    return False
+                del self._blocked[source]
+            if source not in self._sources:
+                self._sources[source] = TokenBucket(self.source_rate, self.source_rate)
+            if not self._sources[source].take(now):
+                self._block(event, now)
+                return False
+
+        priority = HIGH if known or packet.type == ethernet.ARP_TYPE else LOW
+        bucket = self._buckets.get(dpid)
+        if bucket is None:
+            bucket = self._buckets[dpid] = TokenBucket(self.rate, self.burst)
+
+        queues = self._queues.get(dpid)
+        waiting = queues is not None and (queues[HIGH] or (priority == LOW and queues[LOW]))
+        if not waiting and bucket.take(now, self.reserve if priority == LOW else 0):
+            self.admitted += 1
+            return True
+
+        # Wait for a token
+        if queues is None:
+            queues = self._queues[dpid] = (deque(), deque())
+        if len(queues[priority]) >= self.queue_size:
+            self.dropped += 1
+        else:
+            queues[priority].append((event, handler))
+            self.deferred += 1
+        return False
+
+    def queue_depth(self):
+        """
+        Return:
+        -------
+            The number of PacketIns waiting, for all switches.
+        """
+        return sum(len(q[HIGH]) + len(q[LOW]) for q in self._queues.values())
+
+    def stats(self):
+        """
+        Return:
+        -------
+            A dictionary with the counters of the admission layer.
+        """
+        return {'admitted': self.admitted, 'deferred': self.deferred, 'dropped': self.dropped,
+                'blocked_sources': self.blocked_sources, 'queue_depth': self.queue_depth()}
+
+    def _block(self, event, now):
+        """
+        Installs a temporary drop flow for the source of a PacketIn on its switch.
+        """
+        packet = event.parsed
+        self._blocked[(event.connection.dpid, to_int(packet.src))] = now + self.block_time
+        self.blocked_sources += 1
+        self.dropped += 1
+
+        # A flow without action drops the packets
+        msg = of.ofp_flow_mod()
+        msg.match.dl_src = packet.src
+        msg.match.in_port = event.port
+        msg.hard_timeout = self.block_time
+        msg.priority = of.OFP_DEFAULT_PRIORITY + 1
+        event.connection.send(msg)
+        log.warning("Switch #{} - source {} on port {} blocked for {} s".format(event.connection.dpid, packet.src,
+                                                                             event.port, self.block_time))
+
+    def _drain(self):
+        """
+        Handles the waiting PacketIns for which tokens are available, the high priority ones first.
+        """
+        now = time.time()
+        for dpid, queues in self._queues.items():
+            bucket = self._buckets[dpid]
+            for priority in (HIGH, LOW):
+                queue = queues[priority]
+                while queue and bucket.take(now, self.reserve if priority == LOW else 0):
+                    event, handler = queue.popleft()
+                    event.admitted = True
+                    self.admitted += 1
+                    handler(event)
+        # Forget the sources which have not been seen for a while
+        if len(self._sources) > 10000:
+            self._sources = dict((s, b) for s, b in self._sources.items() if b.last > now - 1)
@@ -0,0 +1,210 @@
+"""
+Traffic-matrix benchmark of the forwarding apps (tree.py, vlans.py, adaptive.py) on the emulated Clos of emulator.py.
+Each app is run against each traffic matrix in its own process, and the results are written as JSON with sorted keys,
+so that runs can be compared over time:
+
+    PYTHONPATH=.:ext:ext/misc python -m misc.benchmark --cores=4 --edges=16 --hosts=16 --output=benchmark.json
+
+Traffic matrices, as lists of (source host, destination host, UDP source port, UDP destination port, payload size,
+weight), the weight being the share of the packets of the flow:
+
+- uniform: all-to-all between random hosts.
+- incast: many senders to a few receivers.
+- hotspot: the hosts are split into tenants as in tenants.py (host i in tenant i % tenants), one tenant sends most of
+  the traffic, inside the tenant.
+- elephant_mice: a few large flows carry most of the bytes among many small ones.
+
+Each result gives the load in bytes per second of every direction of the links between the switches (keyed by
+"dpid1:port1-dpid2:port2") and its distribution, the controller messages and flow setups per flow, and the delivery
+of the packets.
+"""
+import argparse
+import json
+import multiprocessing
+import random
+import sys
+
+SCHEMA = 1
+APPS = ('tree', 'vlan', 'adaptive')
+
+
+def uniform(hosts, flows, rng):
+    """
+    Return:
+    -------
+        A traffic matrix of flows between random pairs of hosts.
+    """
+    matrix = []
+    for _ in range(flows):
+        src = rng.randrange(hosts)
+        dst = (src + rng.randrange(1, hosts)) % hosts
+        matrix.append((src, dst, rng.randrange(1024, 65536), 80, 64, 1))
+    return matrix
+
+
+def incast(hosts, flows, rng, receivers=None):
+    """
+    Return:
+    -------
+        A traffic matrix where every flow goes to one of a few receivers (one per 64 hosts by default).
+    """
+    receivers = receivers or max(1, hosts // 64)
+    targets = rng.sample(range(hosts), receivers)
+    matrix = []
+    for _ in range(flows):
+        dst = rng.choice(targets)
+        src = (dst + rng.randrange(1, hosts)) % hosts
+        matrix.append((src, dst, rng.randrange(1024, 65536), 5001, 512, 1))
+    return matrix
+
+
+def hotspot(hosts, flows, rng, tenants=4, share=0.8):
+    """
+    Return:
+    -------
+        A traffic matrix of flows inside the tenants, the tenant 0 sending a share of the packets.
+    """
+    members = [list(range(t, hosts, tenants)) for t in range(tenants)]
+    members = [m for m in members if len(m) > 1]
+    hot = int(flows * share)
+    matrix = []
+    for i in range(flows):
+        group = members[0] if i < hot else rng.choice(members[1:] or members)
+        src, dst = rng.sample(group, 2)
+        matrix.append((src, dst, rng.randrange(1024, 65536), 80, 256, 1))
+    return matrix
+
+
+def elephant_mice(hosts, flows, rng, elephants=0.05, weight=20):
+    """
+    Return:
+    -------
+        A traffic matrix where a fraction of the flows are elephants, sending weight times more large packets than
+        the mice.
+    """
+    matrix = []
+    for i in range(flows):
+        src = rng.randrange(hosts)
+        dst = (src + rng.randrange(1, hosts)) % hosts
+        if i < flows * elephants:
+            matrix.append((src, dst, rng.randrange(1024, 65536), 5001, 1400, weight))
+        else:
+            matrix.append((src, dst, rng.randrange(1024, 65536), 80, 64, 1))
+    return matrix
+
+
+MATRICES = {'uniform': uniform, 'incast': incast, 'hotspot': hotspot, 'elephant_mice': elephant_mice}
+
+
+def distribution(values):
+    """
+    Return:
+    -------
+        The mean, min, percentiles and max of a list of values, and Jain's fairness index.
+    """
+    values = sorted(values) or [0.0]
+    count = len(values)
+
+    def percentile(p):
+        return values[min(count - 1, int(p / 100.0 * count))]
+
+    total = sum(values)
+    squares = sum(v * v for v in values)
+    return {'mean': total / count, 'min': values[0], 'p50': percentile(50), 'p90': percentile(90),
+            'p99': percentile(99), 'max': values[-1], 'fairness': total * total / (count * squares) if squares else 1.0}
+
+
+def _run_case(app, matrix, args, results):
+    """
+    Runs an app against a traffic matrix, in a process of its own, and puts its results in the queue.
+    """
+    from misc.emulator import Emulator, create_controller
+
+    rng = random.Random(args.seed)
+    hosts = args.edges * args.hosts
+    traffic = MATRICES[matrix](hosts, args.flows, rng)
+
+    emulator = Emulator(args.cores, args.edges, args.hosts, args.table_size)
+    create_controller(app, emulator.core_ids, args.interval)
+    metrics = emulator.run(args.duration, args.rate, traffic, args.seed)
+
+    loads = emulator.link_loads()
+    messages = metrics['packet_ins'] + metrics['packet_outs'] + metrics['flow_mods']
+    flows = max(1, metrics['flows'])
+    results.put({
+        'app': app,
+        'matrix': matrix,
+        'link_load': distribution(list(loads.values())),
+        'link_loads': dict(("{}:{}-{}:{}".format(*link), load) for link, load in loads.items()),
+        'max_link_load': max(loads.values()) if loads else 0.0,
+        'controller_messages': messages,
+        'controller_messages_per_flow': messages / float(flows),
+        'flow_setups': metrics['flow_mods'],
+        'flow_setups_per_flow': metrics['flow_mods'] / float(flows),
+        'packet_ins': metrics['packet_ins'],
+        'sent': metrics['sent'],
+        'delivered': metrics['delivered'],
+        'delivery_ratio': metrics['delivered'] / float(max(1, metrics['sent'])),
+        'looped': metrics['looped'],
+        'controller_cpu': metrics['controller_cpu'],
+        'flows_max': metrics['flows_max'],
+    })
+
+
+def benchmark(args):
+    """
+    Runs every app against every traffic matrix.
+
+    Return:
+    -------
+        The results, as written by main().
+    """
+    try:
+        # The POX event loop of a parent process does not survive a fork
+        context = multiprocessing.get_context('spawn')
+    except AttributeError:
+        context = multiprocessing
+
+    results = []
+    for matrix in args.matrices:
+        for app in args.apps:
+            queue = context.Queue()
+            process = context.Process(target=_run_case, args=(app, matrix, args, queue))
+            process.start()
+            result = queue.get()
+            process.join()
+            results.append(result)
+            sys.stderr.write("{} / {}: max link load {:.0f} B/s, {:.2f} messages per flow\n".format(
+                matrix, app, result['max_link_load'], result['controller_messages_per_flow']))
+
+    fabric = {'cores': args.cores, 'edges': args.edges, 'hosts_per_edge': args.hosts, 'table_size': args.table_size}
+    run = {'duration': args.duration, 'rate': args.rate, 'flows': args.flows, 'seed': args.seed}
+    return {'schema': SCHEMA, 'fabric': fabric, 'run': run, 'results': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the forwarding apps on traffic matrices.")
+    parser.add_argument('--apps', nargs='+', default=list(APPS), choices=APPS)
+    parser.add_argument('--matrices', nargs='+', default=sorted(MATRICES), choices=sorted(MATRICES))
+    parser.add_argument('--cores', type=int, default=4)
+    parser.add_argument('--edges', type=int, default=16)
+    parser.add_argument('--hosts', type=int, default=16, help="hosts per edge switch")
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--rate', type=float, default=2000, help="packets per second")
+    parser.add_argument('--flows', type=int, default=2000)
+    parser.add_argument('--interval', type=float, default=1.0, help="statistics interval of adaptive.py")
+    parser.add_argument('--table_size', type=int, default=4096)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="JSON file of the results, standard output by default")
+    args = parser.parse_args()
+
+    output = json.dumps(benchmark(args), indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+from collections import deque
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.recoco import Timer
+
+log = core.getLogger()
+
+# Flow statistics requests of the manager remembered per switch, the replies to older ones are not recognized
+MAX_REQUESTS = 4
+
+
+class CapacityManager(object):
+    """
+    Keeps the flow tables of the switches below their capacity. The occupancy of a switch is polled with its table
+    statistics, and estimated between two polls from the flows installed by the switch controllers. When a table goes
+    above the high watermark:
+
+    - its coldest flows, ranked by the packets they matched since the previous poll, are evicted down to the low
+      watermark,
+    - the switch is under pressure until its table goes back below the low watermark: the switch controllers install
+      coarser rules, aggregating the flows of all the sources of a destination (see reserve()).
+
+    Only the flows of the default priority, the reactive flows of the apps, are evicted. The evictions are reported to
+    a callback, as the flows of the apps do not all ask for a FlowRemoved.
+    """
+
+    def __init__(self, interval=5, high=0.9, low=0.75, max_entries=None, min_age=None, on_evicted=None):
+        """
+        Initializes the manager and starts polling the switches.
+
+        Parameters:
+        -----------
+        interval: float
+            Delay in seconds between two polls of the table and flow statistics.
+        high: float
+            Occupancy above which the coldest flows are evicted and the switch is under pressure.
+        low: float
+            Occupancy the evictions go down to, and below which the pressure ends.
+        max_entries: int
+            Capacity of the flow tables, None to use the one reported by the switches. The smallest of both is used.
+        min_age: float
+            Flows younger than this delay in seconds are not evicted, one interval by default.
+        on_evicted: callable
+            Called with the dpid and the match of each evicted flow, e.g. to forget its failover decision. None to
+            only evict.
+        """
+        self.interval = interval
+        self.high = high
+        self.low = low
+        self.max_entries = max_entries
+        self.min_age = interval if min_age is None else min_age
+        self.on_evicted = on_evicted
+
+        self._connections = {}  # dpid -> Connection
+        self._capacity = {}     # dpid -> maximum number of flows
+        self._active = {}       # dpid -> number of flows at the last poll
+        self._installed = {}    # dpid -> flows installed since the last poll
+        self._counts = {}       # dpid -> {packed match and priority: packet count at the last poll}
+        self._requests = {}     # dpid -> xids of the last flow statistics requests of the manager
+        self._pressure = set()  # dpids of the switches under pressure
+
+        # Metrics
+        self.evicted = 0
+        self.coarse_rules = 0
+        self.table_full = 0     # Flows refused by a full table
+        self.pressure_episodes = 0
+
+        core.openflow.addListenerByName("ConnectionDown", self._handle_ConnectionDown)
+        core.openflow.addListenerByName("TableStatsReceived", self._handle_TableStatsReceived)
+        core.openflow.addListenerByName("FlowStatsReceived", self._handle_FlowStatsReceived)
+        core.openflow.addListenerByName("ErrorIn", self._handle_ErrorIn)
+        self.timer = Timer(interval, self._poll_all, recurring=True)
+
+    def watch(self, connection):
+        """
+        Starts managing the flow table of a switch.
+        """
+        self._connections[connection.dpid] = connection
+        self._installed[connection.dpid] = 0
+        self._poll(connection)
+
+    def reserve(self, dpid):
+        """
+        Accounts for a flow about to be installed on a switch.
+
+        Return:
+        -------
+            True if the switch is under pressure: the flow should then be a coarse rule.
+        """
+        installed = self._installed.get(dpid, 0) + 1
+        self._installed[dpid] = installed
+
+        if dpid not in self._pressure:
+            capacity = self._capacity.get(dpid)
+            if capacity is None or self._active.get(dpid, 0) + installed < self.high * capacity:
+                return False
+            # Evict before the next poll, the coarse rules start with the next flow
+            self._enter_pressure(dpid)
+            if dpid in self._connections:
+                self._poll(self._connections[dpid])
+            return False
+
+        self.coarse_rules += 1
+        return True
+
+    def requested(self, event):
+        """
+        Return:
+        -------
+            True if a FlowStatsReceived event answers a request of the manager, so that the other listeners can ignore
+            it.
+        """
+        return bool(event.ofp) and event.ofp[0].xid in self._requests.get(event.connection.dpid, ())
+
+    def occupancy(self, dpid):
+        """
+        Return:
+        -------
+            The estimated fraction of the flow table of a switch in use, None if its capacity is not known yet.
+        """
+        capacity = self._capacity.get(dpid)
+        if not capacity:
+            return None
+        return (self._active.get(dpid, 0) + self._installed.get(dpid, 0)) / float(capacity)
+
+    def stats(self):
+        """
+        Return:
+        -------
+            A dictionary with the metrics of the manager and the occupancy of every switch.
+        """
+        occupancy = dict((dpid, self.occupancy(dpid)) for dpid in self._connections)
+        return {'evicted': self.evicted, 'coarse_rules': self.coarse_rules, 'table_full': self.table_full,
+                'pressure_episodes': self.pressure_episodes, 'under_pressure': sorted(self._pressure),
+                'occupancy': occupancy}
+
+    def _poll_all(self):
+        for connection in list(self._connections.values()):
+            self._poll(connection)
+
+    def _poll(self, connection):
+        """
+        Requests the table and flow statistics of a switch.
+        """
+        connection.send(of.ofp_stats_request(body=of.ofp_table_stats_request()))
+        request = of.ofp_stats_request(body=of.ofp_flow_stats_request())
+        requests = self._requests.get(connection.dpid)
+        if requests is None:
+            # The requests never answered are forgotten
+            requests = self._requests[connection.dpid] = deque(maxlen=MAX_REQUESTS)
+        requests.append(request.xid)
+        connection.send(request)
+
+    def _enter_pressure(self, dpid):
+        self._pressure.add(dpid)
+        self.pressure_episodes += 1
+        log.info("Switch #{} - flow table at {:.0%}, installing coarse rules".format(dpid, self.occupancy(dpid) or 1))
+
+    def _update(self, dpid, active):
+        """
+        Records the number of flows of a switch and ends its pressure if the table has room again.
+        """
+        self._active[dpid] = active
+        self._installed[dpid] = 0
+        if dpid in self._pressure and self.occupancy(dpid) is not None and self.occupancy(dpid) < self.low:
+            self._pressure.discard(dpid)
+            log.info("Switch #{} - flow table at {:.0%}, back to fine rules".format(dpid, self.occupancy(dpid)))
+
+    def _handle_ConnectionDown(self, event):
+        dpid = event.connection.dpid
+        for state in (self._connections, self._capacity, self._active, self._installed, self._counts, self._requests):
+            state.pop(dpid, None)
+        self._pressure.discard(dpid)
+
+    def _handle_TableStatsReceived(self, event):
+        """
+        Updates the capacity and the occupancy of a switch.
+        """
+        dpid = event.connection.dpid
+        if dpid not in self._connections or not event.stats:
+            return
+
+        capacity = sum(table.max_entries for table in event.stats)
+        if self.max_entries is not None:
+            capacity = min(capacity, self.max_entries) if capacity else self.max_entries
+        self._capacity[dpid] = capacity
+        self._update(dpid, sum(table.active_count for table in event.stats))
+
+    def _handle_FlowStatsReceived(self, event):
+        """
+        Ranks the flows of a switch by the packets they matched since the previous poll, and evicts the coldest ones
+        if the table is above the high watermark.
+        """
+        if not self.requested(event):
+            return
+        dpid = event.connection.dpid
+        self._requests[dpid].remove(event.ofp[0].xid)
+        if dpid not in self._connections:
+            return
+
+        previous = self._counts.get(dpid, {})
+        counts = {}
+        candidates = []
+        for stat in event.stats:
+            key = (stat.match.pack(), stat.priority)
+            counts[key] = stat.packet_count
+            if stat.priority == of.OFP_DEFAULT_PRIORITY and stat.duration_sec >= self.min_age:
+                candidates.append((stat.packet_count - previous.get(key, 0), stat))
+        self._counts[dpid] = counts
+        self._update(dpid, len(event.stats))
+
+        capacity = self._capacity.get(dpid)
+        if capacity is None or len(event.stats) < self.high * capacity:
+            return
+        if dpid not in self._pressure:
+            self._enter_pressure(dpid)
+
+        # Evict the coldest flows down to the low watermark
+        count = len(event.stats) - int(self.low * capacity)
+        candidates.sort(key=lambda c: c[0])
+        for recent, stat in candidates[:count]:
+            msg = of.ofp_flow_mod(command=of.OFPFC_DELETE_STRICT)
+            msg.match = stat.match
+            msg.priority = stat.priority
+            event.connection.send(msg)
+            counts.pop((stat.match.pack(), stat.priority), None)
+            if self.on_evicted is not None:
+                self.on_evicted(dpid, stat.match)
+        evicted = min(count, len(candidates))
+        self.evicted += evicted
+        self._active[dpid] -= evicted
+        log.info("Switch #{} - {} cold flows evicted, {} flows left".format(dpid, evicted, self._active[dpid]))
+
+    def _handle_ErrorIn(self, event):
+        """
+        A flow refused by a full table puts the switch under pressure at once.
+        """
+        error = event.ofp
+        if error.type != of.OFPET_FLOW_MOD_FAILED or error.code != of.OFPFMFC_ALL_TABLES_FULL:
+            return
+        dpid = event.connection.dpid
+        if dpid not in self._connections:
+            return
+
+        self.table_full += 1
+        if dpid not in self._pressure:
+            self._enter_pressure(dpid)
+            self._poll(event.connection)
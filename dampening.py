@@ -0,0 +1,152 @@
+import time
+from pox.core import core
+from pox.lib.recoco import Timer
+from misc.warmstart import link_key
+
+log = core.getLogger()
+
+
+class LinkDampener(object):
+    """
+    Dampening of the flapping links, between openflow.discovery and the LinkEvent handler of a controller, in the
+    manner of the BGP route flap dampening. Every time a link goes down it gets a penalty, which decays exponentially.
+    The link going down is always reported at once, but a link coming back up while its penalty is above the suppress
+    threshold is held until the penalty has decayed below the reuse threshold. A link going down again while held is
+    not reported at all, as the controller still sees it down.
+
+    openflow.discovery reports each direction of a link: both directions share the penalty of the link, and each of
+    them adds half of it.
+    """
+
+    def __init__(self, handler, half_life=15, penalty=1000, suppress=2000, reuse=750, max_suppress=60,
+                 check_interval=1):
+        """
+        Initializes the dampener.
+
+        Parameters:
+        -----------
+        handler: callable
+            LinkEvent handler of the controller, called with the events which are let through.
+        half_life: float
+            Delay in seconds for a penalty to decay by half.
+        penalty: float
+            Penalty added each time a link goes down.
+        suppress: float
+            A link coming up with a penalty above this threshold is held.
+        reuse: float
+            A held link is reported up once its penalty is below this threshold.
+        max_suppress: float
+            Maximum delay in seconds a link can be held, which bounds the penalty.
+        check_interval: float
+            Delay in seconds between two checks of the held links.
+        """
+        self.handler = handler
+        self.half_life = half_life
+        self.penalty = penalty
+        self.suppress = suppress
+        self.reuse = reuse
+        self.max_penalty = reuse * 2 ** (float(max_suppress) / half_life)
+
+        self._penalties = {}    # Link key -> [penalty, time of the last update]
+        self._held = {}         # (dpid1, port1, dpid2, port2) of a direction -> LinkEvent held
+        self._reported = set()  # Directions reported up to the controller
+
+        # Metrics
+        self.held = 0           # Link ups held
+        self.released = 0       # Link ups reported after being held
+        self.avoided = 0        # Events never reported to the controller
+
+        self.timer = Timer(check_interval, self._release, recurring=True)
+
+    def handle(self, event):
+        """
+        Handles a LinkEvent of openflow.discovery.
+        """
+        link = event.link
+        direction = (link.dpid1, link.port1, link.dpid2, link.port2)
+        key = link_key(link)
+        now = time.time()
+
+        if event.removed:
+            self._add_penalty(key, now)
+            if self._held.pop(direction, None) is not None:
+                # The controller has not seen the link up, neither the up nor the down are reported
+                self.avoided += 2
+                return
+            self._reported.discard(direction)
+            self.handler(event)
+            return
+
+        if direction in self._held:
+            self._held[direction] = event
+            return
+        if direction in self._reported:
+            # Already up
+            self.handler(event)
+            return
+        penalty = self._current(key, now)
+        if penalty > self.suppress:
+            if (direction[2], direction[3], direction[0], direction[1]) not in self._held:
+                log.info("Link {} flapping (penalty {:.0f}), held until it settles".format(key, penalty))
+            self._held[direction] = event
+            self.held += 1
+            return
+        self._reported.add(direction)
+        self.handler(event)
+
+    def suppressed(self):
+        """
+        Return:
+        -------
+            The list of (link key, current penalty) of the links held down.
+        """
+        now = time.time()
+        keys = set(link_key(event.link) for event in self._held.values())
+        return sorted((key, self._current(key, now)) for key in keys)
+
+    def stats(self):
+        """
+        Return:
+        -------
+            A dictionary with the metrics of the dampener.
+        """
+        return {'held': self.held, 'released': self.released, 'avoided': self.avoided,
+                'suppressed': len(self.suppressed())}
+
+    def _current(self, key, now):
+        """
+        Return:
+        -------
+            The penalty of a link decayed up to now.
+        """
+        entry = self._penalties.get(key)
+        if entry is None:
+            return 0.0
+        entry[0] *= 0.5 ** ((now - entry[1]) / self.half_life)
+        entry[1] = now
+        return entry[0]
+
+    def _add_penalty(self, key, now):
+        """
+        Adds the penalty of a link going down, half for each direction.
+        """
+        penalty = min(self._current(key, now) + self.penalty / 2.0, self.max_penalty)
+        self._penalties[key] = [penalty, now]
+
+    def _release(self):
+        """
+        Reports the held links whose penalty has decayed below the reuse threshold, and forgets the penalties which
+        have become negligible.
+        """
+        now = time.time()
+        for direction, event in list(self._held.items()):
+            key = link_key(event.link)
+            if self._current(key, now) < self.reuse:
+                del self._held[direction]
+                self._reported.add(direction)
+                self.released += 1
+                log.info("Link {} stable again, reported up".format(key))
+                self.handler(event)
+
+        for key in [k for k in self._penalties if self._current(k, now) < 1]:
+            del self._penalties[key]
@@ -0,0 +1,235 @@
+import time
+from collections import OrderedDict, deque
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+
+log = core.getLogger()
+
+
+class FloodDedup(object):
+    """
+    Fabric-wide handling of the floods. Flooding hop by hop makes every switch of the tree send the flooded packet to
+    the controller again. Instead, the first PacketIn of a flood, at the ingress switch, is handled once for the whole
+    fabric with a flood plan: one packet_out per switch of the tree sends the packet on its host ports, and the
+    switches learn the port of the source towards the ingress switch. The packet never crosses the fabric links, and
+    the echoes still reaching the controller within a short window (e.g. packets already in flight) are recognized by
+    a digest of the packet and the tree, and dropped.
+
+    The switch controllers registered must have a connection, a tracer, a mac_to_port mapping (to learn the sources)
+    and a tree_ports(tree) method returning the ports a packet of the tree is flooded on (the non-blocked ports), None
+    if the tree is not applied on the switch yet.
+    """
+
+    def __init__(self, topology=None, window=0.5, max_entries=100000):
+        """
+        Initializes the cache.
+
+        Parameters:
+        -----------
+        topology: graph.Topology
+            Topology of the fabric, to find the switches of a tree and the fabric ports. None if the switches
+            registered only give their host ports, and are not linked by any tree.
+        window: float
+            Delay in seconds during which a flooded packet reaching the controller again is an echo.
+        max_entries: int
+            Maximum number of flooded packets remembered.
+        """
+        self.topology = topology
+        self.window = window
+        self.max_entries = max_entries
+
+        self.switches = {}          # dpid -> switch controller
+        self._seen = OrderedDict()  # (digest, tree) -> time the packet was flooded
+        self._plans = {}            # (tree, ingress dpid) -> list of (switch controller, port to the parent, host ports)
+        self._peers = {}            # (dpid, port) -> (dpid, port) of the other end of a fabric link
+        self._version = 0
+        self._plans_version = None
+
+        # Metrics
+        self.floods = 0             # Floods handled with a plan
+        self.suppressed = 0         # Echoes dropped
+        self.fallbacks = 0          # Floods left to the switch controller (no complete plan)
+        self.plans_compiled = 0
+
+    def register(self, switch):
+        """
+        Adds the switch controller of a new connection.
+        """
+        self.switches[switch.connection.dpid] = switch
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Forgets the flood plans, to be called when the ports of a tree change on a switch.
+        """
+        self._version += 1
+
+    def duplicate(self, switch, packet_in, tree, from_fabric=None):
+        """
+        Parameters:
+        -----------
+        from_fabric: bool
+            True if the packet comes from a fabric port, None to find it from the topology (every port is a fabric
+            port without topology).
+
+        Return:
+        -------
+            True if a packet is the echo of a packet flooded in the same tree within the window, it should then be
+            dropped. Only the packets coming from a fabric port can be echoes: a host sending the same packet again
+            gets it flooded again, and its copies then crossing the fabric (e.g. to a destination learned meanwhile)
+            are not echoes.
+        """
+        if not self._seen:
+            return False
+        self._refresh()
+        if from_fabric is None:
+            from_fabric = self.topology is None or (switch.connection.dpid, packet_in.in_port) in self._peers
+        key = (hash(packet_in.data), tree)
+        if not from_fabric:
+            self._seen.pop(key, None)
+            return False
+        self._expire(time.time())
+        if key in self._seen:
+            self.suppressed += 1
+            return True
+        return False
+
+    def flood(self, switch, packet_in, tree, src=None):
+        """
+        Floods a packet in the whole fabric from its ingress switch.
+
+        Parameters:
+        -----------
+        switch: SwitchController
+            The switch controller of the ingress switch.
+        packet_in: ofp_packet_in
+            The PacketIn of the packet.
+        tree: hashable
+            The tree the packet is flooded in.
+        src: int
+            MAC address of the source, learned by the switches of the plan. None to learn nothing.
+
+        Return:
+        -------
+            True if the packet has been flooded, False if the switch controller must flood it itself (the packet does
+            not come from a host, or some switches of the tree are not connected to this controller).
+        """
+        plan = self._plan(switch.connection.dpid, tree)
+        # A packet coming from another switch has already reached the hosts behind the previous ones
+        if plan is None or (switch.connection.dpid, packet_in.in_port) in self._peers:
+            self.fallbacks += 1
+            log.debug("Flood plan of tree %s from switch #%s incomplete, flooding hop by hop", tree,
+                      switch.connection.dpid)
+            return False
+
+        data = packet_in.data
+        for other, parent_port, host_ports in plan:
+            msg = of.ofp_packet_out()
+            if other is switch:
+                # The switch may have buffered the packet
+                msg.data = packet_in
+                ports = [p for p in host_ports if p != packet_in.in_port]
+            else:
+                msg.data = data
+                ports = host_ports
+                if src is not None:
+                    other.mac_to_port[src] = parent_port
+            if not ports:
+                continue
+            for port in ports:
+                msg.actions.append(of.ofp_action_output(port=port))
+            other.connection.send(msg)
+        if switch.tracer is not None:
+            switch.tracer.packet_out(switch.connection)
+
+        now = time.time()
+        self._seen[(hash(data), tree)] = now
+        self._expire(now)
+        self.floods += 1
+        return True
+
+    def stats(self):
+        """
+        Return:
+        -------
+            A dictionary with the counters of the cache.
+        """
+        return {'floods': self.floods, 'suppressed': self.suppressed, 'fallbacks': self.fallbacks,
+                'plans_compiled': self.plans_compiled, 'cached': len(self._seen)}
+
+    def _expire(self, now):
+        """
+        Forgets the packets flooded before the window, and the oldest ones above the maximum number of entries.
+        """
+        seen = self._seen
+        limit = now - self.window
+        while seen:
+            key, flooded = next(iter(seen.items()))
+            if flooded > limit and len(seen) <= self.max_entries:
+                break
+            del seen[key]
+
+    def _refresh(self):
+        """
+        Forgets the plans and the fabric ports if the topology or the ports of a tree have changed.
+        """
+        version = (self._version, self.topology.generation if self.topology is not None else None)
+        if version == self._plans_version:
+            return
+        self._plans = {}
+        self._plans_version = version
+
+        self._peers = {}
+        if self.topology is not None:
+            for id1, id2, port1, port2 in self.topology.links():
+                self._peers[(id1, port1)] = (id2, port2)
+                self._peers[(id2, port2)] = (id1, port1)
+
+    def _plan(self, ingress, tree):
+        """
+        Return:
+        -------
+            The flood plan of a tree from an ingress switch, a list of (switch controller, port to the parent switch,
+            host ports), None if a switch of the tree is not registered or does not have the tree yet.
+        """
+        self._refresh()
+        key = (tree, ingress)
+        if key not in self._plans:
+            self._plans[key] = self._compile(ingress, tree)
+            self.plans_compiled += 1
+        return self._plans[key]
+
+    def _compile(self, ingress, tree):
+        """
+        Walks the tree from the ingress switch through the fabric ports open on both ends.
+        """
+        if self.topology is None:
+            plan = [(s, None, s.tree_ports(tree)) for s in self.switches.values()]
+            return None if any(ports is None for s, p, ports in plan) else plan
+
+        peers = self._peers
+        plan = []
+        visited = set([ingress])
+        queue = deque([(ingress, None)])
+        while queue:
+            dpid, parent_port = queue.popleft()
+            switch = self.switches.get(dpid)
+            if switch is None:
+                return None
+            open_ports = switch.tree_ports(tree)
+            if open_ports is None:
+                return None
+            host_ports = []
+            for port in open_ports:
+                peer = peers.get((dpid, port))
+                if peer is None:
+                    host_ports.append(port)
+                elif peer[0] not in visited:
+                    other = self.switches.get(peer[0])
+                    if other is None or other.tree_ports(tree) is None:
+                        return None
+                    if peer[1] in other.tree_ports(tree):
+                        visited.add(peer[0])
+                        queue.append((peer[0], peer[1]))
+            plan.append((switch, parent_port, tuple(host_ports)))
+        return plan
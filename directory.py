@@ -0,0 +1,133 @@
+import time
+
+
+class HostDirectory(object):
+    """
+    Directory of the hosts of the network, keyed by MAC address (a 48-bit int, see maccodec.py), with the edge switch
+    and the port each host is connected to. A reverse index gives the hosts of each edge switch.
+    """
+
+    def __init__(self, max_age=600, on_move=None):
+        """
+        Initializes the directory.
+
+        Parameters:
+        -----------
+        max_age: float
+            Delay in seconds after which a host not seen anymore is removed from the directory.
+        on_move: callable
+            Called with the MAC address, the previous and the new (dpid, port) of a host which has moved.
+        """
+        self.max_age = max_age
+        self.on_move = on_move
+        self.locations = {}     # MAC address -> [dpid, port, last seen]
+        self.edges = {}         # dpid -> {MAC address: port}
+
+        # Metrics
+        self.moves = 0
+        self.aged = 0
+
+    def learn(self, mac, dpid, port, now=None):
+        """
+        Records the location of a host.
+
+        Parameters:
+        -----------
+        mac: int
+            MAC address of the host
+        dpid: int
+            id of the edge switch the host is connected to
+        port: int
+            port of the edge switch the host is connected to
+        now: float
+            Time of the observation, the current time by default.
+
+        Return:
+        -------
+            The previous (dpid, port) of the host if it has moved, None otherwise.
+        """
+        now = time.time() if now is None else now
+
+        location = self.locations.get(mac)
+        if location is not None:
+            if location[0] == dpid and location[1] == port:
+                location[2] = now
+                return None
+            # The host has moved, evict its previous location
+            previous = (location[0], location[1])
+            self._unindex(mac, location[0])
+            self.moves += 1
+        else:
+            previous = None
+
+        self.locations[mac] = [dpid, port, now]
+        self.edges.setdefault(dpid, {})[mac] = port
+
+        if previous is not None and self.on_move is not None:
+            self.on_move(mac, previous, (dpid, port))
+        return previous
+
+    def touch(self, mac, now=None):
+        """
+        Refreshes the last time a host has been seen, without changing its location.
+        """
+        location = self.locations.get(mac)
+        if location is not None:
+            location[2] = time.time() if now is None else now
+
+    def locate(self, mac):
+        """
+        Return:
+        -------
+            The (dpid, port) the host is connected to, None if unknown.
+        """
+        location = self.locations.get(mac)
+        return (location[0], location[1]) if location is not None else None
+
+    def hosts(self, dpid):
+        """
+        Return:
+        -------
+            The mapping between the MAC address of the hosts connected to an edge switch and their port. It must not
+            be modified by the caller.
+        """
+        return self.edges.get(dpid, {})
+
+    def remove(self, mac):
+        """
+        Removes a host from the directory.
+
+        Return:
+        -------
+            The (dpid, port) the host was connected to, None if unknown.
+        """
+        location = self.locations.pop(mac, None)
+        if location is None:
+            return None
+        self._unindex(mac, location[0])
+        return (location[0], location[1])
+
+    def age(self, now=None):
+        """
+        Removes the hosts which have not been seen for more than max_age seconds.
+
+        Return:
+        -------
+            The list of (MAC address, dpid, port) removed.
+        """
+        limit = (time.time() if now is None else now) - self.max_age
+        expired = [(mac, location[0], location[1]) for mac, location in self.locations.items() if location[2] < limit]
+        for mac, dpid, port in expired:
+            self.remove(mac)
+        self.aged += len(expired)
+        return expired
+
+    def _unindex(self, mac, dpid):
+        """
+        Removes a host from the reverse index of an edge switch.
+        """
+        hosts = self.edges.get(dpid)
+        if hosts is not None:
+            hosts.pop(mac, None)
+            if not hosts:
+                del self.edges[dpid]
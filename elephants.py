@@ -0,0 +1,111 @@
+class ElephantDetector(object):
+    """
+    Measures the rate of the flows from their byte counters and decides which heavy flows (elephants) may be moved to
+    another path. A flow is only moved if the new path is clearly better (hysteresis), if it has not been moved
+    recently, and within a maximum number of moves per round.
+    """
+
+    def __init__(self, threshold, hysteresis=0.2, min_dwell=30, max_moves=4):
+        """
+        Initializes the detector.
+
+        Parameters:
+        -----------
+        threshold: float
+            Rate in bytes per second above which a flow is an elephant.
+        hysteresis: float
+            Minimum relative gain on the path load required to move a flow.
+        min_dwell: float
+            Minimum delay in seconds between two moves of the same flow.
+        max_moves: int
+            Maximum number of moves per round.
+        """
+        self.threshold = threshold
+        self.hysteresis = hysteresis
+        self.min_dwell = min_dwell
+        self.max_moves = max_moves
+
+        self._counters = {}     # dpid -> {flow key: (byte count, time)}
+        self._last_move = {}    # (dpid, flow key) -> time of the last move
+        self._round_moves = 0
+
+        # Metrics
+        self.moves = 0
+        self.suppressed = 0
+
+    def update(self, dpid, flows, now):
+        """
+        Updates the counters of the flows of a switch and starts a new round of moves.
+
+        Parameters:
+        -----------
+        dpid: int
+            id of the switch
+        flows: list of (hashable, int)
+            Key and byte count of every flow of the switch.
+        now: float
+            Time of the measure.
+
+        Return:
+        -------
+            The list of (flow key, rate in bytes per second) of the elephants, the heaviest first.
+        """
+        previous = self._counters.get(dpid, {})
+        counters = {}
+        elephants = []
+
+        for key, byte_count in flows:
+            counters[key] = (byte_count, now)
+            if key in previous and now > previous[key][1]:
+                rate = (byte_count - previous[key][0]) / float(now - previous[key][1])
+                if rate >= self.threshold:
+                    elephants.append((key, rate))
+
+        # Flows which are not reported anymore have expired
+        self._counters[dpid] = counters
+        for id in [id for id in self._last_move if id[0] == dpid and id[1] not in counters]:
+            del self._last_move[id]
+
+        self._round_moves = 0
+        return sorted(elephants, key=lambda e: -e[1])
+
+    def should_move(self, dpid, key, current_cost, new_cost, contribution, now):
+        """
+        Decides if an elephant should be moved to a new path.
+
+        Parameters:
+        -----------
+        dpid: int
+            id of the switch
+        key: hashable
+            Key of the flow
+        current_cost: float
+            Load of the bottleneck of the current path, the flow included.
+        new_cost: float
+            Load of the bottleneck of the new path, the flow excluded.
+        contribution: float
+            Load of the flow itself, in the same unit as the costs.
+        now: float
+            Current time.
+
+        Return:
+        -------
+            True if the flow should be moved.
+        """
+        if new_cost + contribution >= current_cost * (1 - self.hysteresis):
+            return False
+
+        if now - self._last_move.get((dpid, key), float('-inf')) < self.min_dwell or \
+                self._round_moves >= self.max_moves:
+            self.suppressed += 1
+            return False
+
+        return True
+
+    def moved(self, dpid, key, now):
+        """
+        Records the move of a flow.
+        """
+        self._last_move[(dpid, key)] = now
+        self._round_moves += 1
+        self.moves += 1
@@ -0,0 +1,967 @@
+"""
+In-process emulated Clos data plane, to load test the controllers without Mininet. Every switch is a pure-Python model
+keeping a flow table: it applies the flow_mods and packet_outs of the controller, expires its flows and sends PacketIn,
+FlowRemoved, BarrierIn and stats replies back through a stand-in of the POX connection. The emulator also stands in for
+openflow.discovery and host_tracker, and raises their LinkEvents and HostEvents from the known topology.
+
+The controllers run unchanged on the POX event loop. Run from the POX directory, with the misc package in ext:
+
+    PYTHONPATH=.:ext:ext/misc python -m misc.emulator --app=tree --cores=4 --edges=32 --hosts=32 --duration=30
+
+A single controller can be registered per process: run the apps in separate processes to compare them.
+"""
+import argparse
+import bisect
+import json
+import random
+import struct
+import threading
+import time
+from collections import deque
+
+import pox.core
+if pox.core.core is None:
+    # Run outside of pox.py: start the POX core before the modules below bind it
+    pox.core.initialize()
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.openflow import ConnectionUp, ConnectionDown, PacketIn, FlowRemoved, BarrierIn, ErrorIn, \
+    PortStatsReceived, FlowStatsReceived, TableStatsReceived
+from pox.openflow.discovery import LinkEvent, Link
+from pox.host_tracker.host_tracker import HostEvent, MacEntry
+from pox.lib.revent import EventMixin
+from pox.lib.recoco import Timer
+from pox.lib.addresses import EthAddr, IPAddr
+from pox.lib.packet.ethernet import ethernet
+from pox.lib.packet.ipv4 import ipv4
+from pox.lib.packet.udp import udp
+
+log = core.getLogger()
+
+try:
+    _cpu = time.process_time
+except AttributeError:
+    _cpu = time.clock
+
+# Fields of ofp_match, in the order of the match tuples
+MATCH_FIELDS = ('in_port', 'dl_src', 'dl_dst', 'dl_vlan', 'dl_vlan_pcp', 'dl_type', 'nw_tos', 'nw_proto', 'nw_src',
+                'nw_dst', 'tp_src', 'tp_dst')
+LOCAL_PORT = 65534
+MAX_HOPS = 32
+MAX_BUFFERS = 4096
+MAX_IN_FLIGHT = 100000
+
+
+def match_fields(match):
+    """
+    Return:
+    -------
+        The tuple of the fields of an ofp_match, None for the wildcarded ones.
+    """
+    return tuple(getattr(match, f) for f in MATCH_FIELDS)
+
+
+def covers(general, specific):
+    """
+    Return:
+    -------
+        True if every field set in the general match tuple has the same value in the specific one.
+    """
+    for g, s in zip(general, specific):
+        if g is not None and g != s:
+            return False
+    return True
+
+
+def host_mac(index):
+    """
+    Return:
+    -------
+        The MAC address of the host with the given index, starting at 00:00:00:00:00:01 like tenants.py.
+    """
+    return EthAddr(struct.pack('!Q', index + 1)[2:])
+
+
+def host_ip(index):
+    """
+    Return:
+    -------
+        The IP address of the host with the given index.
+    """
+    index += 1
+    return IPAddr("10.{}.{}.{}".format(index >> 16 & 255, index >> 8 & 255, index & 255))
+
+
+class FlowEntry(object):
+    """
+    Entry of an emulated flow table.
+    """
+    __slots__ = ('match', 'fields', 'priority', 'ports', 'idle_timeout', 'hard_timeout', 'flags', 'cookie', 'created',
+                 'used', 'packet_count', 'byte_count')
+
+    def __init__(self, msg, now):
+        self.match = msg.match
+        self.fields = match_fields(msg.match)
+        self.priority = msg.priority
+        self.ports = [a.port for a in msg.actions if isinstance(a, of.ofp_action_output)]
+        self.idle_timeout = msg.idle_timeout
+        self.hard_timeout = msg.hard_timeout
+        self.flags = msg.flags
+        self.cookie = msg.cookie
+        self.created = now
+        self.used = now
+        self.packet_count = 0
+        self.byte_count = 0
+
+    def expired(self, now):
+        """
+        Return:
+        -------
+            The OFPRR reason if the entry has timed out, None otherwise.
+        """
+        if self.hard_timeout and now - self.created >= self.hard_timeout:
+            return of.OFPRR_HARD_TIMEOUT
+        if self.idle_timeout and now - self.used >= self.idle_timeout:
+            return of.OFPRR_IDLE_TIMEOUT
+        return None
+
+
+class FlowTable(object):
+    """
+    Flow table of an emulated switch. The entries are indexed by destination MAC address, sorted by decreasing
+    priority, so that a lookup only goes through the entries which may match.
+    """
+
+    def __init__(self, size):
+        """
+        Parameters:
+        -----------
+        size: int
+            Maximum number of entries, None for no limit.
+        """
+        self.size = size
+        self.entries = []
+        self._index = {}    # dl_dst -> entries sorted by decreasing priority, None for the entries without dl_dst
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, fields):
+        """
+        Return:
+        -------
+            The entry of highest priority matching the fields of a packet, None on a table miss.
+        """
+        found = None
+        for bucket in (self._index.get(fields[2]), self._index.get(None)):
+            for entry in bucket or ():
+                if found is not None and entry.priority <= found.priority:
+                    break
+                if covers(entry.fields, fields):
+                    found = entry
+                    break
+        return found
+
+    def add(self, entry):
+        """
+        Adds an entry, replacing the one with the same match and priority.
+
+        Return:
+        -------
+            False if the table is full, True otherwise.
+        """
+        bucket = self._index.setdefault(entry.fields[2], [])
+        for i, other in enumerate(bucket):
+            if other.priority == entry.priority and other.fields == entry.fields:
+                bucket[i] = entry
+                self.entries[self.entries.index(other)] = entry
+                return True
+        if self.size is not None and len(self.entries) >= self.size:
+            if not bucket:
+                del self._index[entry.fields[2]]
+            return False
+        bucket.insert(bisect.bisect_right([-e.priority for e in bucket], -entry.priority), entry)
+        self.entries.append(entry)
+        return True
+
+    def select(self, fields, priority=None, out_port=of.OFPP_NONE):
+        """
+        Return:
+        -------
+            The entries covered by a match (with the same priority and match if priority is given, i.e. strict) and
+            sending to out_port (any port for OFPP_NONE).
+        """
+        return [e for e in self.entries
+                if (e.fields == fields and e.priority == priority if priority is not None else covers(fields, e.fields))
+                and (out_port == of.OFPP_NONE or out_port in e.ports)]
+
+    def remove(self, entries):
+        """
+        Removes entries from the table.
+        """
+        if not entries:
+            return
+        removed = set(id(e) for e in entries)
+        self.entries = [e for e in self.entries if id(e) not in removed]
+        for dst in set(e.fields[2] for e in entries):
+            bucket = [e for e in self._index.get(dst, ()) if id(e) not in removed]
+            if bucket:
+                self._index[dst] = bucket
+            else:
+                self._index.pop(dst, None)
+
+
+class EmulatedSwitch(object):
+    """
+    Model of an OpenFlow 1.0 switch: flow table, port counters and packet buffers.
+    """
+
+    def __init__(self, emulator, dpid, table_size):
+        self.emulator = emulator
+        self.dpid = dpid
+        self.table = FlowTable(table_size)
+        self.peers = {}         # Port -> ('switch', dpid, port) or ('host', index)
+        self.down = set()       # Ports whose link is down
+        self.counters = {}      # Port -> [rx packets, tx packets, rx bytes, tx bytes]
+        self.connection = None
+
+        self._buffers = {}
+        self._buffer_ids = deque()
+        self._next_buffer = 0
+
+    def add_port(self, port, peer):
+        self.peers[port] = peer
+        self.counters[port] = [0, 0, 0, 0]
+
+    def receive(self, in_port, data, fields, hops):
+        """
+        Handles a packet received on a port: applies the matching flow or sends a PacketIn on a table miss.
+        """
+        counters = self.counters[in_port]
+        counters[0] += 1
+        counters[2] += len(data)
+
+        entry = self.table.lookup((in_port,) + fields)
+        if entry is None:
+            self.packet_in(in_port, data, of.OFPR_NO_MATCH)
+            return
+        entry.used = time.time()
+        entry.packet_count += 1
+        entry.byte_count += len(data)
+        self.output(entry.ports, in_port, data, fields, hops)
+
+    def output(self, ports, in_port, data, fields, hops):
+        """
+        Sends a packet on the ports of an action list. No port means the packet is dropped.
+        """
+        for port in ports:
+            if port in (of.OFPP_ALL, of.OFPP_FLOOD):
+                for p in sorted(self.peers):
+                    if p != in_port:
+                        self.transmit(p, data, fields, hops)
+            elif port == of.OFPP_IN_PORT:
+                self.transmit(in_port, data, fields, hops)
+            elif port == of.OFPP_CONTROLLER:
+                self.packet_in(in_port, data, of.OFPR_ACTION)
+            elif port in self.peers and port != in_port:
+                # As on OpenFlow 1.0 switches, only OFPP_IN_PORT sends a packet back where it came from
+                self.transmit(port, data, fields, hops)
+        if not ports:
+            self.emulator.dropped += 1
+
+    def transmit(self, port, data, fields, hops):
+        """
+        Puts a packet on the link of a port.
+        """
+        if port in self.down:
+            return
+        counters = self.counters[port]
+        counters[1] += 1
+        counters[3] += len(data)
+        self.emulator.deliver(self.peers[port], data, fields, hops + 1)
+
+    def packet_in(self, in_port, data, reason):
+        """
+        Sends a packet to the controller. The packet is also buffered, as done by the hardware switches. A switch which
+        is not connected drops it (e.g. a switch of another shard).
+        """
+        if self.connection is None:
+            return
+        buffer_id = self._next_buffer
+        self._next_buffer = (self._next_buffer + 1) % 0xffffff00
+        self._buffers[buffer_id] = (in_port, data)
+        self._buffer_ids.append(buffer_id)
+        if len(self._buffer_ids) > MAX_BUFFERS:
+            self._buffers.pop(self._buffer_ids.popleft(), None)
+
+        msg = of.ofp_packet_in(in_port=in_port, data=data, reason=reason, buffer_id=buffer_id, total_len=len(data))
+        self.emulator.raise_event(PacketIn, self.connection, msg)
+
+    def handle(self, msg):
+        """
+        Applies a message sent by the controller.
+        """
+        emulator = self.emulator
+        if isinstance(msg, of.ofp_packet_out):
+            emulator.packet_outs += 1
+            in_port, data = self._unbuffer(msg)
+            if data is not None:
+                self.output([a.port for a in msg.actions if isinstance(a, of.ofp_action_output)], in_port, data,
+                            emulator.fields(data), 0)
+        elif isinstance(msg, of.ofp_flow_mod):
+            emulator.flow_mods += 1
+            self._flow_mod(msg)
+        elif isinstance(msg, of.ofp_barrier_request):
+            emulator.raise_event(BarrierIn, self.connection, of.ofp_barrier_reply(xid=msg.xid))
+        elif isinstance(msg, of.ofp_stats_request):
+            self._stats(msg)
+
+    def expire(self, now):
+        """
+        Removes the flows which have timed out.
+        """
+        expired = [(e, e.expired(now)) for e in self.table.entries if e.idle_timeout or e.hard_timeout]
+        expired = [(e, reason) for e, reason in expired if reason is not None]
+        self.table.remove([e for e, reason in expired])
+        for entry, reason in expired:
+            self._flow_removed(entry, reason, now)
+
+    def _unbuffer(self, msg):
+        """
+        Return:
+        -------
+            The input port and the data of the packet of a packet_out or flow_mod, (None, None) if there is none.
+        """
+        # A buffer can be used by several messages (e.g. a packet_out per flooded port)
+        if msg.buffer_id is not None and msg.buffer_id in self._buffers:
+            in_port, data = self._buffers[msg.buffer_id]
+            return getattr(msg, 'in_port', in_port), data
+        data = getattr(msg, 'data', None)
+        if data:
+            return getattr(msg, 'in_port', of.OFPP_NONE), data
+        return None, None
+
+    def _flow_mod(self, msg):
+        """
+        Applies a flow_mod on the flow table.
+        """
+        now = time.time()
+        command = msg.command
+        fields = match_fields(msg.match)
+
+        if command in (of.OFPFC_DELETE, of.OFPFC_DELETE_STRICT):
+            strict = msg.priority if command == of.OFPFC_DELETE_STRICT else None
+            removed = self.table.select(fields, strict, msg.out_port)
+            self.table.remove(removed)
+            for entry in removed:
+                self._flow_removed(entry, of.OFPRR_DELETE, now)
+            return
+
+        if command in (of.OFPFC_MODIFY, of.OFPFC_MODIFY_STRICT):
+            strict = msg.priority if command == of.OFPFC_MODIFY_STRICT else None
+            modified = self.table.select(fields, strict)
+            if modified:
+                ports = [a.port for a in msg.actions if isinstance(a, of.ofp_action_output)]
+                for entry in modified:
+                    entry.ports = ports
+                return
+
+        if not self.table.add(FlowEntry(msg, now)):
+            self.emulator.table_full += 1
+            error = of.ofp_error(type=of.OFPET_FLOW_MOD_FAILED, code=of.OFPFMFC_ALL_TABLES_FULL)
+            self.emulator.raise_event(ErrorIn, self.connection, error)
+            return
+
+        # A flow_mod may carry a buffered packet to send through the new flow
+        in_port, data = self._unbuffer(msg)
+        if data is not None:
+            self.receive(in_port, data, self.emulator.fields(data), 0)
+
+    def _flow_removed(self, entry, reason, now):
+        """
+        Tells the controller about a removed flow, if it asked for it.
+        """
+        if not entry.flags & of.OFPFF_SEND_FLOW_REM:
+            return
+        msg = of.ofp_flow_removed(match=entry.match, cookie=entry.cookie, priority=entry.priority, reason=reason,
+                                  duration_sec=int(now - entry.created), idle_timeout=entry.idle_timeout,
+                                  packet_count=entry.packet_count, byte_count=entry.byte_count)
+        self.emulator.raise_event(FlowRemoved, self.connection, msg)
+
+    def _stats(self, msg):
+        """
+        Answers the port, flow and table statistics requests.
+        """
+        if isinstance(msg.body, of.ofp_port_stats_request):
+            # The local port comes first, as on Open vSwitch
+            stats = [of.ofp_port_stats(port_no=LOCAL_PORT)]
+            for port in sorted(self.counters):
+                rx_packets, tx_packets, rx_bytes, tx_bytes = self.counters[port]
+                stats.append(of.ofp_port_stats(port_no=port, rx_packets=rx_packets, tx_packets=tx_packets,
+                                               rx_bytes=rx_bytes, tx_bytes=tx_bytes))
+            event = PortStatsReceived
+        elif isinstance(msg.body, of.ofp_flow_stats_request):
+            now = time.time()
+            stats = [of.ofp_flow_stats(match=e.match, priority=e.priority, cookie=e.cookie,
+                                       idle_timeout=e.idle_timeout, hard_timeout=e.hard_timeout,
+                                       duration_sec=int(now - e.created), packet_count=e.packet_count,
+                                       byte_count=e.byte_count,
+                                       actions=[of.ofp_action_output(port=p) for p in e.ports])
+                     for e in self.table.entries]
+            event = FlowStatsReceived
+        elif isinstance(msg.body, of.ofp_table_stats_request):
+            stats = [of.ofp_table_stats(table_id=0, name="classifier", max_entries=self.table.size or 0xffffffff,
+                                        active_count=len(self.table))]
+            event = TableStatsReceived
+        else:
+            return
+        reply = of.ofp_stats_reply(xid=msg.xid, body=stats)
+        self.emulator.raise_event(event, self.connection, [reply], stats)
+
+
+class EmulatedConnection(EventMixin):
+    """
+    Stand-in for the POX connection to a switch. The messages sent by the controller are queued and applied by the
+    emulator in order.
+    """
+    _eventMixin_events = set([PacketIn, FlowRemoved, BarrierIn, ErrorIn, PortStatsReceived, FlowStatsReceived,
+                              TableStatsReceived])
+
+    def __init__(self, switch):
+        self.switch = switch
+        self.dpid = switch.dpid
+        ports = [of.ofp_phy_port(port_no=LOCAL_PORT, name="local")]
+        for port in sorted(switch.peers):
+            ports.append(of.ofp_phy_port(port_no=port, hw_addr=EthAddr(struct.pack('!HI', port, switch.dpid)),
+                                         name="s{}-eth{}".format(switch.dpid, port)))
+        self.features = of.ofp_features_reply(datapath_id=switch.dpid, ports=ports)
+
+    def send(self, msg):
+        self.switch.emulator.messages.append((self.switch, msg))
+
+
+class EmulatedNexus(EventMixin):
+    """
+    Stand-in for core.openflow.
+    """
+    _eventMixin_events = set([ConnectionUp, ConnectionDown, PacketIn, FlowRemoved, BarrierIn, ErrorIn,
+                              PortStatsReceived, FlowStatsReceived, TableStatsReceived])
+
+    def __init__(self):
+        self.connections = {}
+
+    def getConnection(self, dpid):
+        return self.connections.get(dpid)
+
+    def sendToDPID(self, dpid, data):
+        connection = self.connections.get(dpid)
+        if connection is None:
+            return False
+        connection.send(data)
+        return True
+
+
+class EmulatedDiscovery(EventMixin):
+    """
+    Stand-in for core.openflow_discovery.
+    """
+    _eventMixin_events = set([LinkEvent])
+
+
+class EmulatedHostTracker(EventMixin):
+    """
+    Stand-in for core.host_tracker.
+    """
+    _eventMixin_events = set([HostEvent])
+
+
+class Emulator(object):
+    """
+    Emulated two-tier Clos: every edge switch is linked to every core switch, and has its hosts on the following ports.
+    The core switches have the dpids 1 to cores, the edge switches the next ones. The port i of an edge switch goes to
+    the core i, the port j of a core switch goes to the j-th edge switch.
+    """
+
+    def __init__(self, cores, edges, hosts_per_edge, table_size=4096):
+        """
+        Builds the fabric and registers the stand-in POX components. Must be done before creating the controller.
+
+        Parameters:
+        -----------
+        cores: int
+            Number of core switches.
+        edges: int
+            Number of edge switches.
+        hosts_per_edge: int
+            Number of hosts behind each edge switch.
+        table_size: int
+            Maximum number of flows per switch, None for no limit.
+        """
+        self.core_ids = list(range(1, cores + 1))
+        self.edge_ids = list(range(cores + 1, cores + edges + 1))
+        self.switches = {}
+        self.links = []             # (dpid1, port1, dpid2, port2)
+        self.hosts = []             # (edge dpid, port) of each host
+        self.messages = deque()     # (switch, message) sent by the controller
+        self.packets = deque()      # (switch, input port, data, fields, hops) in flight
+
+        for dpid in self.core_ids + self.edge_ids:
+            self.switches[dpid] = EmulatedSwitch(self, dpid, table_size)
+        for j, edge in enumerate(self.edge_ids):
+            for i, core_id in enumerate(self.core_ids):
+                self.switches[edge].add_port(i + 1, ('switch', core_id, j + 1))
+                self.switches[core_id].add_port(j + 1, ('switch', edge, i + 1))
+                self.links.append((edge, i + 1, core_id, j + 1))
+            for h in range(hosts_per_edge):
+                port = cores + h + 1
+                self.switches[edge].add_port(port, ('host', len(self.hosts)))
+                self.hosts.append((edge, port))
+
+        self.nexus = EmulatedNexus()
+        self.discovery = EmulatedDiscovery()
+        self.host_tracker = EmulatedHostTracker()
+        core.register('openflow', self.nexus)
+        core.register('openflow_discovery', self.discovery)
+        core.register('host_tracker', self.host_tracker)
+
+        self._fields = {}           # Packet data -> match fields but the input port
+        self._known_hosts = set()
+        self._flows = []            # (source host, packet) of the traffic
+        self._weights = []          # Cumulative weights of the flows
+        self._timer = None
+        self._done = None
+
+        # Metrics
+        self.packet_ins = 0
+        self.packet_outs = 0
+        self.flow_mods = 0
+        self.sent = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.looped = 0
+        self.table_full = 0
+        self.controller_cpu = 0.0
+        self.occupancy = []         # (seconds since the start, total flows, largest table)
+        self._elapsed = 0.0
+        self._cpu_used = 0.0
+        self._start_counters = {}
+
+    def start(self, dpids=None):
+        """
+        Connects the switches and raises the discovery of the links. Must be called on the event loop.
+
+        Parameters:
+        -----------
+        dpids: list of int
+            Switches to connect, all by default (e.g. the switches of a shard). The other ones drop their table misses.
+        """
+        for dpid in sorted(self.switches if dpids is None else dpids):
+            switch = self.switches[dpid]
+            switch.connection = EmulatedConnection(switch)
+            self.nexus.connections[dpid] = switch.connection
+            self.raise_event(ConnectionUp, switch.connection, switch.connection.features)
+        for dpid1, port1, dpid2, port2 in self.links:
+            # openflow.discovery reports each direction of a link
+            self._raise(self.discovery, LinkEvent, True, Link(dpid1, port1, dpid2, port2))
+            self._raise(self.discovery, LinkEvent, True, Link(dpid2, port2, dpid1, port1))
+        self.process()
+
+    def link_down(self, dpid1, port1, dpid2, port2):
+        """
+        Takes a link down and reports it like openflow.discovery. Must be called on the event loop.
+        """
+        self.switches[dpid1].down.add(port1)
+        self.switches[dpid2].down.add(port2)
+        self._raise(self.discovery, LinkEvent, False, Link(dpid1, port1, dpid2, port2))
+        self._raise(self.discovery, LinkEvent, False, Link(dpid2, port2, dpid1, port1))
+        self.process()
+
+    def link_up(self, dpid1, port1, dpid2, port2):
+        """
+        Brings a link back up and reports it like openflow.discovery. Must be called on the event loop.
+        """
+        self.switches[dpid1].down.discard(port1)
+        self.switches[dpid2].down.discard(port2)
+        self._raise(self.discovery, LinkEvent, True, Link(dpid1, port1, dpid2, port2))
+        self._raise(self.discovery, LinkEvent, True, Link(dpid2, port2, dpid1, port1))
+        self.process()
+
+    def packet(self, src, dst, sport=1024, dport=80, size=64):
+        """
+        Builds a UDP packet between two hosts.
+
+        Parameters:
+        -----------
+        src: int
+            Index of the source host.
+        dst: int
+            Index of the destination host.
+        sport: int
+            UDP source port.
+        dport: int
+            UDP destination port.
+        size: int
+            Size of the UDP payload in bytes.
+
+        Return:
+        -------
+            The packed Ethernet frame.
+        """
+        datagram = udp(srcport=sport, dstport=dport)
+        datagram.payload = b'\x00' * size
+        packet = ipv4(srcip=host_ip(src), dstip=host_ip(dst), protocol=ipv4.UDP_PROTOCOL)
+        packet.payload = datagram
+        frame = ethernet(src=host_mac(src), dst=host_mac(dst), type=ethernet.IP_TYPE)
+        frame.payload = packet
+        return frame.pack()
+
+    def inject(self, src, data):
+        """
+        Sends a packet from a host. The first packet of a host is reported like host_tracker.
+        """
+        edge, port = self.hosts[src]
+        self._host_seen(src)
+        self.sent += 1
+        self.packets.append((self.switches[edge], port, data, self.fields(data), 0))
+
+    def _host_seen(self, src):
+        """
+        Reports the first packet of a host like host_tracker.
+        """
+        if src not in self._known_hosts:
+            self._known_hosts.add(src)
+            edge, port = self.hosts[src]
+            self._raise(self.host_tracker, HostEvent, MacEntry(edge, port, host_mac(src)), join=True)
+
+    def deliver(self, peer, data, fields, hops):
+        """
+        Hands a packet to the other end of a link.
+        """
+        if peer[0] == 'host':
+            if host_mac(peer[1]) == fields[1]:
+                self.delivered += 1
+        elif hops >= MAX_HOPS or len(self.packets) >= MAX_IN_FLIGHT:
+            # Forwarding loop or broadcast storm
+            self.looped += 1
+        else:
+            self.packets.append((self.switches[peer[1]], peer[2], data, fields, hops))
+
+    def fields(self, data):
+        """
+        Return:
+        -------
+            The match fields of a packet but the input port.
+        """
+        fields = self._fields.get(data)
+        if fields is None:
+            if len(self._fields) > 100000:
+                self._fields = {}
+            fields = self._fields[data] = match_fields(of.ofp_match.from_packet(ethernet(data)))[1:]
+        return fields
+
+    def process(self):
+        """
+        Runs the data plane until there is no message nor packet left: the messages of the controller are applied
+        before each packet, as if the control channel was faster than the links.
+        """
+        while self.messages or self.packets:
+            while self.messages:
+                switch, msg = self.messages.popleft()
+                switch.handle(msg)
+            if self.packets:
+                switch, in_port, data, fields, hops = self.packets.popleft()
+                switch.receive(in_port, data, fields, hops)
+
+    def raise_event(self, event_type, connection, *args):
+        """
+        Raises an OpenFlow event on core.openflow then on the connection, as done by openflow.of_01.
+        """
+        if event_type is PacketIn:
+            self.packet_ins += 1
+        event = self._raise(self.nexus, event_type, connection, *args)
+        if event is None or event.halt is not True:
+            self._raise(connection, event_type, connection, *args)
+
+    def _raise(self, source, event_type, *args, **kw):
+        """
+        Raises an event and accounts the time spent in the handlers of the controller.
+        """
+        start = _cpu()
+        event = source.raiseEventNoErrors(event_type, *args, **kw)
+        self.controller_cpu += _cpu() - start
+        return event
+
+    def run(self, duration, rate, flows, seed=0, tick=0.01, warmup=1.0):
+        """
+        Sends traffic through the fabric and waits for the end of the run. Must not be called on the event loop.
+
+        Parameters:
+        -----------
+        duration: float
+            Length of the run in seconds.
+        rate: float
+            Packets per second sent by the hosts.
+        flows: int or list
+            Number of distinct flows between random hosts, or traffic matrix given as a list of (source host,
+            destination host, UDP source port, UDP destination port, payload size, weight). Each packet belongs to a
+            flow picked at random in proportion to its weight.
+        seed: int
+            Seed of the random generator.
+        tick: float
+            Delay in seconds between two batches of packets.
+        warmup: float
+            Delay in seconds between the discovery of the links and the first packet, for the controller to compute
+            its trees.
+
+        Return:
+        -------
+            The metrics of the run, see metrics().
+        """
+        rng = random.Random(seed)
+        if isinstance(flows, int):
+            count = len(self.hosts)
+            matrix = []
+            for _ in range(flows):
+                src = rng.randrange(count)
+                dst = (src + rng.randrange(1, count)) % count
+                matrix.append((src, dst, rng.randrange(1024, 65536), rng.choice((80, 443, 5001)), 64, 1))
+            flows = matrix
+
+        total = 0.0
+        self._flows = []
+        self._weights = []
+        for src, dst, sport, dport, size, weight in flows:
+            total += weight
+            self._flows.append((src, self.packet(src, dst, sport, dport, size)))
+            self._weights.append(total)
+
+        self._done = threading.Event()
+        self._rng = rng
+        self._run_args = (duration, rate, tick)
+        core.callLater(self._begin, warmup)
+        self._done.wait()
+        return self.metrics()
+
+    def connect(self, dpids=None, warmup=1.0):
+        """
+        Connects the switches on the event loop, and waits for the controller to compute its trees. Must not be called
+        on the event loop.
+
+        Parameters:
+        -----------
+        dpids: list of int
+            Switches to connect, all by default, see start().
+        warmup: float
+            Delay in seconds given to the controller after the discovery of the links.
+        """
+        connected = threading.Event()
+
+        def start():
+            self.start(dpids)
+            connected.set()
+        core.callLater(start)
+        connected.wait()
+        time.sleep(warmup)
+
+    def saturate(self, packets, seed=0):
+        """
+        Sends packets from the hosts of the connected edge switches straight to the controller, as PacketIns of table
+        misses, each one once the previous one has been handled, to measure how fast the controller handles them. The
+        messages of the controller are applied to the switches, but the packets it sends are dropped, so that the work
+        per PacketIn does not depend on the switches connected. Must not be called on the event loop, after connect().
+
+        Parameters:
+        -----------
+        packets: int
+            Number of PacketIns sent.
+        seed: int
+            Seed of the random generator picking the source and destination hosts.
+
+        Return:
+        -------
+            A dictionary with the number of PacketIns sent, the start and end times of the run, the PacketIn rate and
+            the CPU time spent in the handlers of the controller.
+        """
+        rng = random.Random(seed)
+        sources = [i for i, (edge, port) in enumerate(self.hosts) if self.switches[edge].connection is not None]
+        frames = []
+        for _ in range(min(packets, 1024) if sources else 0):
+            src = rng.choice(sources)
+            dst = (src + rng.randrange(1, len(self.hosts))) % len(self.hosts)
+            frames.append((src, self.packet(src, dst, rng.randrange(1024, 65536))))
+
+        result = {}
+        done = threading.Event()
+
+        def run():
+            packet_ins, cpu = self.packet_ins, self.controller_cpu
+            result['start'] = time.time()
+            for i in range(packets if frames else 0):
+                src, data = frames[i % len(frames)]
+                edge, port = self.hosts[src]
+                self._host_seen(src)
+                self.switches[edge].packet_in(port, data, of.OFPR_NO_MATCH)
+                while self.messages:
+                    switch, msg = self.messages.popleft()
+                    switch.handle(msg)
+                self.packets.clear()
+            result['end'] = time.time()
+            result['packet_ins'] = self.packet_ins - packet_ins
+            result['controller_cpu'] = self.controller_cpu - cpu
+            done.set()
+        core.callLater(run)
+        done.wait()
+
+        result['rate'] = result['packet_ins'] / max(result['end'] - result['start'], 1e-9)
+        return result
+
+    def metrics(self):
+        """
+        Return:
+        -------
+            A dictionary with the metrics of the last run.
+        """
+        elapsed = max(self._elapsed, 1e-9)
+        occupancy = [o[1] for o in self.occupancy] or [0]
+        return {'hosts': len(self.hosts), 'switches': len(self.switches), 'duration': elapsed,
+                'sent': self.sent, 'delivered': self.delivered, 'dropped': self.dropped, 'looped': self.looped,
+                'packet_ins': self.packet_ins, 'packet_in_rate': self.packet_ins / elapsed,
+                'packet_outs': self.packet_outs, 'flow_mods': self.flow_mods, 'table_full': self.table_full,
+                'controller_cpu': self.controller_cpu, 'controller_cpu_share': self.controller_cpu / elapsed,
+                'total_cpu': self._cpu_used, 'flows_mean': sum(occupancy) / float(len(occupancy)),
+                'flows_max': max(occupancy), 'largest_table': max([o[2] for o in self.occupancy] or [0]),
+                'occupancy': self.occupancy, 'flows': len(self._flows)}
+
+    def link_loads(self):
+        """
+        Return:
+        -------
+            The mapping between each direction (dpid1, port1, dpid2, port2) of the links between switches and its
+            load in bytes per second during the last run.
+        """
+        elapsed = max(self._elapsed, 1e-9)
+        loads = {}
+        for dpid1, port1, dpid2, port2 in self.links:
+            for a, pa, b, pb in ((dpid1, port1, dpid2, port2), (dpid2, port2, dpid1, port1)):
+                sent = self.switches[a].counters[pa][3] - self._start_counters.get((a, pa), 0)
+                loads[(a, pa, b, pb)] = sent / elapsed
+        return loads
+
+    def _begin(self, warmup):
+        """
+        Connects the fabric on the event loop and starts the traffic after the warmup.
+        """
+        self.start()
+        Timer(warmup, self._begin_traffic)
+
+    def _begin_traffic(self):
+        """
+        Starts sending the traffic.
+        """
+        self._start = time.time()
+        self._start_cpu = _cpu()
+        self._start_counters = dict(((s.dpid, p), c[3]) for s in self.switches.values() for p, c in s.counters.items())
+        self._last_expire = self._start
+        self._timer = Timer(self._run_args[2], self._tick, recurring=True)
+
+    def _tick(self):
+        """
+        Sends the packets due since the last tick and runs the data plane.
+        """
+        duration, rate, tick = self._run_args
+        now = time.time()
+        elapsed = now - self._start
+
+        due = int(rate * min(elapsed, duration)) - self.sent
+        total = self._weights[-1]
+        for _ in range(due):
+            src, data = self._flows[bisect.bisect_left(self._weights, self._rng.random() * total)]
+            self.inject(src, data)
+        self.process()
+
+        if now - self._last_expire >= 1.0 or elapsed >= duration:
+            self._last_expire = now
+            for switch in self.switches.values():
+                switch.expire(now)
+            self.process()
+            sizes = [len(s.table) for s in self.switches.values()]
+            self.occupancy.append((round(elapsed, 3), sum(sizes), max(sizes)))
+
+        if elapsed >= duration:
+            self._timer.cancel()
+            self._elapsed = elapsed
+            self._cpu_used = _cpu() - self._start_cpu
+            self._done.set()
+
+
+def create_controller(app, core_ids, interval=1.0, table_capacity=None, dedup_window=0):
+    """
+    Creates a controller as its launch() does, without the real discovery and host_tracker components.
+
+    Parameters:
+    -----------
+    app: str
+        tree, vlan or adaptive.
+    core_ids: list of int
+        Ids of the core switches.
+    interval: float
+        Statistics interval of the adaptive controller in seconds.
+    table_capacity: int
+        Flow table capacity given to the capacity manager, 0 to use the size of the emulated tables, None to disable
+        the manager (see capacity.py).
+    dedup_window: float
+        Echo window of the fabric-wide floods, 0 to flood hop by hop (see dedup.py).
+
+    Return:
+    -------
+        The controller.
+    """
+    if app == 'tree':
+        from misc.tree import TreeController
+        controller = TreeController(core_ids)
+    elif app == 'vlan':
+        from misc.vlans import VLANController
+        controller = VLANController(core_ids)
+    elif app == 'adaptive':
+        from misc.adaptive import AdaptiveController
+        controller = AdaptiveController(core_ids, interval)
+    else:
+        raise ValueError("Unknown app {}, expected tree, vlan or adaptive".format(app))
+    if table_capacity is not None:
+        controller.enable_capacity(table_capacity or None)
+    if dedup_window:
+        controller.enable_dedup(dedup_window)
+    return controller
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a controller on an emulated Clos data plane.")
+    parser.add_argument('--app', default='tree', choices=('tree', 'vlan', 'adaptive'))
+    parser.add_argument('--cores', type=int, default=4)
+    parser.add_argument('--edges', type=int, default=32)
+    parser.add_argument('--hosts', type=int, default=32, help="hosts per edge switch")
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--rate', type=float, default=5000, help="packets per second")
+    parser.add_argument('--flows', type=int, default=10000)
+    parser.add_argument('--table_size', type=int, default=4096)
+    parser.add_argument('--table_capacity', type=int,
+                        help="enable the flow table capacity manager, 0 to use the size of the emulated tables")
+    parser.add_argument('--dedup_window', type=float, default=0,
+                        help="flood in the whole fabric from the ingress switch and drop the echoes within this window")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    emulator = Emulator(args.cores, args.edges, args.hosts, args.table_size)
+    controller = create_controller(args.app, emulator.core_ids, table_capacity=args.table_capacity,
+                                   dedup_window=args.dedup_window)
+    metrics = emulator.run(args.duration, args.rate, args.flows, args.seed)
+    metrics['app'] = args.app
+    if controller.capacity is not None:
+        metrics['capacity'] = controller.capacity.stats()
+    if controller.dedup is not None:
+        metrics['dedup'] = controller.dedup.stats()
+    print(json.dumps(metrics, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+import json
+
+
+def clos_links(cores, edges):
+    """
+    Builds the wiring of a two-tier Clos where the port i of every edge switch leads to the i-th core switch, and the
+    port j of every core switch leads to the j-th edge switch.
+
+    Parameters:
+    -----------
+    cores: list of int
+        Ids of the core switches.
+    edges: list of int
+        Ids of the edge switches.
+
+    Return:
+    -------
+        The list of the links (dpid1, port1, dpid2, port2).
+    """
+    links = []
+    for i, core in enumerate(cores):
+        for j, edge in enumerate(edges):
+            links.append((core, j + 1, edge, i + 1))
+    return links
+
+
+def load(path):
+    """
+    Reads a declarative description of the fabric. It is a JSON object with the ids of the core switches ("cores"),
+    of the edge switches ("edges") and the port wiring ("links", a list of [dpid1, port1, dpid2, port2]). Without
+    "links", the wiring of clos_links() is used.
+
+    e.g. {"cores": [1, 2], "edges": [3, 4, 5], "links": [[1, 1, 3, 1], [1, 2, 4, 1], ...]}
+
+    Parameters:
+    -----------
+    path: str
+        Path of the description file.
+
+    Return:
+    -------
+        The list of the core ids, the list of the edge ids and the list of the links (dpid1, port1, dpid2, port2).
+    """
+    with open(path) as f:
+        description = json.load(f)
+
+    try:
+        cores = [int(id) for id in description['cores']]
+        edges = [int(id) for id in description.get('edges', [])]
+        if 'links' in description:
+            links = [tuple(int(v) for v in link) for link in description['links']]
+        else:
+            links = clos_links(cores, edges)
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError("Invalid fabric description {}: {}".format(path, e))
+
+    # A port can only be used by one link
+    used = set()
+    for link in links:
+        if len(link) != 4:
+            raise ValueError("Invalid link {} in {}: expected [dpid1, port1, dpid2, port2]".format(list(link), path))
+        for endpoint in ((link[0], link[1]), (link[2], link[3])):
+            if endpoint in used:
+                raise ValueError("Port #{} of switch #{} used twice in {}".format(endpoint[1], endpoint[0], path))
+            used.add(endpoint)
+
+    return cores, edges, links
@@ -0,0 +1,169 @@
+import time
+from collections import deque
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+
+log = core.getLogger()
+
+
+class FailoverManager(object):
+    """
+    Keeps track of the forwarding decisions installed on the switches together with a prebuilt flow modification
+    moving each of them to a backup port. When a link goes down, the prebuilt messages of the decisions using this
+    link are pushed to the switches in one batch.
+    """
+
+    def __init__(self, history=1000):
+        """
+        Initializes the failover manager.
+
+        Parameters:
+        -----------
+        history: int
+            Number of link failures whose convergence is kept, the oldest ones are dropped.
+        """
+        self.decisions = {}         # (dpid, key) -> [connection, match, out_port, endpoints, backup_port, backup endpoints, flow mod]
+        self.convergence = deque(maxlen=history)    # (failed link, seconds from the event to the last flow mod, flow mods sent)
+        self._by_endpoint = {}      # (dpid, port) -> set of (dpid, key) depending on this link endpoint
+        self._down = set()          # Link endpoints (dpid, port) currently down
+
+    def record(self, connection, key, match, out_port, endpoints, backup_port=None, backup_endpoints=()):
+        """
+        Records a forwarding decision and prebuilds the flow modification moving it to its backup port.
+
+        Parameters:
+        -----------
+        connection: Connection
+            Connection to the switch on which the decision has been installed.
+        key: hashable
+            Identifier of the decision on this switch (e.g. the source, destination and type of the flow)
+        match: ofp_match
+            Match of the installed flow.
+        out_port: int
+            Port used by the flow.
+        endpoints: list of (int, int)
+            Link endpoints (dpid, port) used by the flow. If any of them goes down, the decision is affected.
+        backup_port: int
+            Port to use if the decision is affected, None to remove the flow instead.
+        backup_endpoints: list of (int, int)
+            Link endpoints used by the backup path.
+        """
+        id = (connection.dpid, key)
+        self.forget(connection.dpid, key)
+
+        if backup_port is not None:
+            msg = of.ofp_flow_mod(command=of.OFPFC_MODIFY_STRICT)
+            msg.actions.append(of.ofp_action_output(port=backup_port))
+            # A modify of a flow already gone adds it again, it must still report its removal
+            msg.flags = of.OFPFF_SEND_FLOW_REM
+        else:
+            msg = of.ofp_flow_mod(command=of.OFPFC_DELETE_STRICT)
+        msg.match = match
+
+        self.decisions[id] = [connection, match, out_port, tuple(endpoints), backup_port, tuple(backup_endpoints), msg]
+        for endpoint in endpoints:
+            self._by_endpoint.setdefault(endpoint, set()).add(id)
+
+    def forget(self, dpid, key):
+        """
+        Stops tracking a forwarding decision.
+        """
+        decision = self.decisions.pop((dpid, key), None)
+        if decision is None:
+            return
+
+        for endpoint in decision[3]:
+            ids = self._by_endpoint.get(endpoint)
+            if ids is not None:
+                ids.discard((dpid, key))
+                if not ids:
+                    del self._by_endpoint[endpoint]
+
+    def forget_where(self, test):
+        """
+        Stops tracking the forwarding decisions whose key satisfies a condition.
+
+        Parameters:
+        -----------
+        test: callable
+            Called with the key of each decision, returns True for the decisions to forget.
+        """
+        for dpid, key in [id for id in self.decisions if test(id[1])]:
+            self.forget(dpid, key)
+
+    def link_added(self, endpoint1, endpoint2):
+        """
+        Marks the endpoints of a link as usable again for the backup paths.
+
+        Parameters:
+        -----------
+        endpoint1: (int, int)
+            (dpid, port) of the first side of the link
+        endpoint2: (int, int)
+            (dpid, port) of the second side of the link
+        """
+        self._down.discard(endpoint1)
+        self._down.discard(endpoint2)
+
+    def link_removed(self, endpoint1, endpoint2, received=None):
+        """
+        Moves every decision using the link to its backup port. A decision whose backup is also down, or which has no
+        backup, is removed from the switch so that the next packet comes back to the controller.
+
+        Parameters:
+        -----------
+        endpoint1: (int, int)
+            (dpid, port) of the first side of the link
+        endpoint2: (int, int)
+            (dpid, port) of the second side of the link
+        received: float
+            Time the LinkEvent reporting the failure was received, the convergence is measured from it. Now if None.
+
+        Return:
+        -------
+            The number of flow modifications sent.
+        """
+        start = time.time() if received is None else received
+        if endpoint1 in self._down and endpoint2 in self._down:
+            # Already handled (the link is reported once per direction)
+            return 0
+        self._down.add(endpoint1)
+        self._down.add(endpoint2)
+
+        ids = self._by_endpoint.get(endpoint1, set()) | self._by_endpoint.get(endpoint2, set())
+
+        # Build the batch for each switch before sending anything
+        batches = {}
+        for id in ids:
+            decision = self.decisions[id]
+            connection, msg = decision[0], decision[6]
+            if decision[4] is not None and any(e in self._down for e in decision[5]):
+                msg = of.ofp_flow_mod(command=of.OFPFC_DELETE_STRICT)
+                msg.match = decision[1]
+            batches.setdefault(connection, []).append((id, msg))
+
+        sent = 0
+        for connection, batch in batches.items():
+            for id, msg in batch:
+                connection.send(msg)
+                sent += 1
+                self._swap(id, msg)
+        elapsed = time.time() - start
+
+        self.convergence.append(((endpoint1, endpoint2), elapsed, sent))
+        log.info("Link {} - {} down: {} flow mods sent to {} switches in {:.3f} ms".format(
+            endpoint1, endpoint2, sent, len(batches), elapsed * 1000))
+
+        return sent
+
+    def _swap(self, id, msg):
+        """
+        Updates a decision after its flow modification has been sent. The backup becomes the primary path, without any
+        backup left. A removed flow is forgotten.
+        """
+        if msg.command == of.OFPFC_DELETE_STRICT:
+            self.forget(id[0], id[1])
+            return
+
+        connection, match, _, _, backup_port, backup_endpoints, _ = self.decisions[id]
+        self.record(connection, id[1], match, backup_port, backup_endpoints)
@@ -2,6 +2,17 @@ from pox.core import core
 import pox.openflow.discovery
 import pox.openflow.libopenflow_01 as of
 from misc.graph import *
+from misc.recompute import Recomputer
+import misc.fabric
+from misc.shard import ShardChannel, owner
+from misc.admission import AdmissionControl
+from misc.tracing import FlowTracer
+from misc.dampening import LinkDampener
+from misc.rollout import BlockedPortsRollout
+from misc.capacity import CapacityManager
+from misc.dedup import FloodDedup
+from misc.warmstart import WarmStart, RestoredLinkEvent, link_key, LINK, MAC
+from pox.lib.recoco import Timer
 
 log = core.getLogger()
 
@@ -12,7 +23,7 @@ class SwitchController(object):
     given switch.
     """
 
-    def __init__(self, connection):
+    def __init__(self, connection, admission=None, tracer=None, capacity=None, dedup=None):
         """
         Initializes the switch controller.
 
@@ -20,9 +31,25 @@ class SwitchController(object):
         -----------
         connection: Connection
                     A connection objet to the switch.
+        admission: AdmissionControl
+                    Admission layer in front of the PacketIn handler, None to handle every PacketIn.
+        tracer: FlowTracer
+                    Flow setup latency tracer, None to disable tracing.
+        capacity: CapacityManager
+                    Flow table capacity manager, None to install every flow as is.
+        dedup: FloodDedup
+                    Fabric-wide flood handling, None to flood hop by hop.
         """
         connection.addListeners(self)
         self.connection = connection
+        self.admission = admission
+        self.tracer = tracer
+        self.capacity = capacity
+        if capacity is not None:
+            capacity.watch(connection)
+        self.dedup = dedup
+        if dedup is not None:
+            dedup.register(self)
 
         # Get the list of ports that the switch owns
         self.ports = []
@@ -49,6 +76,8 @@ class SwitchController(object):
 
         # Send message to switch
         self.connection.send(msg)
+        if self.tracer is not None:
+            self.tracer.packet_out(self.connection)
 
     def _flow_mod_msg(self, src, dst, out_port, hard_timeout=30):
         """
@@ -70,7 +99,9 @@ class SwitchController(object):
         msg = of.ofp_flow_mod()
         match = of.ofp_match()
         match.dl_dst = dst
-        match.dl_src = src
+        # Under flow table pressure, a single rule per destination aggregates all the sources
+        if self.capacity is None or not self.capacity.reserve(self.connection.dpid):
+            match.dl_src = src
         msg.match = match
         msg.actions.append(of.ofp_action_output(port=out_port))
         # Add hard time out
@@ -78,11 +109,16 @@ class SwitchController(object):
 
         # Send message to switch
         self.connection.send(msg)
+        if self.tracer is not None:
+            self.tracer.flow_mod(self.connection)
 
         log.debug("Add flow entry in switch #{}: {} {} {}".format(self.connection.dpid, src, out_port, dst))
 
 
 class CentralController(object):
+    # Apply methods of the results the writer shard sends to the other shards, see _submit()
+    shared_applies = ()
+
     def __init__(self, core_ids):
         """
         Initializes the main controller.
@@ -95,11 +131,41 @@ class CentralController(object):
         """
         self.core_ids = core_ids
         self.topology = Topology(core_ids)
+        # Runs the tree computations outside of the event loop
+        self.recomputer = Recomputer(self.topology)
+        # Applies the new trees on the switches without transient loops
+        self.rollout = BlockedPortsRollout()
         self.switch_controllers = []
 
+        # State restored from a snapshot, until confirmed by the network
+        self.warm_start = None
+        self._provisional_links = set()
+        self._restored_macs = {}
+
+        # Links of the fabric description, None if the topology is only discovered
+        self.fabric_links = None
+        self.fabric_deviations = []
+
+        # Sharded deployment, see shard.py
+        self.shard_count = 1
+        self.shard_index = 0
+        self.channel = None
+        self._shared_results = {}
+
+        # Admission layer shared by the switch controllers, see enable_admission()
+        self.admission = None
+        # Flow setup latency tracer shared by the switch controllers, see enable_tracing()
+        self.tracer = None
+        # Dampening of the flapping links, see enable_dampening()
+        self.dampener = None
+        # Flow table capacity manager shared by the switch controllers, see enable_capacity()
+        self.capacity = None
+        # Fabric-wide flood handling shared by the switch controllers, see enable_dedup()
+        self.dedup = None
+
         # Add the listeners
         core.openflow.addListenerByName("ConnectionUp", self._handle_ConnectionUp)
-        core.openflow_discovery.addListenerByName("LinkEvent", self._handle_LinkEvent)
+        core.openflow_discovery.addListenerByName("LinkEvent", self._handle_DiscoveryLinkEvent)
 
     def _handle_ConnectionUp(self, event):
         """
@@ -107,6 +173,21 @@ class CentralController(object):
         """
         raise NotImplementedError()
 
+    def _handle_DiscoveryLinkEvent(self, event):
+        """
+        Handles the links reported by openflow.discovery, through the dampening layer if enabled.
+
+        Parameters:
+        -----------
+        event: Event
+            Event that triggered this function.
+
+        """
+        if self.dampener is not None:
+            self.dampener.handle(event)
+        else:
+            self._handle_LinkEvent(event)
+
     def _handle_LinkEvent(self, event):
         """
         Handles links going up or down. The topology is changed according to the event.
@@ -116,8 +197,331 @@ class CentralController(object):
         event: Event
             Event that triggered this function.
 
+        Return:
+        -------
+            True if the topology has changed, False otherwise (e.g. a restored link being confirmed).
+
         """
+        key = link_key(event.link)
+        self._provisional_links.discard(key)
+
+        # Only the writer shard maintains the topology, the other ones send it their links and mirror its topology
+        if self.channel is not None and not self.channel.writer:
+            if not isinstance(event, RestoredLinkEvent):
+                link = event.link
+                self.channel.publish('link', (link.dpid1, link.port1, link.dpid2, link.port2, event.added))
+            return False
+
+        generation = self.topology.generation
+
+        # Report the differences between the discovered links and the fabric description
+        if self.fabric_links is not None and not isinstance(event, RestoredLinkEvent):
+            if event.added and key not in self.fabric_links:
+                self._fabric_deviation("Link {} is not in the fabric description".format(key))
+            elif event.removed and key in self.fabric_links:
+                self._fabric_deviation("Link {} of the fabric description went down".format(key))
+
         if event.added:
             self.topology.add_link(event.link.dpid1, event.link.dpid2, event.link.port1, event.link.port2)
         elif event.removed:
             self.topology.remove_link(event.link.dpid1, event.link.dpid2, event.link.port1, event.link.port2)
+
+        if self.topology.generation == generation:
+            return False
+        if self.channel is not None:
+            self.channel.publish('topology', self.topology.links())
+        return True
+
+    def enable_admission(self, rate):
+        """
+        Puts an admission layer in front of the PacketIn handlers of the switch controllers created from now on.
+
+        Parameters:
+        -----------
+        rate: float
+            PacketIns per second admitted for each switch.
+
+        """
+        self.admission = AdmissionControl(rate, burst=max(1.0, rate / 5.0), host_port=self._host_port)
+
+    def _host_port(self, dpid, port):
+        """
+        Return:
+        -------
+            True if a port of a switch leads to hosts: a port of an edge switch which is not a link of the topology. The
+            ports of a switch whose links are not known yet are not host ports.
+        """
+        if dpid in self.core_ids:
+            return False
+        node = self.topology.nodes.get(dpid)
+        return node is not None and port not in node.links
+
+    def enable_dampening(self, half_life):
+        """
+        Holds the links which flap until they settle, instead of recomputing the trees at each change.
+
+        Parameters:
+        -----------
+        half_life: float
+            Delay in seconds for the flap penalty of a link to decay by half, see LinkDampener.
+
+        """
+        self.dampener = LinkDampener(self._handle_LinkEvent, half_life)
+
+    def enable_capacity(self, max_entries=None, interval=5):
+        """
+        Manages the flow tables of the switches connecting from now on: the coldest flows are evicted before the tables
+        are full, and coarser rules are installed under pressure, see CapacityManager.
+
+        Parameters:
+        -----------
+        max_entries: int
+            Capacity of the flow tables, None to use the one reported by the switches.
+        interval: float
+            Delay in seconds between two polls of the table and flow statistics.
+
+        """
+        self.capacity = CapacityManager(interval, max_entries=max_entries)
+
+    def enable_dedup(self, window):
+        """
+        Floods the packets in the whole fabric from their ingress switch and drops their echoes, instead of flooding
+        them hop by hop, for the switch controllers created from now on, see FloodDedup.
+
+        Parameters:
+        -----------
+        window: float
+            Delay in seconds during which a flooded packet reaching the controller again is an echo.
+
+        """
+        self.dedup = FloodDedup(self.topology, window)
+
+    def enable_tracing(self, kind, path, sample=1):
+        """
+        Traces the flow setup latency of the switch controllers created from now on, see tracing.py.
+
+        Parameters:
+        -----------
+        kind: str
+            Type of the controller, used to label the histograms.
+        path: str
+            File the histograms are dumped to when POX goes down.
+        sample: int
+            Only one PacketIn out of sample is traced.
+
+        """
+        self.tracer = FlowTracer(kind, path, sample)
+
+    def enable_sharding(self, count, index, path=None):
+        """
+        Runs the controller as one shard of a sharded deployment: only the switches of this shard are handled, and the
+        trees are computed by the shard 0 for all the shards.
+
+        Parameters:
+        -----------
+        count: int
+            Number of shards.
+        index: int
+            Index of this shard, from 0 to count - 1.
+        path: str
+            Path of the Unix socket shared by the shards, None for the default one, see shard.socket_path().
+
+        """
+        self.shard_count = count
+        self.shard_index = index
+        self.channel = ShardChannel(path, index == 0, core.callLater)
+
+        if self.channel.writer:
+            self.channel.subscribe('link', self._handle_shared_link)
+            self.channel.subscribe('sync', self._handle_shared_sync)
+        else:
+            self.channel.subscribe('apply', self._handle_shared_apply)
+            self.channel.subscribe('topology', self._handle_shared_topology)
+            # Ask for the topology and the trees computed before this shard started
+            self.channel.publish('sync', index)
+
+    def _owns(self, dpid):
+        """
+        Return:
+        -------
+            True if the switch is handled by this shard.
+        """
+        return owner(dpid, self.shard_count) == self.shard_index
+
+    def _submit(self, function, apply):
+        """
+        Schedules a computation on the topology, see Recomputer.submit(). The writer shard sends the result to the
+        other shards.
+
+        Parameters:
+        -----------
+        function: callable
+            Called outside of the event loop with a snapshot of the topology.
+        apply: method
+            Method of the controller called with the result, listed in shared_applies.
+
+        """
+        def share_and_apply(result):
+            if self.channel is not None:
+                self._shared_results[apply.__name__] = result
+                self.channel.publish('apply', (apply.__name__, result))
+            apply(result)
+
+        self.recomputer.submit(function, share_and_apply)
+
+    def _handle_shared_link(self, link):
+        """
+        Handles a link seen by another shard. Writer only.
+        """
+        self._handle_LinkEvent(RestoredLinkEvent(*link))
+
+    def _handle_shared_sync(self, index):
+        """
+        Sends the last results to a shard which just started. Writer only.
+        """
+        self.channel.publish('topology', self.topology.links())
+        for name, result in self._shared_results.items():
+            self.channel.publish('apply', (name, result))
+
+    def _handle_shared_topology(self, links):
+        """
+        Mirrors the topology of the writer shard, e.g. for the host ports of the admission layer. The trees are not
+        recomputed, they are received from the writer shard.
+
+        Parameters:
+        -----------
+        links: list
+            The links (id1, id2, port1, port2) of the topology of the writer shard.
+        """
+        links = set(links)
+        current = set(self.topology.links())
+        for link in current - links:
+            self.topology.remove_link(*link)
+        for link in links - current:
+            self.topology.add_link(*link)
+
+    def _handle_shared_apply(self, payload):
+        """
+        Applies a result computed by the writer shard.
+        """
+        name, result = payload
+        if name not in self.shared_applies:
+            log.warning("Unexpected result {} from the writer shard, ignored".format(name))
+            return
+        getattr(self, name)(result)
+
+    def enable_warm_start(self, path, interval, grace):
+        """
+        Restores the state saved in a snapshot file and starts saving the state periodically. The restored links are
+        provisional: the ones not confirmed by openflow.discovery within the grace period are removed.
+
+        Parameters:
+        -----------
+        path: str
+            Path of the snapshot file.
+        interval: float
+            Delay in seconds between two snapshots.
+        grace: float
+            Delay in seconds given to openflow.discovery to confirm the restored links.
+
+        """
+        self.warm_start = WarmStart(path, interval, self._dump_state)
+
+        for kind, fields in self.warm_start.load():
+            if kind == LINK:
+                event = RestoredLinkEvent(fields[0], fields[1], fields[2], fields[3], True)
+                self._handle_LinkEvent(event)
+                self._provisional_links.add(event.link.key())
+            elif kind == MAC:
+                self._restored_macs.setdefault(fields[0], {})[fields[1]] = fields[2]
+
+        Timer(grace, self._expire_provisional)
+
+    def load_fabric(self, path, grace):
+        """
+        Preloads the topology with a fabric description, so that the trees are known before openflow.discovery has
+        found the links. The links of the description are provisional: the ones not confirmed by openflow.discovery
+        within the grace period are reported and removed.
+
+        Parameters:
+        -----------
+        path: str
+            Path of the fabric description, see fabric.load().
+        grace: float
+            Delay in seconds given to openflow.discovery to confirm the links.
+
+        """
+        cores, edges, links = misc.fabric.load(path)
+        self.fabric_links = set()
+
+        for dpid1, port1, dpid2, port2 in links:
+            event = RestoredLinkEvent(dpid1, port1, dpid2, port2, True)
+            self._handle_LinkEvent(event)
+            self.fabric_links.add(event.link.key())
+            self._provisional_links.add(event.link.key())
+        log.info("Fabric description {}: {} links preloaded".format(path, len(links)))
+
+        Timer(grace, self._expire_provisional)
+
+    def _fabric_deviation(self, message):
+        """
+        Reports a difference between the network and the fabric description.
+        """
+        self.fabric_deviations.append(message)
+        log.warning(message)
+
+    def _dump_state(self):
+        """
+        Return:
+        -------
+            The records describing the links and the learned MAC addresses, for the snapshot file.
+        """
+        for id1, id2, port1, port2 in self.topology.links():
+            yield LINK, (id1, port1, id2, port2)
+        for switch in self.switch_controllers:
+            for mac, port in switch.mac_to_port.items():
+                yield MAC, (switch.connection.dpid, mac, port)
+
+    def _restore_switch(self, switch):
+        """
+        Gives a new switch controller the MAC to port mapping restored for its switch.
+
+        Parameters:
+        -----------
+        switch: SwitchController
+            The switch controller of the new connection.
+
+        """
+        restored = self._restored_macs.pop(switch.connection.dpid, None)
+        if restored:
+            switch.mac_to_port.update(restored)
+
+    def _discoverable(self, key):
+        """
+        Return:
+        -------
+            True if openflow.discovery can confirm a link for this shard. LLDP packets are only matched by the shard
+            of the switch that sent them, so the links between switches of different shards are never discovered, and a
+            shard other than the writer only sees the links of its own switches.
+        """
+        shard = owner(key[0], self.shard_count)
+        if shard != owner(key[2], self.shard_count):
+            return False
+        return self.channel is None or self.channel.writer or shard == self.shard_index
+
+    def _expire_provisional(self):
+        """
+        Removes the restored links that have not been confirmed by openflow.discovery. The links this shard can not
+        discover are kept.
+        """
+        for key in list(self._provisional_links):
+            if not self._discoverable(key):
+                log.debug("Link {} can not be discovered by this shard, kept".format(key))
+                continue
+            if self.fabric_links is not None and key in self.fabric_links:
+                self._fabric_deviation("Link {} of the fabric description not discovered, removed".format(key))
+            else:
+                log.info("Restored link {} not confirmed, removed".format(key))
+            self._handle_LinkEvent(RestoredLinkEvent(key[0], key[1], key[2], key[3], False))
+        self._provisional_links.clear()
+        self._restored_macs = {}
@@ -14,6 +14,10 @@ class Topology:
         self.nodes = dict()
         self.cores_id = cores
         self.principal_core = None
+        # Incremented on every change of the links, used to detect stale computations
+        self.generation = 0
+        # (id, port) -> cost of the link on this port, see weighted_spanning_tree(). Not a change of the links.
+        self.costs = dict()
 
     def add_node(self, id):
         """
@@ -62,6 +66,7 @@ class Topology:
 
         self.nodes[id1].add_link(id2, port1)
         self.nodes[id2].add_link(id1, port2)
+        self.generation += 1
 
     def remove_link(self, id1, id2, port1, port2):
         """
@@ -85,6 +90,32 @@ class Topology:
 
         self.nodes[id1].remove_link(port1)
         self.nodes[id2].remove_link(port2)
+        self.costs.pop((id1, port1), None)
+        self.costs.pop((id2, port2), None)
+        self.generation += 1
+
+    def set_cost(self, id, port, cost):
+        """
+        Sets the cost of the link on a port of a node, as measured on this end.
+
+        Parameters:
+        -----------
+        id: int
+            id of the node
+        port: int
+            port of the link
+        cost: float
+            cost of the link, 1 for an idle link without errors.
+        """
+        self.costs[(id, port)] = cost
+
+    def link_cost(self, id1, id2, port1, port2):
+        """
+        Return:
+        -------
+            The cost of a link, the highest of the costs measured on its two ends (1 if not measured).
+        """
+        return max(self.costs.get((id1, port1), 1.0), self.costs.get((id2, port2), 1.0))
 
     def port(self, src_id, dst_id):
         """
@@ -152,6 +183,70 @@ class Topology:
 
         return spanning_tree, blocked_ports
 
+    def weighted_spanning_tree(self, current=None, hysteresis=0.2):
+        """
+        Return a minimum-cost spanning tree (Kruskal's algorithm) for the link costs, see set_cost(). The current tree is
+        kept while it still spans the topology and the new tree is not cheaper by more than the hysteresis, so that
+        small changes of the costs do not make the tree churn.
+
+        Parameters:
+        -----------
+        current: set
+            The links (id1, id2, port1, port2) of the current tree, as returned by links(), None if there is none.
+        hysteresis: float
+            Minimum relative gain on the cost of the tree required to replace the current one.
+
+        Return:
+        -------
+            The spanning tree and the mapping between the id of the switches and the blocked ports, as spanning_tree().
+        """
+        all_links = self.links()
+        current = set(current) if current is not None else set()
+        # On equal costs, the links of the current tree are kept
+        links = sorted(all_links, key=lambda l: (self.link_cost(*l), l not in current, l))
+
+        kept = self._kruskal(links)
+        if current and current != kept and self._kruskal([l for l in links if l in current]) == current:
+            new_cost = sum(self.link_cost(*l) for l in kept)
+            current_cost = sum(self.link_cost(*l) for l in current)
+            if len(current) == len(kept) and new_cost > current_cost * (1 - hysteresis):
+                kept = current
+
+        spanning_tree = copy.deepcopy(self)
+        blocked_ports = {}
+        for node_id in self.nodes.keys():
+            # Returns the list of blocked ports for each host
+            blocked_ports[node_id] = []
+        for id1, id2, port1, port2 in all_links:
+            if (id1, id2, port1, port2) not in kept:
+                spanning_tree.remove_link(id1, id2, port1, port2)
+                blocked_ports[id1].append(port1)
+                blocked_ports[id2].append(port2)
+
+        return spanning_tree, blocked_ports
+
+    def _kruskal(self, links):
+        """
+        Return:
+        -------
+            The set of the links of a spanning forest, taking the links in the given order.
+        """
+        parent = dict((id, id) for id in self.nodes.keys())
+
+        def find(id):
+            while parent[id] != id:
+                parent[id] = parent[parent[id]]
+                id = parent[id]
+            return id
+
+        kept = set()
+        for link in links:
+            root1, root2 = find(link[0]), find(link[1])
+            if root1 != root2:
+                parent[root1] = root2
+                kept.add(link)
+        return kept
+
     def rooted_tree(self, root):
         """
         Similar to the spanning tree, but only let the links of the rooted node active. The connectivity between edge
@@ -200,6 +295,22 @@ class Topology:
 
         return rooted_tree, blocked_ports
 
+    def links(self):
+        """
+        Return:
+        -------
+            The list of the links (id1, id2, port1, port2) of the topology, with id1 < id2. Parallel links between two
+            nodes are paired by port number.
+        """
+        links = []
+        for id1, node in self.nodes.items():
+            for id2 in set(node.links.values()):
+                if id1 < id2:
+                    ports1 = sorted(p for p, id in node.links.items() if id == id2)
+                    ports2 = sorted(p for p, id in self.nodes[id2].links.items() if id == id1)
+                    links.extend((id1, id2, p1, p2) for p1, p2 in zip(ports1, ports2))
+        return links
+
     def fully_connected_core(self):
         """
         Return:
@@ -264,6 +375,24 @@ class Topology:
                 return
         self.principal_core = None
 
+    def snapshot(self):
+        """
+        Return:
+        -------
+            An independent copy of the topology, safe to use outside of the event loop while the topology changes. Only
+            the link tables are copied, the ids and costs are immutable, so that the event loop is not blocked by a
+            deep copy on large fabrics.
+        """
+        snapshot = Topology(list(self.cores_id))
+        snapshot.principal_core = self.principal_core
+        snapshot.generation = self.generation
+        snapshot.costs = dict(self.costs)
+        for id, node in self.nodes.items():
+            copy_node = Node(id, node.core)
+            copy_node.links = dict(node.links)
+            snapshot.nodes[id] = copy_node
+        return snapshot
+
     def debug(self):
         for node in self.nodes.values():
             node.debug()
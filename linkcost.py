@@ -0,0 +1,108 @@
+import time
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.recoco import Timer
+
+log = core.getLogger()
+
+
+class LinkCostMonitor(object):
+    """
+    Measures the cost of the links of the switches from their port statistics, for the weighted spanning tree (see
+    graph.Topology.weighted_spanning_tree()). The cost of a port is
+
+        1 + utilization_weight * utilization + error_weight * error rate
+
+    where the utilization is the busiest direction relative to the link speed, and the error rate is the fraction of
+    the packets dropped or in error. The costs are smoothed over the polls.
+    """
+
+    def __init__(self, topology, on_update, interval=10, link_speed=1e9, utilization_weight=4, error_weight=50,
+                 smoothing=0.5):
+        """
+        Initializes the monitor and starts polling the switches.
+
+        Parameters:
+        -----------
+        topology: graph.Topology
+            The topology the costs are set on.
+        on_update: callable
+            Called without argument after each round of polls, to re-evaluate the tree.
+        interval: float
+            Delay in seconds between two polls of the port statistics.
+        link_speed: float
+            Speed of the links in bits per second.
+        utilization_weight: float
+            Cost of a fully used link, on top of the base cost of 1.
+        error_weight: float
+            Cost of a link losing all its packets, on top of the base cost of 1.
+        smoothing: float
+            Weight of the last measure in the cost, from 0 (never updated) to 1 (no smoothing).
+        """
+        self.topology = topology
+        self.on_update = on_update
+        self.link_speed = link_speed / 8.0
+        self.utilization_weight = utilization_weight
+        self.error_weight = error_weight
+        self.smoothing = smoothing
+
+        self._connections = {}  # dpid -> Connection
+        self._counters = {}     # (dpid, port) -> (time, tx bytes, rx bytes, packets, dropped and errors)
+        self.costs = {}         # (dpid, port) -> smoothed cost
+
+        core.openflow.addListenerByName("ConnectionUp", self._handle_ConnectionUp)
+        core.openflow.addListenerByName("ConnectionDown", self._handle_ConnectionDown)
+        core.openflow.addListenerByName("PortStatsReceived", self._handle_PortStatsReceived)
+        self.timer = Timer(interval, self._poll, recurring=True)
+
+    def _poll(self):
+        """
+        Requests the port statistics of every switch, then re-evaluates the tree with the costs of the previous round.
+        """
+        for connection in list(self._connections.values()):
+            connection.send(of.ofp_stats_request(body=of.ofp_port_stats_request()))
+        if self.costs:
+            self.on_update()
+
+    def _handle_ConnectionUp(self, event):
+        self._connections[event.connection.dpid] = event.connection
+
+    def _handle_ConnectionDown(self, event):
+        dpid = event.connection.dpid
+        self._connections.pop(dpid, None)
+        for key in [k for k in self._counters if k[0] == dpid]:
+            del self._counters[key]
+            self.costs.pop(key, None)
+
+    def _handle_PortStatsReceived(self, event):
+        """
+        Updates the cost of the ports of a switch from the counters since the previous poll.
+        """
+        dpid = event.connection.dpid
+        node = self.topology.nodes.get(dpid)
+        if node is None:
+            return
+        now = time.time()
+        for stat in event.stats:
+            if stat.port_no not in node.links:
+                # Host ports and local port, not part of the tree
+                continue
+            key = (dpid, stat.port_no)
+            # Counters not supported by the switch keep the same value, their deltas are 0
+            faults = stat.rx_dropped + stat.tx_dropped + stat.rx_errors + stat.tx_errors
+            counters = (now, stat.tx_bytes, stat.rx_bytes, stat.tx_packets + stat.rx_packets, faults)
+            previous = self._counters.get(key)
+            self._counters[key] = counters
+            if previous is None or now <= previous[0]:
+                continue
+
+            elapsed = now - previous[0]
+            deltas = [max(0, c - p) for c, p in zip(counters[1:], previous[1:])]
+            utilization = max(deltas[0], deltas[1]) / elapsed / self.link_speed
+            error_rate = deltas[3] / float(deltas[2] + deltas[3]) if deltas[3] else 0.0
+            cost = 1 + self.utilization_weight * min(1.0, utilization) + self.error_weight * error_rate
+
+            if key in self.costs:
+                cost = self.smoothing * cost + (1 - self.smoothing) * self.costs[key]
+            self.costs[key] = cost
+            self.topology.set_cost(dpid, stat.port_no, cost)
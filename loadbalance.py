@@ -0,0 +1,109 @@
+import hashlib
+import math
+import random
+import struct
+
+
+def path_cost(port, uplinks, downlinks=None):
+    """
+    Return:
+    -------
+        The load of the bottleneck of the path through a port, see pick_core().
+    """
+    if downlinks and port in downlinks:
+        return max(uplinks[port], downlinks[port])
+    return uplinks[port]
+
+
+def pick_core(uplinks, downlinks=None):
+    """
+    Picks the core switch to use for a new flow, as the one whose path has the least loaded bottleneck link.
+
+    Parameters:
+    -----------
+    uplinks: dict
+        Mapping between the ports of the source edge switch leading to a core switch and the load of the link towards
+        this core.
+    downlinks: dict
+        Mapping between the same ports and the load of the link from their core switch to the destination edge switch.
+        None if the destination edge switch is unknown. A port missing from the mapping has no path to the destination.
+
+    Return:
+    -------
+        The port of the source edge switch to use. The load of the uplink breaks the ties, then the port number.
+    """
+    if downlinks:
+        candidates = [p for p in uplinks if p in downlinks]
+        if candidates:
+            return min(candidates, key=lambda p: (max(uplinks[p], downlinks[p]), uplinks[p], p))
+
+    # Unknown destination: only the first hop is considered
+    return min(uplinks, key=lambda p: (uplinks[p], p))
+
+
+def weighted_choice(key, weights):
+    """
+    Weighted rendezvous hashing: picks a port for a flow, always the same one for the same flow and weights, with a
+    probability proportional to the weight of each port. Changing the weight of a port only moves the flows from or to
+    this port.
+
+    Parameters:
+    -----------
+    key: hashable
+        Identifier of the flow, its string representation is hashed.
+    weights: dict
+        Mapping between the candidate ports and their positive weight.
+
+    Return:
+    -------
+        The chosen port.
+    """
+    def score(port):
+        h = struct.unpack('!I', hashlib.md5('{}:{}'.format(key, port).encode('utf-8')).digest()[:4])[0]
+        return -math.log((h + 0.5) / 4294967296.0) / weights[port]
+
+    return min(sorted(weights), key=score)
+
+
+def benchmark(cores=4, edges=8, flows=4000, incast=0.5, seed=1):
+    """
+    Simulates the placement of flows on a two-tier Clos, a part of them being an incast towards the same edge switch,
+    and prints the maximum link load when the cores are chosen on the uplink load only and on the whole path.
+
+    Parameters:
+    -----------
+    cores: int
+        Number of core switches.
+    edges: int
+        Number of edge switches.
+    flows: int
+        Number of flows to place.
+    incast: float
+        Fraction of the flows going to the edge switch 0.
+    seed: int
+        Seed of the random generator, the same flows are used for both strategies.
+    """
+    rnd = random.Random(seed)
+    demands = []
+    for _ in range(flows):
+        src = rnd.randrange(1, edges)
+        dst = 0 if rnd.random() < incast else rnd.choice([e for e in range(edges) if e != src])
+        demands.append((src, dst, rnd.paretovariate(1.5)))
+
+    for name, path_aware in (('uplink only', False), ('path aware', True)):
+        up = dict(((e, c), 0.0) for e in range(edges) for c in range(cores))
+        down = dict(((c, e), 0.0) for e in range(edges) for c in range(cores))
+
+        for src, dst, size in demands:
+            uplinks = dict((c, up[(src, c)]) for c in range(cores))
+            downlinks = dict((c, down[(c, dst)]) for c in range(cores)) if path_aware else None
+            core = pick_core(uplinks, downlinks)
+            up[(src, core)] += size
+            down[(core, dst)] += size
+
+        loads = list(up.values()) + list(down.values())
+        print("{:12} max link load {:10.1f}   mean {:8.1f}".format(name, max(loads), sum(loads) / len(loads)))
+
+
+if __name__ == '__main__':
+    benchmark()
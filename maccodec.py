@@ -0,0 +1,111 @@
+"""
+Compact representation of the MAC addresses in the controller tables. The MAC addresses of a packet are converted
+once, when its PacketIn is handled, into 48-bit ints: they are smaller than EthAddr objects and hash faster. They are
+converted back only to build OpenFlow matches or log messages.
+
+    python maccodec.py
+
+measures the memory and lookup time of a MAC to port table of 100k entries keyed by EthAddr and by int.
+"""
+import struct
+from pox.lib.addresses import EthAddr
+
+BROADCAST = 0xffffffffffff
+ANY = 0
+
+_QUAD = struct.Struct('!Q')
+_PAD = b'\x00\x00'
+
+
+def to_int(mac):
+    """
+    Return:
+    -------
+        The 48-bit int of an EthAddr.
+    """
+    return _QUAD.unpack(_PAD + mac.toRaw())[0]
+
+
+def to_eth(value):
+    """
+    Return:
+    -------
+        The EthAddr of a 48-bit int.
+    """
+    return EthAddr(_QUAD.pack(value)[2:])
+
+
+def to_raw(value):
+    """
+    Return:
+    -------
+        The 6 bytes of a 48-bit int, e.g. for a snapshot record.
+    """
+    return _QUAD.pack(value)[2:]
+
+
+def from_raw(raw):
+    """
+    Return:
+    -------
+        The 48-bit int of 6 bytes.
+    """
+    return _QUAD.unpack(_PAD + raw)[0]
+
+
+def is_multicast(value):
+    """
+    Return:
+    -------
+        True for a group address (broadcast included), False for a host address.
+    """
+    return bool(value >> 40 & 1)
+
+
+def benchmark(count=100000, lookups=1000000):
+    """
+    Compares a MAC to port table keyed by EthAddr with one keyed by int: memory of the table and time of the lookups
+    made by a PacketIn handler, from the EthAddr of a parsed packet (the conversion to int is counted).
+    """
+    import random
+    import time
+    import tracemalloc
+
+    rng = random.Random(0)
+    raws = [struct.pack('!Q', rng.getrandbits(47) << 1)[2:] for _ in range(count)]
+
+    def measure(build):
+        tracemalloc.start()
+        table = build()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return table, size
+
+    eth_table, eth_size = measure(lambda: dict((EthAddr(raw), i % 48) for i, raw in enumerate(raws)))
+    int_table, int_size = measure(lambda: dict((from_raw(raw), i % 48) for i, raw in enumerate(raws)))
+
+    # The handlers look up the addresses of freshly parsed packets
+    packets = [EthAddr(raws[rng.randrange(count)]) for _ in range(min(lookups, 100000))]
+    rounds = max(1, lookups // len(packets))
+
+    start = time.time()
+    for _ in range(rounds):
+        for mac in packets:
+            eth_table.get(mac)
+    eth_time = time.time() - start
+
+    start = time.time()
+    for _ in range(rounds):
+        for mac in packets:
+            int_table.get(to_int(mac))
+    int_time = time.time() - start
+
+    done = rounds * len(packets)
+    print("{} MACs, {} lookups".format(count, done))
+    print("EthAddr keys: {:.1f} MB, {:.0f} ns per lookup".format(eth_size / 1e6, eth_time / done * 1e9))
+    print("int keys:     {:.1f} MB, {:.0f} ns per lookup (conversion included)".format(int_size / 1e6,
+                                                                                      int_time / done * 1e9))
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,271 @@
+from collections import deque
+
+
+class PathEngine(object):
+    """
+    Computes the equal-cost shortest paths between the edge switches of a multi-tier Clos (core, aggregation and edge
+    tiers) built on top of a graph.Topology. Edge switches are leaves: a path never transits through an edge switch
+    other than its source and its destination.
+
+    The results are cached for the generation of the topology they were computed on. When the engine is told about a
+    link change, only the pairs of edge switches whose paths are affected are invalidated.
+
+    adaptive.py finds the links from the core switches to the edge switch of a destination with next_hops(). The trees
+    of the tree and VLAN apps are still built by graph.Topology, which only handles two tiers.
+    """
+
+    def __init__(self, topology, aggregation_ids=()):
+        """
+        Initializes the path engine.
+
+        Parameters:
+        -----------
+        topology: graph.Topology
+            The topology to compute the paths on.
+        aggregation_ids: list of int
+            List of the ids of the aggregation switches. Empty for a two-tier Clos.
+        """
+        self.topology = topology
+        self.aggregation_ids = set(aggregation_ids)
+        self.generation = topology.generation
+
+        self._distances = {}    # Edge id -> {node id: number of hops to the edge}
+        self._paths = {}        # (source edge, destination edge) -> list of paths
+        self._link_pairs = {}   # (id1, id2) with id1 <= id2 -> set of pairs whose paths use the link
+        self._next_hops = {}    # (switch id, destination edge) -> frozenset of ports
+
+    def is_edge(self, id):
+        """
+        Return:
+        -------
+            True if the switch is an edge switch, False otherwise.
+        """
+        return id not in self.topology.cores_id and id not in self.aggregation_ids
+
+    def edges(self):
+        """
+        Return:
+        -------
+            The sorted list of the ids of the edge switches.
+        """
+        return sorted(id for id in self.topology.nodes if self.is_edge(id))
+
+    def paths(self, src, dst):
+        """
+        Retrieves the equal-cost shortest paths between two edge switches.
+
+        Parameters:
+        -----------
+        src: int
+            id of the source edge switch
+        dst: int
+            id of the destination edge switch
+
+        Return:
+        -------
+            The list of the shortest paths, each path being a tuple of switch ids from src to dst. Empty list if dst
+            can not be reached.
+        """
+        self._check_generation()
+
+        pair = (src, dst)
+        if pair not in self._paths:
+            self._paths[pair] = self._compute_paths(src, dst)
+            for path in self._paths[pair]:
+                for i in range(len(path) - 1):
+                    key = (min(path[i], path[i + 1]), max(path[i], path[i + 1]))
+                    self._link_pairs.setdefault(key, set()).add(pair)
+
+        return self._paths[pair]
+
+    def precompute(self):
+        """
+        Computes the paths of every pair of edge switches which are not in the cache yet.
+        """
+        edges = self.edges()
+        for src in edges:
+            for dst in edges:
+                if src != dst:
+                    self.paths(src, dst)
+
+    def next_hops(self, switch, dst):
+        """
+        Retrieves the ports of a switch that lie on a shortest path to an edge switch.
+
+        Parameters:
+        -----------
+        switch: int
+            id of the switch forwarding the packet
+        dst: int
+            id of the destination edge switch
+
+        Return:
+        -------
+            The frozenset of the ports of the switch leading to a next hop. Empty if dst can not be reached.
+        """
+        self._check_generation()
+
+        key = (switch, dst)
+        if key not in self._next_hops:
+            distances = self._distances_to(dst)
+            ports = set()
+            if switch in distances and switch in self.topology.nodes:
+                for port, id in self.topology.nodes[switch].links.items():
+                    if distances.get(id) == distances[switch] - 1 and (id == dst or not self.is_edge(id)):
+                        ports.add(port)
+            self._next_hops[key] = frozenset(ports)
+
+        return self._next_hops[key]
+
+    def path_ports(self, path):
+        """
+        Translates a path into the output port to use on each switch.
+
+        Parameters:
+        -----------
+        path: tuple of int
+            Path returned by paths()
+
+        Return:
+        -------
+            The list of (switch id, output port) along the path, the last switch excluded.
+        """
+        return [(path[i], self.topology.port(path[i], path[i + 1])) for i in range(len(path) - 1)]
+
+    def link_changed(self, id1, id2, added):
+        """
+        Invalidates the cached results affected by a link going up or down. Must be called after the topology has
+        been updated.
+
+        Parameters:
+        -----------
+        id1: int
+            Id of the first node of the link
+        id2: int
+            Id of the second node of the link
+        added: bool
+            True if the link has been added, False if removed.
+        """
+        if self.topology.generation == self.generation:
+            # The topology did not change (e.g. the link was already known)
+            return
+        if self.topology.generation != self.generation + 1:
+            # Some changes were missed, nothing in the cache can be trusted
+            self.flush()
+            return
+
+        key = (min(id1, id2), max(id1, id2))
+        if added:
+            # The pairs for which the new link gives a path at least as short as the current ones
+            stale_pairs = [pair for pair in self._paths if self._shortcut(pair, id1, id2)]
+        else:
+            # Removing a link only removes the paths that used it
+            stale_pairs = list(self._link_pairs.get(key, ()))
+        for pair in stale_pairs:
+            self._drop_pair(pair)
+
+        # The distances to an edge only change if the link joins two switches at different distances from it
+        for dst in [d for d, dist in self._distances.items() if dist.get(id1) != dist.get(id2)]:
+            del self._distances[dst]
+            for id in self.topology.nodes:
+                self._next_hops.pop((id, dst), None)
+
+        self.generation = self.topology.generation
+
+    def flush(self):
+        """
+        Empties the cache.
+        """
+        self._distances = {}
+        self._paths = {}
+        self._link_pairs = {}
+        self._next_hops = {}
+        self.generation = self.topology.generation
+
+    def _check_generation(self):
+        """
+        Flushes the cache if it has been computed on another generation of the topology.
+        """
+        if self.generation != self.topology.generation:
+            self.flush()
+
+    def _shortcut(self, pair, id1, id2):
+        """
+        Return:
+        -------
+            True if a link between id1 and id2 gives the pair a path at least as short as the cached ones.
+        """
+        from_src = self._distances.get(pair[0])
+        to_dst = self._distances.get(pair[1])
+        if from_src is None or to_dst is None:
+            return True
+
+        infinity = float('inf')
+        cached = len(self._paths[pair][0]) - 1 if self._paths[pair] else infinity
+        through = min(from_src.get(id1, infinity) + 1 + to_dst.get(id2, infinity),
+                      from_src.get(id2, infinity) + 1 + to_dst.get(id1, infinity))
+        return through <= cached
+
+    def _drop_pair(self, pair):
+        """
+        Removes a pair from the path cache and from the link index.
+        """
+        for path in self._paths.pop(pair, ()):
+            for i in range(len(path) - 1):
+                key = (min(path[i], path[i + 1]), max(path[i], path[i + 1]))
+                pairs = self._link_pairs.get(key)
+                if pairs is not None:
+                    pairs.discard(pair)
+                    if not pairs:
+                        del self._link_pairs[key]
+
+    def _distances_to(self, edge):
+        """
+        Breadth-first search from an edge switch. The other edge switches are reached but not expanded.
+
+        Return:
+        -------
+            The mapping between the id of the reachable switches and their number of hops to the edge.
+        """
+        if edge not in self._distances:
+            distances = {edge: 0}
+            if edge in self.topology.nodes:
+                frontier = deque([edge])
+                while frontier:
+                    node = frontier.popleft()
+                    if node != edge and self.is_edge(node):
+                        continue
+                    for id in self.topology.nodes[node].links.values():
+                        if id not in distances:
+                            distances[id] = distances[node] + 1
+                            frontier.append(id)
+            self._distances[edge] = distances
+
+        return self._distances[edge]
+
+    def _compute_paths(self, src, dst):
+        """
+        Enumerates the shortest paths from src to dst by walking down the distances to dst.
+        """
+        distances = self._distances_to(dst)
+        # Computed for the invalidation of the pairs when a link is added
+        self._distances_to(src)
+
+        if src not in distances or src == dst:
+            return []
+
+        paths = []
+        stack = [(src,)]
+        while stack:
+            path = stack.pop()
+            node = path[-1]
+            if node == dst:
+                paths.append(path)
+                continue
+            if node != src and self.is_edge(node):
+                continue
+            for id in sorted(set(self.topology.nodes[node].links.values())):
+                if distances.get(id) == distances[node] - 1:
+                    stack.append(path + (id,))
+
+        return sorted(paths)
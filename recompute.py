@@ -0,0 +1,121 @@
+import threading
+import time
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+from pox.core import core
+
+log = core.getLogger()
+
+
+class Recomputer(object):
+    """
+    Runs the topology computations (spanning tree, rooted trees...) in a worker thread on a snapshot of the topology,
+    outside of the event loop. A result is applied back on the event loop only if the topology has not changed since
+    the snapshot was taken, stale results are discarded.
+    """
+
+    def __init__(self, topology):
+        """
+        Initializes the recomputer and starts its worker thread.
+
+        Parameters:
+        -----------
+        topology: graph.Topology
+            The live topology, only read on the event loop.
+        """
+        self.topology = topology
+        self._queue = queue.Queue()
+        self._latest = None
+
+        # Metrics
+        self.submitted = 0
+        self.applied = 0
+        self.discarded = 0
+        self.last_apply_lag = 0.0   # Seconds between the end of the computation and its application
+        self.max_apply_lag = 0.0
+        self.last_latency = 0.0     # Seconds between the submission and the application
+
+        self._thread = threading.Thread(target=self._run, name="Recomputer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, function, apply):
+        """
+        Schedules a computation on a snapshot of the current topology. Must be called from the event loop.
+
+        Parameters:
+        -----------
+        function: callable
+            Called in the worker thread with the snapshot, returns the result of the computation.
+        apply: callable
+            Called on the event loop with the result, if it is still current.
+        """
+        generation = self.topology.generation
+        self._latest = generation
+        self.submitted += 1
+        self._queue.put((generation, time.time(), self.topology.snapshot(), function, apply))
+
+    def queue_depth(self):
+        """
+        Return:
+        -------
+            The number of computations waiting for the worker thread.
+        """
+        return self._queue.qsize()
+
+    def stats(self):
+        """
+        Return:
+        -------
+            A dictionary with the metrics of the recomputer.
+        """
+        return {'queue_depth': self.queue_depth(), 'submitted': self.submitted, 'applied': self.applied,
+                'discarded': self.discarded, 'last_apply_lag': self.last_apply_lag,
+                'max_apply_lag': self.max_apply_lag, 'last_latency': self.last_latency}
+
+    def _run(self):
+        """
+        Main loop of the worker thread.
+        """
+        while True:
+            generation, submitted, snapshot, function, apply = self._queue.get()
+
+            # A newer snapshot is already waiting, do not waste time on this one
+            if generation != self._latest:
+                core.callLater(self._discard, generation)
+                continue
+
+            try:
+                result = function(snapshot)
+            except Exception:
+                log.exception("Topology computation failed for generation {}".format(generation))
+                continue
+
+            core.callLater(self._apply, generation, submitted, time.time(), result, apply)
+
+    def _discard(self, generation):
+        """
+        Counts a stale computation. Runs on the event loop.
+        """
+        self.discarded += 1
+        log.debug("Discarded computation of generation {}, queue depth {}".format(generation, self.queue_depth()))
+
+    def _apply(self, generation, submitted, computed, result, apply):
+        """
+        Applies a result if its generation is still current. Runs on the event loop.
+        """
+        if generation != self.topology.generation:
+            self._discard(generation)
+            return
+
+        now = time.time()
+        self.last_apply_lag = now - computed
+        self.max_apply_lag = max(self.max_apply_lag, self.last_apply_lag)
+        self.last_latency = now - submitted
+        self.applied += 1
+
+        apply(result)
+        log.debug("Applied computation of generation {} after {:.3f} ms (apply lag {:.3f} ms, queue depth {})".format(
+            generation, self.last_latency * 1000, self.last_apply_lag * 1000, self.queue_depth()))
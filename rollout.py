@@ -0,0 +1,137 @@
+import time
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.recoco import Timer
+
+log = core.getLogger()
+
+
+class BlockedPortsRollout(object):
+    """
+    Ordered rollout of new blocked ports on the switches. A new tree is applied in two phases:
+
+    1. every switch blocks the union of its current and new blocked ports, and removes the flows sending on the
+       ports it newly blocks. A barrier is sent to each switch having flows removed.
+    2. once every barrier has been answered, every switch moves to its new blocked ports, i.e. unblocks the ports
+       which are not blocked anymore.
+
+    At no time a port is open on a switch while another switch still floods according to the old tree, so the
+    transition can not create a forwarding loop.
+    """
+
+    def __init__(self, timeout=2):
+        """
+        Initializes the rollout and listens to the barrier replies of the switches.
+
+        Parameters:
+        -----------
+        timeout: float
+            Delay in seconds after which the second phase starts even if some barriers are not answered (e.g. a
+            switch disconnected).
+        """
+        self.timeout = timeout
+
+        self._pending = set()   # (dpid, xid) of the barriers of the first phase
+        self._unblock = []      # Callables of the second phase
+        self._start = None
+        self._timer = None
+
+        # Metrics
+        self.rollouts = 0
+        self.superseded = 0
+        self.timeouts = 0
+        self.last_duration = 0.0    # Seconds from the first phase to the end of the second one
+        self.max_duration = 0.0
+
+        core.openflow.addListenerByName("BarrierIn", self._handle_BarrierIn)
+
+    def start(self, updates):
+        """
+        Starts the rollout of new blocked ports. A rollout still waiting for its barriers is superseded: the state of
+        its first phase is the starting point of the new one.
+
+        Parameters:
+        -----------
+        updates: list of (Connection, iterable, callable, callable)
+            For each switch: its connection, the ports it newly blocks, a callable blocking the union of the current
+            and new blocked ports, and a callable applying the new blocked ports.
+        """
+        if self._start is not None:
+            self.superseded += 1
+            self._cancel_timer()
+
+        self._start = time.time()
+        self._pending = set()
+        self._unblock = []
+        for connection, blocked, block, unblock in updates:
+            block()
+            self._unblock.append(unblock)
+
+            blocked = list(blocked)
+            if not blocked:
+                continue
+            for port in blocked:
+                connection.send(of.ofp_flow_mod(command=of.OFPFC_DELETE, out_port=port))
+            barrier = of.ofp_barrier_request()
+            self._pending.add((connection.dpid, barrier.xid))
+            connection.send(barrier)
+
+        if self._pending:
+            self._timer = Timer(self.timeout, self._handle_timeout)
+        else:
+            self._finish()
+
+    def stats(self):
+        """
+        Return:
+        -------
+            A dictionary with the metrics of the rollouts.
+        """
+        return {'rollouts': self.rollouts, 'superseded': self.superseded, 'timeouts': self.timeouts,
+                'in_progress': self._start is not None, 'last_duration': self.last_duration,
+                'max_duration': self.max_duration}
+
+    def _handle_BarrierIn(self, event):
+        """
+        Starts the second phase once every switch has confirmed the first one.
+        """
+        key = (event.connection.dpid, event.xid)
+        if key not in self._pending:
+            return
+        self._pending.discard(key)
+        if not self._pending:
+            self._cancel_timer()
+            self._finish()
+
+    def _handle_timeout(self):
+        """
+        Starts the second phase without the missing barrier replies.
+        """
+        self._timer = None
+        if self._start is None:
+            return
+        self.timeouts += 1
+        log.warning("Rollout: no barrier reply from switches {} after {} s, unblocking anyway".format(
+            sorted(dpid for dpid, xid in self._pending), self.timeout))
+        self._pending = set()
+        self._finish()
+
+    def _finish(self):
+        """
+        Second phase: applies the new blocked ports.
+        """
+        for unblock in self._unblock:
+            unblock()
+
+        self.rollouts += 1
+        self.last_duration = time.time() - self._start
+        self.max_duration = max(self.max_duration, self.last_duration)
+        log.info("Rollout of the blocked ports on {} switches done in {:.3f} ms".format(
+            len(self._unblock), self.last_duration * 1000))
+        self._start = None
+        self._unblock = []
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
@@ -0,0 +1,397 @@
+"""
+Sharded deployment of the controllers. The switches are partitioned across several POX processes by dpid: the switch
+with the given dpid belongs to the shard dpid % shard count. Each process runs the usual controller for its switches
+and listens on its own OpenFlow port, e.g. for 2 shards:
+
+    ./pox.py openflow.of_01 --port=6633 misc.tree --fabric=fabric.json --shards=2 --shard_index=0
+    ./pox.py openflow.of_01 --port=6634 misc.tree --fabric=fabric.json --shards=2 --shard_index=1
+
+The shards share the topology, the host directory and the link loads through a Unix socket, created in a directory
+private to the user (see socket_path()). The shard 0 is the single writer of the topology: it receives the links seen by
+the other shards, recomputes the trees and sends them back.
+LLDP packets are only matched by the shard that sent them, so links between switches of different shards should be
+given with a fabric description (--fabric).
+
+The PacketIn throughput of 1 to N shards, each in its own process on the emulated Clos of emulator.py, is measured with:
+
+    PYTHONPATH=.:ext:ext/misc python -m misc.shard --app=tree --shards=4 --packets=20000
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import stat
+import struct
+import tempfile
+import threading
+import time
+from misc.graph import Topology
+
+HEADER = struct.Struct('!I')
+
+try:
+    SCALARS = (type(None), bool, int, long, float, str, unicode)
+except NameError:
+    SCALARS = (type(None), bool, int, float, str)
+
+
+def socket_path(path=None):
+    """
+    Return:
+    -------
+        The path of the Unix socket of the shards, by default in a directory of the temporary directory private to the
+        user.
+    """
+    if path:
+        return path
+    return os.path.join(tempfile.gettempdir(), 'clos-shards-{}'.format(os.getuid()), 'shards.sock')
+
+
+def encode(obj):
+    """
+    Converts a payload to JSON types. The tuples, the dicts (whose keys are often ints or tuples) and the topologies
+    are tagged to be restored by decode().
+
+    Return:
+    -------
+        The JSON-compatible object.
+    """
+    if isinstance(obj, SCALARS):
+        return obj
+    if isinstance(obj, list):
+        return [encode(o) for o in obj]
+    if isinstance(obj, tuple):
+        return {'t': [encode(o) for o in obj]}
+    if isinstance(obj, dict):
+        return {'d': [[encode(k), encode(v)] for k, v in obj.items()]}
+    if isinstance(obj, (set, frozenset)):
+        return {'s': [encode(o) for o in obj]}
+    if isinstance(obj, Topology):
+        return {'g': [list(obj.cores_id), [list(link) for link in obj.links()]]}
+    raise TypeError("Can not share a {} between the shards".format(type(obj).__name__))
+
+
+def decode(obj):
+    """
+    Return:
+    -------
+        The payload encoded by encode().
+    """
+    if isinstance(obj, list):
+        return [decode(o) for o in obj]
+    if not isinstance(obj, dict):
+        return obj
+    if 't' in obj:
+        return tuple(decode(o) for o in obj['t'])
+    if 'd' in obj:
+        return dict((decode(k), decode(v)) for k, v in obj['d'])
+    if 's' in obj:
+        return set(decode(o) for o in obj['s'])
+    if 'g' in obj:
+        cores, links = obj['g']
+        topology = Topology(cores)
+        for id1, id2, port1, port2 in links:
+            topology.add_link(id1, id2, port1, port2)
+        return topology
+    raise ValueError("Unknown shard message {}".format(obj))
+
+
+def _private_directory(path):
+    """
+    Creates the directory of the socket if needed, and checks that it is only accessible by the user, so that no other
+    user can create or connect to the socket.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        os.makedirs(directory, 0o700)
+    except OSError:
+        # Already created, e.g. by another shard
+        pass
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise OSError("The directory {} of the shard socket must belong to the user with mode 0700".format(directory))
+
+
+def owner(dpid, count):
+    """
+    Return:
+    -------
+        The index of the shard in charge of a switch.
+    """
+    return dpid % count
+
+
+class ShardChannel(object):
+    """
+    Message channel between the shards of a controller, over a Unix socket. The writer shard listens on the socket and
+    relays every message it receives to the other shards. Messages are (topic, payload) tuples encoded in JSON (see
+    encode()), only the topics subscribed to are handled.
+    """
+
+    def __init__(self, path, writer, call_later, timeout=10):
+        """
+        Initializes the channel. The writer creates the socket, the other shards connect to it.
+
+        Parameters:
+        -----------
+        path: str
+            Path of the Unix socket, in a directory private to the user. None for the default one, see socket_path().
+        writer: bool
+            True for the writer shard.
+        call_later: callable
+            Used to run the message handlers on the event loop (core.callLater for POX).
+        timeout: float
+            Delay in seconds given to the writer to create the socket.
+        """
+        path = socket_path(path)
+        _private_directory(path)
+        self.path = path
+        self.writer = writer
+        self.call_later = call_later
+        self.sent = 0
+        self.received = 0
+
+        self._handlers = {}
+        self._peers = []
+        self._send_locks = {}   # Peer -> lock held for the whole sendall, so that frames never interleave
+        self._lock = threading.Lock()
+
+        if writer:
+            if os.path.exists(path):
+                os.unlink(path)
+            self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._server.bind(path)
+            self._server.listen(64)
+            self._start(self._accept)
+        else:
+            peer = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            deadline = time.time() + timeout
+            while True:
+                try:
+                    peer.connect(path)
+                    break
+                except socket.error:
+                    if time.time() > deadline:
+                        raise
+                    time.sleep(0.1)
+            self._add(peer)
+            self._start(self._read, peer)
+
+    def subscribe(self, topic, handler):
+        """
+        Registers the handler of a topic. It is called on the event loop with the payload of each message.
+        """
+        self._handlers[topic] = handler
+
+    def publish(self, topic, payload):
+        """
+        Sends a message to the other shards.
+
+        Parameters:
+        -----------
+        topic: str
+            Topic of the message
+        payload: object
+            Content of the message, made of scalars, lists, tuples, dicts, sets and topologies.
+        """
+        data = json.dumps([topic, encode(payload)]).encode('utf-8')
+        self._send(HEADER.pack(len(data)) + data, None)
+
+    def close(self):
+        """
+        Closes the connections to the other shards.
+        """
+        with self._lock:
+            for peer in self._peers:
+                peer.close()
+            self._peers = []
+            self._send_locks = {}
+        if self.writer:
+            self._server.close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def _send(self, frame, source):
+        """
+        Sends a frame to every peer but the one it comes from.
+        """
+        with self._lock:
+            peers = [(p, self._send_locks[p]) for p in self._peers if p is not source]
+        for peer, lock in peers:
+            try:
+                with lock:
+                    peer.sendall(frame)
+                self.sent += 1
+            except socket.error:
+                self._drop(peer)
+
+    def _add(self, peer):
+        """
+        Registers a connected peer.
+        """
+        with self._lock:
+            self._peers.append(peer)
+            self._send_locks[peer] = threading.Lock()
+
+    def _drop(self, peer):
+        """
+        Forgets a disconnected peer.
+        """
+        with self._lock:
+            if peer in self._peers:
+                self._peers.remove(peer)
+                del self._send_locks[peer]
+        peer.close()
+
+    def _start(self, target, *args):
+        """
+        Runs a function in a daemon thread.
+        """
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+
+    def _accept(self):
+        """
+        Accepts the connections of the other shards. Writer only.
+        """
+        while True:
+            try:
+                peer, _ = self._server.accept()
+            except socket.error:
+                return
+            self._add(peer)
+            self._start(self._read, peer)
+
+    def _read(self, peer):
+        """
+        Reads the frames sent by a peer and hands them to the event loop.
+        """
+        buffer = b''
+        while True:
+            try:
+                data = peer.recv(65536)
+            except socket.error:
+                data = b''
+            if not data:
+                self._drop(peer)
+                return
+            buffer += data
+
+            while len(buffer) >= HEADER.size:
+                size = HEADER.unpack(buffer[:HEADER.size])[0]
+                if len(buffer) < HEADER.size + size:
+                    break
+                frame, buffer = buffer[:HEADER.size + size], buffer[HEADER.size + size:]
+                self.received += 1
+
+                # The writer relays the messages to the other shards
+                if self.writer:
+                    self._send(frame, peer)
+
+                try:
+                    topic, payload = json.loads(frame[HEADER.size:].decode('utf-8'))
+                    handler = self._handlers.get(topic)
+                    if handler is not None:
+                        self.call_later(handler, decode(payload))
+                except (ValueError, TypeError, KeyError):
+                    # Malformed message, the payload is data only and is never executed
+                    continue
+
+
+def _benchmark_shard(app, fabric, count, index, path, packets, barrier, results):
+    """
+    Runs a shard of a controller on the emulated fabric, in a process of its own, with only the switches of the shard
+    connected, then sends PacketIns to these switches as fast as the shard handles them and puts its results in the
+    queue.
+    """
+    from misc.emulator import Emulator, create_controller
+
+    emulator = Emulator(*fabric)
+    controller = create_controller(app, emulator.core_ids)
+    controller.enable_sharding(count, index, path)
+    emulator.connect([dpid for dpid in emulator.switches if owner(dpid, count) == index])
+
+    # All the shards are loaded at the same time
+    barrier.wait()
+    results.put(emulator.saturate(packets, seed=index))
+    # The writer relays the messages of the other shards until they are all done
+    barrier.wait()
+    controller.channel.close()
+
+
+def benchmark(app='tree', max_shards=None, packets=20000, cores=4, edges=16, hosts=16, path=None):
+    """
+    Measures the PacketIn throughput of 1 to max_shards shards of a controller, on the emulated Clos of emulator.py.
+    Each shard runs in its own process and sends the given number of PacketIns to its switches, the aggregate rate is
+    the PacketIns handled by all the shards over the time from the first start to the last end.
+
+    Parameters:
+    -----------
+    app: str
+        tree, vlan or adaptive.
+    max_shards: int
+        Largest number of shards, the number of CPUs by default.
+    packets: int
+        Number of PacketIns sent to each shard.
+    cores, edges, hosts: int
+        Number of core switches, edge switches and hosts per edge switch of the emulated fabric.
+    path: str
+        Path of the Unix socket shared by the shards, None for the default one, see socket_path(). Each shard count
+        uses its own socket in the same directory.
+
+    Return:
+    -------
+        A list of dictionaries, one per shard count, with the number of shards, the PacketIns handled, the aggregate
+        PacketIn rate and the speedup over a single shard.
+    """
+    try:
+        # The POX event loop of a parent process does not survive a fork
+        context = multiprocessing.get_context('spawn')
+    except AttributeError:
+        context = multiprocessing
+    directory = os.path.dirname(socket_path(path))
+
+    results = []
+    for count in range(1, (max_shards or multiprocessing.cpu_count()) + 1):
+        path = os.path.join(directory, 'benchmark-{}-{}.sock'.format(os.getpid(), count))
+        barrier = context.Barrier(count)
+        queue = context.Queue()
+        processes = [context.Process(target=_benchmark_shard, args=(app, (cores, edges, hosts), count, index, path,
+                                                                    packets, barrier, queue))
+                     for index in range(count)]
+        for process in processes:
+            process.start()
+        shards = [queue.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+        packet_ins = sum(shard['packet_ins'] for shard in shards)
+        elapsed = max(shard['end'] for shard in shards) - min(shard['start'] for shard in shards)
+        rate = packet_ins / max(elapsed, 1e-9)
+        results.append({
+            'shards': count,
+            'packet_ins': packet_ins,
+            'rate': rate,
+            'speedup': rate / results[0]['rate'] if results else 1.0,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the PacketIn throughput of the sharded controllers.")
+    parser.add_argument('--app', default='tree', choices=('tree', 'vlan', 'adaptive'))
+    parser.add_argument('--shards', type=int, help="largest number of shards, the number of CPUs by default")
+    parser.add_argument('--packets', type=int, default=20000, help="PacketIns sent to each shard")
+    parser.add_argument('--cores', type=int, default=4)
+    parser.add_argument('--edges', type=int, default=16)
+    parser.add_argument('--hosts', type=int, default=16, help="hosts per edge switch")
+    args = parser.parse_args()
+
+    for result in benchmark(args.app, args.shards, args.packets, args.cores, args.edges, args.hosts):
+        print("{} shard(s): {:.0f} PacketIn/s (x{:.2f})".format(result['shards'], result['rate'], result['speedup']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+import pytest
+import misc.admission
+from misc.admission import TokenBucket, AdmissionControl
+from pox.lib.addresses import EthAddr
+from pox.lib.packet.ethernet import ethernet
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+
+class Connection(object):
+    def __init__(self, dpid):
+        self.dpid = dpid
+        self.sent = []
+
+    def send(self, msg):
+        self.sent.append(msg)
+
+
+class Packet(object):
+    def __init__(self, src, type=ethernet.IP_TYPE):
+        self.src = EthAddr(src)
+        self.type = type
+
+
+class PacketIn(object):
+    def __init__(self, connection, port, packet):
+        self.connection = connection
+        self.port = port
+        self.parsed = packet
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(misc.admission, 'time', clock)
+    monkeypatch.setattr(misc.admission, 'Timer', lambda *args, **kwargs: None)
+    return clock
+
+
+def test_bucket_starts_full():
+    bucket = TokenBucket(10, 5)
+    assert [bucket.take(0) for _ in range(6)] == [True] * 5 + [False]
+
+
+def test_bucket_refill_rate():
+    bucket = TokenBucket(10, 5)
+    for _ in range(5):
+        bucket.take(0)
+
+    assert not bucket.take(0.05)
+    assert bucket.take(0.1)
+    assert not bucket.take(0.1)
+    bucket.refill(0.35)
+    assert bucket.tokens == pytest.approx(2.5)
+
+
+def test_bucket_refill_capped_by_burst():
+    bucket = TokenBucket(10, 5)
+    bucket.take(0)
+    bucket.refill(100)
+    assert bucket.tokens == 5
+
+
+def test_bucket_reserve():
+    bucket = TokenBucket(10, 5)
+    assert [bucket.take(0, reserve=2) for _ in range(4)] == [True] * 3 + [False]
+    assert bucket.take(0)
+    assert bucket.take(0)
+    assert not bucket.take(0)
+
+
+def test_low_priority_leaves_reserve(clock):
+    admission = AdmissionControl(rate=10, burst=10, reserve=0.2)
+    connection = Connection(1)
+    flood = [admission.admit(PacketIn(connection, 1, Packet('00:00:00:00:00:01')), None) for _ in range(10)]
+    arp = [admission.admit(PacketIn(connection, 1, Packet('00:00:00:00:00:01', ethernet.ARP_TYPE)), None)
+           for _ in range(3)]
+
+    assert flood == [True] * 8 + [False] * 2
+    assert arp == [True] * 2 + [False]
+    assert admission.deferred == 3
+
+
+def test_queued_packet_ins_drained_on_refill(clock):
+    handled = []
+    admission = AdmissionControl(rate=10, burst=1, reserve=0)
+    connection = Connection(1)
+    events = [PacketIn(connection, 1, Packet('00:00:00:00:00:01')) for _ in range(3)]
+    assert [admission.admit(event, handled.append) for event in events] == [True, False, False]
+
+    clock.now = 0.1
+    admission._drain()
+    assert handled == events[1:2]
+    clock.now = 0.2
+    admission._drain()
+    assert handled == events[1:]
+    assert admission.queue_depth() == 0
+
+
+def test_sources_blocked_on_host_ports_only(clock):
+    admission = AdmissionControl(rate=1000, burst=1000, source_rate=5, host_port=lambda dpid, port: port == 1)
+    connection = Connection(1)
+    host = [admission.admit(PacketIn(connection, 1, Packet('00:00:00:00:00:01')), None) for _ in range(7)]
+    fabric = [admission.admit(PacketIn(connection, 2, Packet('00:00:00:00:00:02')), None) for _ in range(7)]
+
+    assert host == [True] * 5 + [False] * 2
+    assert fabric == [True] * 7
+    assert admission.blocked_sources == 1
+    assert len(connection.sent) == 1
+    assert connection.sent[0].match.in_port == 1
+
+    # Blocked until the drop flow expires
+    clock.now = admission.block_time + 1
+    assert admission.admit(PacketIn(connection, 1, Packet('00:00:00:00:00:01')), None)
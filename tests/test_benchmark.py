@@ -0,0 +1,51 @@
+import argparse
+import json
+import os
+import random
+import sys
+import pytest
+from misc.benchmark import MATRICES, benchmark, distribution
+
+# vlans.py imports tenants.py as a top-level module, as with ext/misc in the PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.mark.parametrize('name', sorted(MATRICES))
+def test_matrices(name):
+    matrix = MATRICES[name](32, 100, random.Random(0))
+    assert len(matrix) == 100
+    for src, dst, sport, dport, size, weight in matrix:
+        assert 0 <= src < 32 and 0 <= dst < 32 and src != dst
+        assert size > 0 and weight > 0
+    assert matrix == MATRICES[name](32, 100, random.Random(0))
+
+
+def test_distribution():
+    stats = distribution([1.0, 1.0, 1.0, 5.0])
+    assert (stats['mean'], stats['min'], stats['p50'], stats['max']) == (2.0, 1.0, 1.0, 5.0)
+    assert stats['fairness'] == pytest.approx(64.0 / (4 * 28))
+    assert distribution([])['fairness'] == 1.0
+
+
+def test_tiny_fabric_results():
+    # The apps run on the emulated fabric, with the POX events, discovery and packet libraries
+    pytest.importorskip('pox.host_tracker.host_tracker')
+
+    args = argparse.Namespace(apps=['tree', 'adaptive'], matrices=['uniform'], cores=2, edges=2, hosts=2,
+                              duration=1.0, rate=100, flows=10, interval=1.0, table_size=4096, seed=0)
+    output = json.loads(json.dumps(benchmark(args), sort_keys=True))
+
+    assert output['schema'] == 1
+    assert output['fabric'] == {'cores': 2, 'edges': 2, 'hosts_per_edge': 2, 'table_size': 4096}
+    assert [(r['app'], r['matrix']) for r in output['results']] == [('tree', 'uniform'), ('adaptive', 'uniform')]
+    for result in output['results']:
+        # Both directions of the 4 links between the edge and the core switches
+        assert len(result['link_loads']) == 8
+        assert '3:1-1:1' in result['link_loads'] and '1:1-3:1' in result['link_loads']
+        assert result['max_link_load'] == max(result['link_loads'].values())
+        assert set(result['link_load']) == {'mean', 'min', 'p50', 'p90', 'p99', 'max', 'fairness'}
+        assert result['controller_messages_per_flow'] > 0
+        assert result['flow_setups'] > 0
+        assert result['flow_setups_per_flow'] == pytest.approx(result['flow_setups'] / 10.0)
+        assert result['delivery_ratio'] == 1.0
+        assert result['looped'] == 0
@@ -0,0 +1,127 @@
+import pytest
+import pox.openflow.libopenflow_01 as of
+import misc.capacity
+from misc.capacity import CapacityManager, MAX_REQUESTS
+
+
+class Component(object):
+    def addListenerByName(self, name, handler):
+        pass
+
+
+class Core(object):
+    def __init__(self):
+        self.openflow = Component()
+
+
+class Connection(object):
+    def __init__(self, dpid):
+        self.dpid = dpid
+        self.sent = []
+
+    def send(self, msg):
+        self.sent.append(msg)
+
+    def flow_requests(self):
+        return [m for m in self.sent if isinstance(m, of.ofp_stats_request)
+                and isinstance(m.body, of.ofp_flow_stats_request)]
+
+
+class Match(object):
+    def __init__(self, dst):
+        self.dl_dst = dst
+
+    def pack(self):
+        return str(self.dl_dst).encode()
+
+
+class Stat(object):
+    def __init__(self, dst, packet_count, priority=of.OFP_DEFAULT_PRIORITY, duration_sec=60):
+        self.match = Match(dst)
+        self.packet_count = packet_count
+        self.priority = priority
+        self.duration_sec = duration_sec
+
+
+class TableStat(object):
+    def __init__(self, max_entries, active_count):
+        self.max_entries = max_entries
+        self.active_count = active_count
+
+
+class StatsEvent(object):
+    def __init__(self, connection, stats, xid=None):
+        self.connection = connection
+        self.stats = stats
+        self.ofp = [of.ofp_stats_reply(xid=xid)] if xid is not None else []
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    monkeypatch.setattr(misc.capacity, 'core', Core())
+    monkeypatch.setattr(misc.capacity, 'Timer', lambda *args, **kwargs: None)
+    evicted = []
+    manager = CapacityManager(interval=5, max_entries=10, on_evicted=lambda dpid, match: evicted.append(
+        (dpid, match.dl_dst)))
+    manager.evicted_matches = evicted
+    return manager
+
+
+def reply(manager, connection, stats):
+    xid = connection.flow_requests()[-1].xid
+    manager._handle_FlowStatsReceived(StatsEvent(connection, stats, xid))
+
+
+def test_evicts_coldest_flows_down_to_low_watermark(manager):
+    connection = Connection(1)
+    manager.watch(connection)
+    manager._handle_TableStatsReceived(StatsEvent(connection, [TableStat(100, 0)]))
+
+    # Traffic since the last poll: the flows 0 to 9 matched 0 to 9 packets, the static one is never evicted
+    stats = [Stat(i, i) for i in range(9)] + [Stat(100, 0, priority=of.OFP_DEFAULT_PRIORITY + 1)]
+    reply(manager, connection, stats)
+
+    deletes = [m for m in connection.sent if isinstance(m, of.ofp_flow_mod)]
+    assert [m.command for m in deletes] == [of.OFPFC_DELETE_STRICT] * 3
+    assert [m.match.dl_dst for m in deletes] == [0, 1, 2]
+    assert manager.evicted_matches == [(1, 0), (1, 1), (1, 2)]
+    assert manager.evicted == 3
+    assert manager.occupancy(1) == pytest.approx(0.7)
+
+
+def test_ranks_by_packets_since_previous_poll(manager):
+    connection = Connection(1)
+    manager.watch(connection)
+    manager._handle_TableStatsReceived(StatsEvent(connection, [TableStat(10, 0)]))
+    reply(manager, connection, [Stat(i, 1000 * i) for i in range(5)])
+    assert manager.evicted == 0
+
+    # The flow 4 was the busiest but matched no packet since, the flow 0 was idle but is now the busiest
+    manager._poll(connection)
+    reply(manager, connection, [Stat(0, 500), Stat(1, 1100), Stat(2, 2200), Stat(3, 3300), Stat(4, 4000)] +
+          [Stat(i, 1000) for i in range(5, 9)])
+    assert manager.evicted_matches == [(1, 4), (1, 1)]
+
+
+def test_young_flows_not_evicted(manager):
+    connection = Connection(1)
+    manager.watch(connection)
+    manager._handle_TableStatsReceived(StatsEvent(connection, [TableStat(10, 0)]))
+    reply(manager, connection, [Stat(i, 0, duration_sec=1) for i in range(10)])
+
+    assert manager.evicted == 0
+    assert 1 in manager.stats()['under_pressure']
+    assert manager.reserve(1)
+
+
+def test_unanswered_requests_forgotten(manager):
+    connection = Connection(1)
+    manager.watch(connection)
+    for _ in range(10):
+        manager._poll(connection)
+    requests = connection.flow_requests()
+
+    assert len(manager._requests[1]) == MAX_REQUESTS
+    assert not manager.requested(StatsEvent(connection, [], requests[0].xid))
+    assert manager.requested(StatsEvent(connection, [], requests[-1].xid))
+    assert not manager.requested(StatsEvent(connection, [], 0))
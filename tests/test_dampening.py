@@ -0,0 +1,98 @@
+import pytest
+import misc.dampening
+from misc.dampening import LinkDampener
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+
+class Link(object):
+    def __init__(self, dpid1, port1, dpid2, port2):
+        self.dpid1, self.port1, self.dpid2, self.port2 = dpid1, port1, dpid2, port2
+
+
+class LinkEvent(object):
+    def __init__(self, link, added):
+        self.link = link
+        self.added = added
+        self.removed = not added
+
+
+UP = Link(1, 1, 2, 1)
+DOWN = Link(2, 1, 1, 1)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(misc.dampening, 'time', clock)
+    monkeypatch.setattr(misc.dampening, 'Timer', lambda *args, **kwargs: None)
+    return clock
+
+
+def flap(dampener, count):
+    """
+    Takes the link down and up again count times, in both directions.
+    """
+    for _ in range(count):
+        for added in (False, True):
+            for link in (UP, DOWN):
+                dampener.handle(LinkEvent(link, added))
+
+
+def test_penalty_decays_by_half_life(clock):
+    dampener = LinkDampener(lambda event: None, half_life=15)
+    dampener._add_penalty('key', clock.now)
+
+    assert dampener._current('key', 0) == 500
+    assert dampener._current('key', 15) == pytest.approx(250)
+    assert dampener._current('key', 45) == pytest.approx(62.5)
+    assert dampener._current('other', 45) == 0
+
+
+def test_penalty_capped_by_max_suppress(clock):
+    dampener = LinkDampener(lambda event: None, half_life=15, reuse=750, max_suppress=60)
+    for _ in range(100):
+        dampener._add_penalty('key', clock.now)
+
+    assert dampener._current('key', 0) == pytest.approx(750 * 16)
+
+
+def test_flapping_link_held_until_reuse(clock):
+    events = []
+    dampener = LinkDampener(events.append, half_life=15, penalty=1000, suppress=2000, reuse=750)
+    flap(dampener, 2)
+    assert len(events) == 8
+
+    # The third flap brings the penalty to 3000: the link is reported down but held up
+    flap(dampener, 1)
+    assert [event.added for event in events[8:]] == [False, False]
+    assert dampener.held == 2
+    assert len(dampener.suppressed()) == 1
+
+    # 3000 decays below 750 after two half lives
+    clock.now = 29
+    dampener._release()
+    assert len(events) == 10
+    clock.now = 31
+    dampener._release()
+    assert [event.added for event in events[10:]] == [True, True]
+    assert dampener.released == 2
+    assert dampener.suppressed() == []
+
+
+def test_down_while_held_not_reported(clock):
+    events = []
+    dampener = LinkDampener(events.append, half_life=15, penalty=1000, suppress=2000, reuse=750)
+    flap(dampener, 3)
+    dampener.handle(LinkEvent(UP, False))
+    dampener.handle(LinkEvent(DOWN, False))
+
+    assert len(events) == 10
+    assert dampener.avoided == 4
+    assert dampener.suppressed() == []
@@ -0,0 +1,158 @@
+import pytest
+import pox.openflow.libopenflow_01 as of
+import misc.dedup
+from misc.dedup import FloodDedup
+from misc.graph import Topology
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+
+class Connection(object):
+    def __init__(self, dpid):
+        self.dpid = dpid
+        self.sent = []
+
+    def send(self, msg):
+        self.sent.append(msg)
+
+
+class Switch(object):
+    def __init__(self, dpid, ports):
+        self.connection = Connection(dpid)
+        self.tracer = None
+        self.mac_to_port = {}
+        self.ports = ports
+
+    def tree_ports(self, tree):
+        return self.ports
+
+
+def packet_in(in_port, data):
+    return of.ofp_packet_in(in_port=in_port, data=data)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(misc.dedup, 'time', clock)
+    return clock
+
+
+def fabric(window=0.5):
+    """
+    Return:
+    -------
+        A flood cache on the core 1 linked to the edges 3 (hosts on the ports 10 and 11) and 4 (host on the port 10),
+        and the switch controllers by dpid.
+    """
+    topology = Topology([1])
+    topology.add_link(1, 3, 3, 1)
+    topology.add_link(1, 4, 4, 1)
+    dedup = FloodDedup(topology, window)
+    switches = {1: Switch(1, [3, 4]), 3: Switch(3, [1, 10, 11]), 4: Switch(4, [1, 10])}
+    for switch in switches.values():
+        dedup.register(switch)
+    return dedup, switches
+
+
+def ports(switch):
+    return [[a.port for a in msg.actions] for msg in switch.connection.sent]
+
+
+def test_flood_plan_reaches_every_host_port(clock):
+    dedup, switches = fabric()
+    assert dedup.flood(switches[3], packet_in(10, b'arp'), 'tree', src='h1')
+
+    assert ports(switches[3]) == [[11]]
+    assert ports(switches[1]) == []
+    assert ports(switches[4]) == [[10]]
+    # The switches learn the port of the source towards the ingress switch
+    assert switches[1].mac_to_port == {'h1': 3}
+    assert switches[4].mac_to_port == {'h1': 1}
+    assert switches[3].mac_to_port == {}
+
+
+def test_echoes_suppressed_within_window(clock):
+    dedup, switches = fabric(window=0.5)
+    dedup.flood(switches[3], packet_in(10, b'arp'), 'tree')
+
+    clock.now = 0.4
+    assert dedup.duplicate(switches[4], packet_in(1, b'arp'), 'tree')
+    assert dedup.duplicate(switches[1], packet_in(3, b'arp'), 'tree')
+    # Another packet, another tree, or the same packet sent again by a host are not echoes
+    assert not dedup.duplicate(switches[4], packet_in(1, b'other'), 'tree')
+    assert not dedup.duplicate(switches[4], packet_in(1, b'arp'), 'other tree')
+    assert not dedup.duplicate(switches[3], packet_in(10, b'arp'), 'tree')
+    assert dedup.suppressed == 2
+
+    clock.now = 0.6
+    assert not dedup.duplicate(switches[4], packet_in(1, b'arp'), 'tree')
+    assert dedup.stats()['cached'] == 0
+
+
+def test_packet_sent_again_by_host_is_not_echo(clock):
+    dedup, switches = fabric(window=0.5)
+    dedup.flood(switches[3], packet_in(10, b'arp'), 'tree')
+
+    # The host sends the same packet again, towards a destination learned meanwhile: its copy crossing the fabric
+    # must reach the next switch
+    clock.now = 0.1
+    assert not dedup.duplicate(switches[3], packet_in(10, b'arp'), 'tree')
+    assert not dedup.duplicate(switches[1], packet_in(3, b'arp'), 'tree')
+
+    # Without topology, the caller tells where the packet comes from
+    dedup = FloodDedup(None, 0.5)
+    for switch in switches.values():
+        dedup.register(switch)
+    dedup.flood(switches[3], packet_in(10, b'arp'), None)
+    assert dedup.duplicate(switches[4], packet_in(1, b'arp'), None, True)
+    assert not dedup.duplicate(switches[3], packet_in(10, b'arp'), None, False)
+    assert not dedup.duplicate(switches[4], packet_in(1, b'arp'), None, True)
+
+
+def test_flood_from_fabric_port_left_to_switch(clock):
+    dedup, switches = fabric()
+    assert not dedup.flood(switches[4], packet_in(1, b'arp'), 'tree')
+    assert dedup.fallbacks == 1
+    assert all(not s.connection.sent for s in switches.values())
+
+
+def test_incomplete_plan_left_to_switch(clock):
+    dedup, switches = fabric()
+    switches[4].ports = None
+    assert not dedup.flood(switches[3], packet_in(10, b'arp'), 'tree')
+
+    # The tree applied on the switch is picked up once the plans are invalidated
+    switches[4].ports = [1, 10]
+    dedup.invalidate()
+    assert dedup.flood(switches[3], packet_in(10, b'arp'), 'tree')
+
+
+def test_plans_recompiled_on_topology_change(clock):
+    dedup, switches = fabric()
+    dedup.flood(switches[3], packet_in(10, b'a'), 'tree')
+    dedup.flood(switches[3], packet_in(10, b'b'), 'tree')
+    assert dedup.plans_compiled == 1
+
+    # The link to the edge 4 goes down: the new plan does not reach it anymore
+    dedup.topology.remove_link(1, 4, 4, 1)
+    dedup.flood(switches[3], packet_in(10, b'c'), 'tree')
+    assert dedup.plans_compiled == 2
+    assert ports(switches[4]) == [[10], [10]]
+
+
+def test_cache_bounded(clock):
+    dedup, switches = fabric()
+    dedup.max_entries = 3
+    for i in range(5):
+        dedup.flood(switches[3], packet_in(10, str(i).encode()), 'tree')
+
+    assert dedup.stats()['cached'] == 3
+    assert not dedup.duplicate(switches[4], packet_in(1, b'0'), 'tree')
+    assert dedup.duplicate(switches[4], packet_in(1, b'4'), 'tree')
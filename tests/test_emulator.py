@@ -0,0 +1,81 @@
+import os
+import sys
+import threading
+import pytest
+
+# The emulator runs the controllers on the POX event loop, with the POX events, discovery and packet libraries
+pytest.importorskip('pox.host_tracker.host_tracker')
+
+# vlans.py imports tenants.py as a top-level module, as with ext/misc in the PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from misc.emulator import Emulator, FlowTable, FlowEntry, create_controller
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+
+
+def flow_mod(dst, port, priority=of.OFP_DEFAULT_PRIORITY, src=None):
+    msg = of.ofp_flow_mod(priority=priority)
+    msg.match.dl_dst = dst
+    if src is not None:
+        msg.match.dl_src = src
+    msg.actions.append(of.ofp_action_output(port=port))
+    return msg
+
+
+def test_flow_table_priorities():
+    table = FlowTable(2)
+    coarse = FlowEntry(flow_mod("00:00:00:00:00:02", 1, priority=10), 0)
+    fine = FlowEntry(flow_mod("00:00:00:00:00:02", 2, priority=20, src="00:00:00:00:00:01"), 0)
+    assert table.add(coarse) and table.add(fine)
+    assert not table.add(FlowEntry(flow_mod("00:00:00:00:00:03", 3), 0))
+
+    fields = (5, of.ofp_match(dl_src="00:00:00:00:00:01").dl_src, fine.fields[2]) + (None,) * 9
+    assert table.lookup(fields) is fine
+    table.remove([fine])
+    assert table.lookup(fields) is coarse
+    assert len(table) == 1
+
+
+@pytest.mark.parametrize('app', ['tree', 'vlan', 'adaptive'])
+def test_small_fabric(app):
+    emulator = Emulator(2, 2, 2)
+    create_controller(app, emulator.core_ids)
+    metrics = emulator.run(1.0, 200, 10, warmup=0.2)
+
+    assert (metrics['switches'], metrics['hosts'], metrics['flows']) == (4, 4, 10)
+    assert metrics['sent'] == 200
+    assert metrics['delivered'] == metrics['sent']
+    assert metrics['looped'] == 0
+    # The first packets reach the controller, the next ones follow the installed flows
+    assert 0 < metrics['packet_ins'] < metrics['sent']
+    assert metrics['flow_mods'] > 0
+    assert 0 < metrics['flows_max'] <= 4 * 4096
+    assert metrics['controller_cpu'] > 0
+
+    # Every direction of the 4 links between the edge and the core switches has a load
+    loads = emulator.link_loads()
+    assert len(loads) == 8
+    assert sum(loads.values()) > 0
+
+
+def test_adaptive_next_hops_follow_link_events():
+    emulator = Emulator(2, 2, 2)
+    controller = create_controller('adaptive', emulator.core_ids)
+    emulator.connect(warmup=0)
+    edge = controller.switch_controllers[3]
+    down = controller.topology.port(1, 4)
+    assert controller.paths.next_hops(3, 4) == frozenset([1, 2])
+    assert edge._path_endpoints(1, 4) == [(3, 1), (1, down)]
+
+    # The link between the core 1 and the edge 4 goes down: the core 1 can not reach the edge 4 anymore
+    done = threading.Event()
+
+    def link_down():
+        emulator.link_down(1, down, 4, 1)
+        done.set()
+    core.callLater(link_down)
+    assert done.wait(10)
+
+    assert controller.paths.generation == controller.topology.generation
+    assert controller.paths.next_hops(3, 4) == frozenset([2])
+    assert edge._path_endpoints(1, 4) == [(3, 1)]
@@ -0,0 +1,101 @@
+import pytest
+import pox.openflow.libopenflow_01 as of
+import misc.failover
+from misc.failover import FailoverManager
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def time(self):
+        return self.now
+
+
+class Connection(object):
+    def __init__(self, dpid):
+        self.dpid = dpid
+        self.sent = []
+
+    def send(self, msg):
+        self.sent.append(msg)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(misc.failover, 'time', clock)
+    return clock
+
+
+def test_link_down_moves_flows_to_backup(clock):
+    failover = FailoverManager()
+    edge = Connection(10)
+    failover.record(edge, 'a', 'match a', 1, [(10, 1), (1, 3)], 2, [(10, 2), (2, 3)])
+    failover.record(edge, 'b', 'match b', 2, [(10, 2), (2, 3)], 1, [(10, 1), (1, 3)])
+
+    assert failover.link_removed((1, 3), (10, 1)) == 1
+    msg = edge.sent[0]
+    assert msg.command == of.OFPFC_MODIFY_STRICT
+    assert msg.match == 'match a'
+    assert [a.port for a in msg.actions] == [2]
+    assert msg.flags & of.OFPFF_SEND_FLOW_REM
+
+    # The backup is now the primary path, without backup left
+    assert failover.decisions[(10, 'a')][2] == 2
+    assert failover.decisions[(10, 'a')][4] is None
+
+
+def test_other_direction_already_handled(clock):
+    failover = FailoverManager()
+    edge = Connection(10)
+    failover.record(edge, 'a', 'match a', 1, [(10, 1)], 2, [(10, 2)])
+
+    assert failover.link_removed((1, 3), (10, 1)) == 1
+    assert failover.link_removed((10, 1), (1, 3)) == 0
+    assert len(edge.sent) == 1
+
+
+def test_backup_down_removes_flow(clock):
+    failover = FailoverManager()
+    edge = Connection(10)
+    failover.record(edge, 'a', 'match a', 1, [(10, 1)], 2, [(10, 2)])
+    failover.link_removed((2, 3), (10, 2))
+    assert edge.sent == []
+
+    failover.link_removed((1, 3), (10, 1))
+    assert [m.command for m in edge.sent] == [of.OFPFC_DELETE_STRICT]
+    assert failover.decisions == {}
+
+    # The link coming back makes the endpoints usable again
+    failover.link_added((2, 3), (10, 2))
+    failover.record(edge, 'a', 'match a', 1, [(10, 1)], 2, [(10, 2)])
+    failover.link_added((1, 3), (10, 1))
+    failover.link_removed((1, 3), (10, 1))
+    assert edge.sent[-1].command == of.OFPFC_MODIFY_STRICT
+
+
+def test_forgotten_flow_not_reinstalled(clock):
+    failover = FailoverManager()
+    edge = Connection(10)
+    failover.record(edge, 'a', 'match a', 1, [(10, 1)], 2, [(10, 2)])
+    failover.record(edge, 'b', 'match b', 1, [(10, 1)], 2, [(10, 2)])
+    failover.forget(10, 'a')
+    failover.forget_where(lambda key: key == 'b')
+
+    assert failover.link_removed((1, 3), (10, 1)) == 0
+    assert failover.decisions == {} and failover._by_endpoint == {}
+
+
+def test_convergence_measured_from_event(clock):
+    failover = FailoverManager(history=2)
+    edge = Connection(10)
+    failover.record(edge, 'a', 'match a', 1, [(10, 1)], 2, [(10, 2)])
+    failover.link_removed((1, 3), (10, 1), received=clock.now - 0.25)
+
+    assert failover.convergence[-1] == (((1, 3), (10, 1)), pytest.approx(0.25), 1)
+
+    failover.link_removed((1, 4), (11, 1))
+    failover.link_removed((1, 5), (12, 1))
+    assert len(failover.convergence) == 2
+    assert failover.convergence[-1][1] == 0
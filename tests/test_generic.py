@@ -0,0 +1,72 @@
+import pytest
+import misc.generic
+from misc.generic import CentralController
+from misc.warmstart import RestoredLink
+
+
+class Component(object):
+    def addListenerByName(self, name, handler):
+        pass
+
+
+class Core(object):
+    def __init__(self):
+        self.openflow = Component()
+        self.openflow_discovery = Component()
+
+
+class LinkEvent(object):
+    def __init__(self, dpid1, port1, dpid2, port2, added):
+        self.link = RestoredLink(dpid1, port1, dpid2, port2)
+        self.added = added
+        self.removed = not added
+
+
+class Channel(object):
+    def __init__(self, writer):
+        self.writer = writer
+        self.published = []
+
+    def publish(self, topic, payload):
+        self.published.append((topic, payload))
+
+
+@pytest.fixture
+def controller(monkeypatch):
+    monkeypatch.setattr(misc.generic, 'core', Core())
+    return CentralController([1, 2])
+
+
+def test_writer_broadcasts_topology(controller):
+    controller.channel = Channel(True)
+    assert controller._handle_LinkEvent(LinkEvent(3, 1, 1, 1, True))
+    assert not controller._handle_LinkEvent(LinkEvent(1, 1, 3, 1, True))
+
+    assert controller.channel.published == [('topology', [(1, 3, 1, 1)])]
+
+
+def test_reader_mirrors_writer_topology(controller):
+    controller.channel = Channel(False)
+    assert not controller._handle_LinkEvent(LinkEvent(3, 1, 1, 1, True))
+    assert controller.channel.published == [('link', (3, 1, 1, 1, True))]
+    assert controller.topology.links() == []
+
+    controller._handle_shared_topology([(1, 3, 1, 1), (2, 3, 1, 2)])
+    assert sorted(controller.topology.links()) == [(1, 3, 1, 1), (2, 3, 1, 2)]
+    controller._handle_shared_topology([(2, 3, 1, 2)])
+    assert controller.topology.links() == [(2, 3, 1, 2)]
+
+
+def test_reader_host_ports(controller):
+    controller.channel = Channel(False)
+    controller._handle_LinkEvent(LinkEvent(3, 1, 1, 1, True))
+
+    # Nothing is known of the switch until the writer sends its topology
+    assert not controller._host_port(3, 1)
+    assert not controller._host_port(3, 3)
+
+    controller._handle_shared_topology([(1, 3, 1, 1), (2, 3, 1, 2)])
+    assert not controller._host_port(3, 1)
+    assert not controller._host_port(3, 2)
+    assert controller._host_port(3, 3)
+    assert not controller._host_port(1, 3)
@@ -0,0 +1,96 @@
+import random
+from misc.graph import Topology
+from misc.paths import PathEngine
+
+CORES = [1, 2]
+AGGREGATIONS = [10, 11, 12, 13]
+EDGES = list(range(100, 108))
+
+
+def all_links():
+    """
+    Return:
+    -------
+        The links of a three-tier Clos with two pods, the port of a link on a switch being the id of the other end.
+    """
+    links = [(c, a) for c in CORES for a in AGGREGATIONS]
+    links += [(a, e) for a in AGGREGATIONS[:2] for e in EDGES[:4]]
+    links += [(a, e) for a in AGGREGATIONS[2:] for e in EDGES[4:]]
+    return links
+
+
+def three_tier():
+    topology = Topology(CORES)
+    for id1, id2 in all_links():
+        topology.add_link(id1, id2, id2, id1)
+    return topology
+
+
+def results(engine):
+    """
+    Return:
+    -------
+        The paths and the next hops of every switch for every pair of edge switches.
+    """
+    paths = dict(((src, dst), engine.paths(src, dst)) for src in EDGES for dst in EDGES)
+    next_hops = dict(((id, dst), engine.next_hops(id, dst)) for id in CORES + AGGREGATIONS + EDGES for dst in EDGES)
+    return paths, next_hops
+
+
+def test_paths_of_three_tier_clos():
+    engine = PathEngine(three_tier(), AGGREGATIONS)
+
+    assert engine.edges() == EDGES
+    assert engine.paths(100, 101) == [(100, 10, 101), (100, 11, 101)]
+    assert len(engine.paths(100, 104)) == 8
+    assert engine.next_hops(100, 104) == frozenset([10, 11])
+    assert engine.next_hops(10, 104) == frozenset([1, 2])
+    assert engine.paths(100, 100) == []
+
+
+def test_incremental_matches_fresh():
+    rng = random.Random(0)
+    topology = three_tier()
+    engine = PathEngine(topology, AGGREGATIONS)
+    links = all_links()
+    up = set(links)
+
+    for _ in range(200):
+        results(engine)
+        id1, id2 = rng.choice(links)
+        if (id1, id2) in up:
+            topology.remove_link(id1, id2, id2, id1)
+            up.discard((id1, id2))
+        else:
+            topology.add_link(id1, id2, id2, id1)
+            up.add((id1, id2))
+        engine.link_changed(id1, id2, (id1, id2) in up)
+
+        assert engine.generation == topology.generation
+        assert results(engine) == results(PathEngine(topology, AGGREGATIONS))
+
+
+def test_removal_keeps_unaffected_pairs():
+    topology = three_tier()
+    engine = PathEngine(topology, AGGREGATIONS)
+    engine.precompute()
+
+    topology.remove_link(10, 100, 100, 10)
+    engine.link_changed(10, 100, False)
+
+    assert (101, 102) in engine._paths
+    assert (100, 101) not in engine._paths
+    assert engine.paths(100, 101) == [(100, 11, 101)]
+
+
+def test_missed_change_flushes():
+    topology = three_tier()
+    engine = PathEngine(topology, AGGREGATIONS)
+    engine.precompute()
+
+    topology.remove_link(10, 100, 100, 10)
+    topology.remove_link(11, 100, 100, 11)
+    engine.link_changed(11, 100, False)
+
+    assert engine._paths == {}
+    assert engine.paths(100, 101) == []
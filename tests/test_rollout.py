@@ -0,0 +1,152 @@
+import os
+import sys
+import pytest
+import pox.openflow.libopenflow_01 as of
+import misc.rollout
+from misc.rollout import BlockedPortsRollout
+
+# vlans.py imports tenants.py as a top-level module, as with ext/misc in the PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from misc.vlans import VLANController
+
+
+class Component(object):
+    def addListenerByName(self, name, handler):
+        pass
+
+
+class Core(object):
+    def __init__(self):
+        self.openflow = Component()
+
+
+class Timer(object):
+    def __init__(self, delay, callback):
+        self.delay = delay
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Connection(object):
+    def __init__(self, dpid, log):
+        self.dpid = dpid
+        self.log = log
+
+    def send(self, msg):
+        self.log.append((self.dpid, msg))
+
+
+class BarrierIn(object):
+    def __init__(self, connection, xid):
+        self.connection = connection
+        self.xid = xid
+
+
+@pytest.fixture
+def rollout(monkeypatch):
+    monkeypatch.setattr(misc.rollout, 'core', Core())
+    monkeypatch.setattr(misc.rollout, 'Timer', Timer)
+    return BlockedPortsRollout()
+
+
+def updates(log, blocked):
+    """
+    Return:
+    -------
+        The updates of rollout.start() for switches numbered from 1, with the ports they newly block. The phases
+        applied are logged.
+    """
+    return [(Connection(dpid, log), ports, lambda dpid=dpid: log.append((dpid, 'block')),
+             lambda dpid=dpid: log.append((dpid, 'unblock'))) for dpid, ports in enumerate(blocked, 1)]
+
+
+def barriers(log):
+    return [(dpid, msg) for dpid, msg in log if isinstance(msg, of.ofp_barrier_request)]
+
+
+def test_unblock_after_every_barrier(rollout):
+    log = []
+    rollout.start(updates(log, [[2], [], [1, 3]]))
+
+    # First phase: every switch blocks the union, removes the flows of its newly blocked ports, then sends a barrier
+    assert [entry[1] for entry in log if entry[1] in ('block', 'unblock')] == ['block'] * 3
+    flow_mods = [(dpid, msg.out_port) for dpid, msg in log if isinstance(msg, of.ofp_flow_mod)]
+    assert flow_mods == [(1, 2), (3, 1), (3, 3)]
+    assert [dpid for dpid, msg in barriers(log)] == [1, 3]
+    for dpid in (1, 3):
+        sent = [msg for d, msg in log if d == dpid and not isinstance(msg, str)]
+        assert isinstance(sent[-1], of.ofp_barrier_request)
+
+    first, last = barriers(log)
+    rollout._handle_BarrierIn(BarrierIn(Connection(first[0], log), first[1].xid))
+    assert (1, 'unblock') not in log
+
+    # Unrelated barriers are ignored
+    rollout._handle_BarrierIn(BarrierIn(Connection(2, log), 0))
+    assert (1, 'unblock') not in log
+
+    rollout._handle_BarrierIn(BarrierIn(Connection(last[0], log), last[1].xid))
+    assert log[-3:] == [(1, 'unblock'), (2, 'unblock'), (3, 'unblock')]
+    assert rollout._timer is None
+    assert rollout.stats()['rollouts'] == 1
+    assert not rollout.stats()['in_progress']
+
+
+def test_nothing_newly_blocked_finishes_at_once(rollout):
+    log = []
+    rollout.start(updates(log, [[], []]))
+
+    assert log == [(1, 'block'), (2, 'block'), (1, 'unblock'), (2, 'unblock')]
+    assert rollout.rollouts == 1
+
+
+def test_new_rollout_supersedes_pending_one(rollout):
+    log = []
+    rollout.start(updates(log, [[1]]))
+    old = barriers(log)[0]
+    timer = rollout._timer
+
+    rollout.start(updates(log, [[2]]))
+    assert timer.cancelled
+    assert rollout.superseded == 1
+
+    # The barrier of the superseded rollout does not trigger the second phase
+    rollout._handle_BarrierIn(BarrierIn(Connection(1, log), old[1].xid))
+    assert log.count((1, 'unblock')) == 0
+
+    new = barriers(log)[-1]
+    rollout._handle_BarrierIn(BarrierIn(Connection(1, log), new[1].xid))
+    assert log.count((1, 'unblock')) == 1
+
+
+def test_timeout_unblocks_anyway(rollout):
+    log = []
+    rollout.start(updates(log, [[1], [2]]))
+    rollout._timer.callback()
+
+    assert log[-2:] == [(1, 'unblock'), (2, 'unblock')]
+    assert rollout.timeouts == 1
+    assert not rollout.stats()['in_progress']
+
+
+def test_vlan_union_per_vlan():
+    # The VLAN 10 moves from the core 1 to the core 2, the VLAN 20 stays on the core 2
+    current_vlans = {10: 1, 20: 2}
+    current_trees = {1: {5: [1]}, 2: {5: [2, 3]}}
+    vlan_to_core = {10: 2, 20: 2}
+    core_to_ports = {2: {5: [3, 4]}}
+    vlans, union, blocked = VLANController._union_trees(current_vlans, current_trees, vlan_to_core, core_to_ports, 5)
+
+    assert vlans == {10: 10, 20: 20}
+    assert union == {10: {5: [1, 3, 4]}, 20: {5: [2, 3, 4]}}
+    assert blocked == set([3, 4])
+
+
+def test_vlan_union_without_current_trees():
+    vlans, union, blocked = VLANController._union_trees(None, {}, {10: 1}, {1: {5: [2]}}, 5)
+
+    assert union == {10: {5: [2]}}
+    assert blocked == set([2])
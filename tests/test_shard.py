@@ -0,0 +1,96 @@
+import json
+import os
+import threading
+import time
+import pytest
+from misc.graph import Topology
+from misc.shard import ShardChannel, benchmark, encode, decode, owner, _private_directory
+
+
+def roundtrip(obj):
+    return decode(json.loads(json.dumps(encode(obj))))
+
+
+def test_codec_roundtrip():
+    payload = {'trees': {1: [2, 3], (4, 5): (6, 7)}, 'blocked': set([(1, 2), (3, 4)]), 'load': 0.5, 'name': None,
+               'hosts': [[1, 'ab'], (2, True)]}
+    assert roundtrip(payload) == payload
+
+
+def test_codec_topology():
+    topology = Topology([1, 2])
+    topology.add_link(1, 100, 100, 1)
+    topology.add_link(2, 100, 101, 2)
+    restored = roundtrip(topology)
+
+    assert isinstance(restored, Topology)
+    assert restored.cores_id == [1, 2]
+    assert sorted(restored.links()) == sorted(topology.links())
+
+
+def test_codec_rejects_unknown_types():
+    with pytest.raises(TypeError):
+        encode(object())
+    with pytest.raises(ValueError):
+        decode({'x': 1})
+
+
+def test_private_directory(tmpdir):
+    path = os.path.join(str(tmpdir), 'shards', 'shards.sock')
+    _private_directory(path)
+    assert os.stat(os.path.dirname(path)).st_mode & 0o777 == 0o700
+
+    os.chmod(os.path.dirname(path), 0o755)
+    with pytest.raises(OSError):
+        _private_directory(path)
+
+
+def test_owner_partitions_by_dpid():
+    assert [owner(dpid, 3) for dpid in range(1, 7)] == [1, 2, 0, 1, 2, 0]
+
+
+def test_concurrent_frames_do_not_interleave(tmpdir):
+    path = os.path.join(str(tmpdir), 'shards', 'shards.sock')
+    received = []
+    done = threading.Event()
+
+    def handle(payload):
+        received.append(payload)
+        if len(received) == 100:
+            done.set()
+
+    writer = ShardChannel(path, True, lambda f, *args: f(*args))
+    relayed = ShardChannel(path, False, lambda f, *args: f(*args))
+    reader = ShardChannel(path, False, lambda f, *args: f(*args))
+    reader.subscribe('bulk', handle)
+    while len(writer._peers) < 2:
+        time.sleep(0.01)
+
+    # The writer publishes while it relays the frames of the other shard, on the same sockets
+    big = list(range(20000))
+    threads = [threading.Thread(target=lambda c=c: [c.publish('bulk', (c.writer, big)) for _ in range(50)])
+               for c in (writer, relayed)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert done.wait(10)
+    assert sorted(writer for writer, _ in received) == [False] * 50 + [True] * 50
+    assert all(payload == big for _, payload in received)
+    for channel in (reader, relayed, writer):
+        channel.close()
+
+
+def test_benchmark_reports_throughput_per_shard_count(tmpdir):
+    # The shards run the controllers on the emulated fabric, with the POX events, discovery and packet libraries
+    pytest.importorskip('pox.host_tracker.host_tracker')
+
+    results = benchmark('tree', 2, packets=200, cores=2, edges=4, hosts=2,
+                        path=os.path.join(str(tmpdir), 'shards', 'shards.sock'))
+
+    # Every shard owns edge switches, and handles all the PacketIns sent to them
+    assert [(r['shards'], r['packet_ins']) for r in results] == [(1, 200), (2, 400)]
+    assert all(r['rate'] > 0 for r in results)
+    assert results[0]['speedup'] == 1.0
+    assert results[1]['speedup'] == pytest.approx(results[1]['rate'] / results[0]['rate'])
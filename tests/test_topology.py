@@ -0,0 +1,87 @@
+import random
+from misc.topology import Topology
+
+
+def clos(cores, edges, order=None):
+    """
+    Return:
+    -------
+        A two-tier Clos, every core linked to every edge, the links added in the given order.
+    """
+    links = [(c, e, e, c) for c in range(1, cores + 1) for e in range(100, 100 + edges)]
+    if order is not None:
+        order.shuffle(links)
+    topology = Topology()
+    for link in links:
+        topology.add_link(*link)
+    return topology
+
+
+def components(nodes, links):
+    """
+    Return:
+    -------
+        The number of connected components, and False if the links contain a cycle.
+    """
+    parent = dict((id, id) for id in nodes)
+
+    def find(id):
+        while parent[id] != id:
+            id = parent[id]
+        return id
+
+    acyclic = True
+    for link in links:
+        root1, root2 = find(link[0]), find(link[1])
+        if root1 == root2:
+            acyclic = False
+        else:
+            parent[root1] = root2
+    return len(set(find(id) for id in nodes)), acyclic
+
+
+def test_spanning_tree_of_clos():
+    topology = clos(4, 8)
+    tree = topology.spanning_tree()
+
+    assert tree.is_connected()
+    assert len(tree._links) == len(topology._nodes) - 1
+    assert tree._links <= topology._links
+    assert components(topology._nodes, tree._links) == (1, True)
+
+
+def test_spanning_tree_is_deterministic():
+    trees = set(clos(3, 6, random.Random(seed)).spanning_tree().to_str() for seed in range(5))
+    assert len(trees) == 1
+
+
+def test_spanning_forest_of_disconnected_topology():
+    topology = clos(2, 3)
+    topology.add_link(200, 201, 1, 1)
+    topology.add_link(201, 202, 2, 1)
+    topology.add_link(202, 200, 2, 2)
+    tree = topology.spanning_tree()
+
+    assert not tree.is_connected()
+    assert components(topology._nodes, tree._links) == (2, True)
+    assert len(tree._links) == len(topology._nodes) - 2
+
+
+def test_parallel_links_keep_one():
+    topology = Topology()
+    topology.add_link(1, 2, 1, 1)
+    topology.add_link(1, 2, 2, 2)
+    tree = topology.spanning_tree()
+
+    assert tree._links == set([(1, 2, 1, 1)])
+
+
+def test_spanning_tree_after_link_removal():
+    topology = clos(2, 4)
+    for e in range(100, 104):
+        topology.remove_link(1, e, e, 1)
+    tree = topology.spanning_tree()
+
+    assert not topology.is_connected()
+    assert components(topology._nodes, tree._links) == (2, True)
+    assert all(1 not in link[:2] for link in tree._links)
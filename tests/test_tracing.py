@@ -0,0 +1,85 @@
+import pytest
+import misc.tracing
+from misc.tracing import FlowTracer, LatencyHistogram, FLOW_MOD, PACKET_OUT
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+
+class Core(object):
+    def __init__(self):
+        self.openflow = self
+
+    def addListenerByName(self, name, handler):
+        pass
+
+
+class Connection(object):
+    def __init__(self, dpid):
+        self.dpid = dpid
+        self.sent = []
+
+    def send(self, msg):
+        self.sent.append(msg)
+
+
+class PacketIn(object):
+    def __init__(self, connection):
+        self.connection = connection
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(misc.tracing, 'time', clock)
+    monkeypatch.setattr(misc.tracing, 'core', Core())
+    return clock
+
+
+def test_histogram_percentiles():
+    histogram = LatencyHistogram()
+    for latency in (0.001, 0.002, 0.003, 0.1):
+        histogram.add(latency)
+
+    assert histogram.count == 4
+    assert histogram.mean() == pytest.approx(0.0265)
+    assert histogram.percentile(50) <= histogram.percentile(99) <= histogram.maximum == 0.1
+    assert LatencyHistogram.from_dict(histogram.to_dict()).count == 4
+
+
+def test_flow_setup_latency(clock):
+    tracer = FlowTracer('tree')
+    connection = Connection(1)
+    tracer.packet_in(PacketIn(connection))
+    clock.now = 0.002
+    tracer.packet_out(connection)
+    clock.now = 0.003
+    tracer.flow_mod(connection)
+
+    assert tracer.histograms[(PACKET_OUT, 1)].maximum == pytest.approx(0.002)
+    assert tracer.histograms[(FLOW_MOD, 1)].maximum == pytest.approx(0.003)
+    assert len(connection.sent) == 1
+
+
+def test_rejected_packet_in_not_charged_to_next_messages(clock):
+    tracer = FlowTracer('tree')
+    connection = Connection(1)
+    queued = PacketIn(connection)
+    tracer.packet_in(queued)
+    tracer.rejected(queued)
+
+    # A flow_mod sent for something else while the PacketIn waits
+    clock.now = 1.0
+    tracer.flow_mod(connection)
+    assert tracer.histograms == {}
+
+    # The PacketIn handled after waiting keeps its first timestamp
+    clock.now = 1.5
+    tracer.packet_in(queued)
+    tracer.flow_mod(connection)
+    assert tracer.histograms[(FLOW_MOD, 1)].maximum == pytest.approx(1.5)
@@ -0,0 +1,32 @@
+import os
+import pytest
+from misc.warmstart import write, read, link_key, RestoredLink, LINK, MAC, HOST, LOAD
+
+
+def test_snapshot_roundtrip(tmpdir):
+    path = os.path.join(str(tmpdir), 'state.bin')
+    records = [(LINK, (1, 2, 3, 4)), (MAC, (5, 0x0a0000000001, 3)), (HOST, (6, 0xffffffffffff, 7)),
+               (LOAD, (8, 1, 1000, -1))]
+    write(path, records)
+
+    assert list(read(path)) == records
+    assert os.listdir(str(tmpdir)) == ['state.bin']
+
+
+def test_snapshot_replaced(tmpdir):
+    path = os.path.join(str(tmpdir), 'state.bin')
+    write(path, [(LINK, (1, 2, 3, 4))])
+    write(path, [])
+    assert list(read(path)) == []
+
+
+def test_not_a_snapshot(tmpdir):
+    path = os.path.join(str(tmpdir), 'state.bin')
+    with open(path, 'wb') as f:
+        f.write(b'garbage')
+    with pytest.raises(ValueError):
+        list(read(path))
+
+
+def test_link_key_same_for_both_directions():
+    assert link_key(RestoredLink(3, 1, 1, 2)) == link_key(RestoredLink(1, 2, 3, 1)) == (1, 2, 3, 1)
@@ -1,4 +1,5 @@
-import copy
+from collections import deque
+
 
 class Node(object):
     """
@@ -60,7 +61,28 @@ class Topology(object):
 
         """
         self._nodes = dict()
-        self._links = list() # Field used for the spanning tree algorithm
+        self._links = set() # Normalized (id1, id2, port1, port2) tuples with id1 <= id2
+
+    @staticmethod
+    def _normalize(id1, id2, port1, port2):
+        """
+        Returns the canonical representation of a link, the smallest id first.
+        """
+        if id1 <= id2:
+            return (id1, id2, port1, port2)
+        return (id2, id1, port2, port1)
+
+    def _add_node(self, id):
+        """
+        Adds a node without any link. Nothing is done if the node already exists.
+
+        Parameters:
+        -----------
+        id: int
+            Id of the node
+        """
+        if id not in self._nodes:
+            self._nodes[id] = Node(id)
 
     def add_link(self, id1, id2, port1, port2):
         """
@@ -78,18 +100,13 @@ class Topology(object):
             Port of the second node leading to the first one.
 
         """
-        if id1 not in self._nodes:
-            self._nodes[id1] = Node(id1)
-        if id2 not in self._nodes:
-            self._nodes[id2] = Node(id2)
+        self._add_node(id1)
+        self._add_node(id2)
 
         self._nodes[id1].add_link(id2, port1)
         self._nodes[id2].add_link(id1, port2)
 
-        if id1 <= id2 and tuple([id1, id2, port1, port2]) not in self._links:
-            self._links.append(tuple([id1, id2, port1, port2]))
-        elif id1 > id2 and tuple([id2, id1, port2, port1]) not in self._links:
-            self._links.append(tuple([id2, id1, port2, port1]))
+        self._links.add(self._normalize(id1, id2, port1, port2))
 
     def remove_link(self, id1, id2, port1, port2):
         """
@@ -110,10 +127,7 @@ class Topology(object):
         self._nodes[id1].remove_link(port1)
         self._nodes[id2].remove_link(port2)
 
-        if id1 <= id2:
-            self._links.remove(tuple([id1, id2, port1, port2]))
-        else:
-            self._links.remove(tuple([id2, id1, port2, port1]))
+        self._links.remove(self._normalize(id1, id2, port1, port2))
 
     def is_connected(self):
         """
@@ -124,41 +138,69 @@ class Topology(object):
         True if the topology is connected, False otherwise.
 
         """
-        starting_node = list(self._nodes.values())[0].id # Take the first element to start the algorithm
-        frontier = [starting_node] # Contains the nodes to expand
-        unvisited_nodes = list(self._nodes.keys())
-        visited_nodes = []
+        if not self._nodes:
+            return True
+
+        starting_node = next(iter(self._nodes)) # Take the first element to start the algorithm
+        frontier = deque([starting_node]) # Contains the nodes to expand
+        visited_nodes = {starting_node}
 
         while frontier:
             # Expand a new node
-            node = frontier.pop(0)
-            visited_nodes.append(node)
-            unvisited_nodes.remove(node)
-
-            for neigbhor in self._nodes[node].neighbors():
-                if neigbhor not in visited_nodes and neigbhor not in frontier:
-                    frontier.append(neigbhor)
+            node = frontier.popleft()
+            for neighbor in self._nodes[node]._links.values():
+                if neighbor not in visited_nodes:
+                    visited_nodes.add(neighbor)
+                    frontier.append(neighbor)
 
         # Check if all the nodes have been visited
-        return bool(not unvisited_nodes)
+        return len(visited_nodes) == len(self._nodes)
 
     def spanning_tree(self):
         """
-        Computes a spanning tree of the graph.
+        Computes a spanning tree of the graph with Kruskal's algorithm. The links are considered in their sorted
+        order, so the same topology always gives the same tree. If the topology is not connected, a spanning forest
+        is returned.
 
         Returns:
         --------
         A spanning tree of the topology.
 
         """
-        new_graph = copy.deepcopy(self)
+        new_graph = Topology()
+        for id in self._nodes:
+            new_graph._add_node(id)
+
+        # Union-find structure over the node ids
+        parent = dict((id, id) for id in self._nodes)
+        rank = dict((id, 0) for id in self._nodes)
+
+        def find(id):
+            root = id
+            while parent[root] != root:
+                root = parent[root]
+            # Path compression
+            while parent[id] != root:
+                parent[id], id = root, parent[id]
+            return root
+
+        for link in sorted(self._links):
+            root1, root2 = find(link[0]), find(link[1])
+            if root1 == root2:
+                continue
+
+            # Union by rank
+            if rank[root1] < rank[root2]:
+                root1, root2 = root2, root1
+            parent[root2] = root1
+            if rank[root1] == rank[root2]:
+                rank[root1] += 1
 
-        for link in new_graph._links:
-            new_graph.remove_link(link[0], link[1], link[2], link[3])
-            if not new_graph.is_connected():
-                new_graph.add_link(link[0], link[1], link[2], link[3])
+            new_graph.add_link(link[0], link[1], link[2], link[3])
+            if len(new_graph._links) == len(self._nodes) - 1:
+                break
 
         return new_graph
 
     def to_str(self):
-        return str(self._links)
+        return str(sorted(self._links))
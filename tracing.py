@@ -0,0 +1,316 @@
+"""
+Flow setup latency tracing. Each traced PacketIn is timestamped when the controller receives it, when the first
+packet_out and the flow_mod it triggers are sent, and when the switch answers the barrier sent right after the
+flow_mod, i.e. once the rule is installed. The latencies are kept in histograms per controller type and per switch.
+
+A dump written by a controller (--trace=<path>) can be read back from the command line:
+
+    python tracing.py /tmp/clos-trace.json
+"""
+import json
+import math
+import sys
+import time
+try:
+    from pox.core import core
+    import pox.openflow.libopenflow_01 as of
+    log = core.getLogger()
+except ImportError:
+    # Reading a dump from the command line does not need POX
+    core = None
+
+# Stages of a flow setup, measured from the reception of the PacketIn
+PACKET_OUT = 'packet_out'
+FLOW_MOD = 'flow_mod'
+INSTALLED = 'installed'
+STAGES = (PACKET_OUT, FLOW_MOD, INSTALLED)
+
+
+class LatencyHistogram(object):
+    """
+    Histogram of latencies with logarithmic buckets: the bucket i holds the latencies between 2^(i-1) and 2^i
+    microseconds.
+    """
+
+    def __init__(self, buckets=None, count=0, total=0.0, maximum=0.0):
+        """
+        Initializes the histogram, empty by default.
+
+        Parameters:
+        -----------
+        buckets: dict
+            Mapping between the bucket index and its number of samples.
+        count: int
+            Number of samples.
+        total: float
+            Sum of the samples in seconds.
+        maximum: float
+            Largest sample in seconds.
+        """
+        self.buckets = dict(buckets or {})
+        self.count = count
+        self.total = total
+        self.maximum = maximum
+
+    def add(self, latency):
+        """
+        Adds a sample.
+
+        Parameters:
+        -----------
+        latency: float
+            Latency in seconds.
+        """
+        micros = latency * 1e6
+        index = int(math.ceil(math.log(micros, 2))) if micros > 1 else 0
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += latency
+        self.maximum = max(self.maximum, latency)
+
+    def merge(self, other):
+        """
+        Adds the samples of another histogram.
+        """
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.maximum = max(self.maximum, other.maximum)
+
+    def percentile(self, p):
+        """
+        Return:
+        -------
+            The upper bound in seconds of the bucket holding the p-th percentile (0 < p <= 100), 0 if empty.
+        """
+        rank = p / 100.0 * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(2 ** index / 1e6, self.maximum)
+        return self.maximum
+
+    def mean(self):
+        """
+        Return:
+        -------
+            The mean latency in seconds, 0 if empty.
+        """
+        return self.total / self.count if self.count else 0.0
+
+    def to_dict(self):
+        """
+        Return:
+        -------
+            The histogram as a JSON serializable dictionary.
+        """
+        return {'buckets': dict((str(i), c) for i, c in self.buckets.items()), 'count': self.count,
+                'total': self.total, 'max': self.maximum}
+
+    @staticmethod
+    def from_dict(data):
+        """
+        Return:
+        -------
+            The histogram described by a dictionary returned by to_dict().
+        """
+        return LatencyHistogram(dict((int(i), c) for i, c in data['buckets'].items()), data['count'],
+                                data['total'], data['max'])
+
+
+class FlowTracer(object):
+    """
+    Traces the setup of the flows of a controller. The switch controllers call packet_in() when they handle a PacketIn,
+    then packet_out() and flow_mod() after sending the corresponding messages. The PacketIns are handled one at a time
+    on the event loop, so the messages sent by a switch controller belong to the PacketIn it is handling.
+    """
+
+    def __init__(self, kind, path=None, sample=1, max_pending=10000):
+        """
+        Initializes the tracer and listens to the barrier replies of the switches.
+
+        Parameters:
+        -----------
+        kind: str
+            Type of the controller (tree, vlan, adaptive), used to label the histograms.
+        path: str
+            File the histograms are dumped to when POX goes down, None to only log the report.
+        sample: int
+            Only one PacketIn out of sample is traced.
+        max_pending: int
+            Maximum number of barriers waiting for a reply, the oldest ones are given up beyond it.
+        """
+        self.kind = kind
+        self.path = path
+        self.sample = max(1, sample)
+        self.max_pending = max_pending
+        self.histograms = {}        # (stage, dpid) -> LatencyHistogram
+
+        self._seen = 0
+        self._current = {}          # dpid -> [PacketIn time, packet_out sent] of the PacketIn being handled
+        self._pending = {}          # (dpid, xid) -> PacketIn time, for the barriers sent
+
+        # Metrics
+        self.traced = 0
+        self.lost = 0
+
+        core.openflow.addListenerByName("BarrierIn", self._handle_BarrierIn)
+        core.addListenerByName("GoingDownEvent", self._handle_GoingDownEvent)
+
+    def packet_in(self, event):
+        """
+        Timestamps a PacketIn. A PacketIn handled again (e.g. after waiting for admission) keeps its first timestamp.
+
+        Parameters:
+        -----------
+        event: Event
+            The PacketIn event.
+        """
+        start = getattr(event, 'trace_start', None)
+        if start is None:
+            self._seen += 1
+            if self._seen % self.sample:
+                self._current.pop(event.connection.dpid, None)
+                return
+            start = event.trace_start = time.time()
+        self._current[event.connection.dpid] = [start, False]
+
+    def rejected(self, event):
+        """
+        Forgets a PacketIn queued or dropped by the admission layer, so that its timestamp is not charged to the next
+        messages sent to the switch. A queued PacketIn keeps its first timestamp for when it is handled.
+
+        Parameters:
+        -----------
+        event: Event
+            The PacketIn event.
+        """
+        self._current.pop(event.connection.dpid, None)
+
+    def packet_out(self, connection):
+        """
+        Records the first packet_out sent for the PacketIn being handled by a switch.
+        """
+        current = self._current.get(connection.dpid)
+        if current is not None and not current[1]:
+            current[1] = True
+            self._add(PACKET_OUT, connection.dpid, time.time() - current[0])
+
+    def flow_mod(self, connection):
+        """
+        Records the flow_mod sent for the PacketIn being handled by a switch, and sends a barrier to know when the
+        switch has installed it.
+        """
+        current = self._current.pop(connection.dpid, None)
+        if current is None:
+            return
+        self._add(FLOW_MOD, connection.dpid, time.time() - current[0])
+
+        if len(self._pending) >= self.max_pending:
+            oldest = min(self._pending, key=self._pending.get)
+            del self._pending[oldest]
+            self.lost += 1
+        barrier = of.ofp_barrier_request()
+        self._pending[(connection.dpid, barrier.xid)] = current[0]
+        connection.send(barrier)
+
+    def _handle_BarrierIn(self, event):
+        """
+        Records the installation of a traced flow.
+        """
+        start = self._pending.pop((event.connection.dpid, event.xid), None)
+        if start is not None:
+            self.traced += 1
+            self._add(INSTALLED, event.connection.dpid, time.time() - start)
+
+    def _handle_GoingDownEvent(self, event):
+        """
+        Logs the report and writes the dump.
+        """
+        log.info(self.report())
+        if self.path:
+            self.dump(self.path)
+
+    def _add(self, stage, dpid, latency):
+        """
+        Adds a latency to the histogram of a stage and a switch.
+        """
+        histogram = self.histograms.get((stage, dpid))
+        if histogram is None:
+            histogram = self.histograms[(stage, dpid)] = LatencyHistogram()
+        histogram.add(latency)
+
+    def to_dict(self):
+        """
+        Return:
+        -------
+            The histograms of the tracer as a JSON serializable dictionary.
+        """
+        return {'kind': self.kind, 'traced': self.traced, 'lost': self.lost,
+                'histograms': [{'stage': stage, 'dpid': dpid, 'histogram': histogram.to_dict()}
+                               for (stage, dpid), histogram in sorted(self.histograms.items())]}
+
+    def dump(self, path):
+        """
+        Writes the histograms into a JSON file, see report().
+        """
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f)
+        log.info("Flow setup trace written to {}: {} flows".format(path, self.traced))
+
+    def report(self):
+        """
+        Return:
+        -------
+            The text report of the histograms.
+        """
+        return report(self.to_dict())
+
+
+def report(data, per_switch=True):
+    """
+    Formats the histograms of a tracer.
+
+    Parameters:
+    -----------
+    data: dict
+        Histograms returned by FlowTracer.to_dict() or read from a dump.
+    per_switch: bool
+        True to add a line per switch under each stage.
+
+    Return:
+    -------
+        The report, one line per stage and per switch.
+    """
+    totals = dict((stage, LatencyHistogram()) for stage in STAGES)
+    switches = dict((stage, []) for stage in STAGES)
+    for entry in data['histograms']:
+        histogram = LatencyHistogram.from_dict(entry['histogram'])
+        totals[entry['stage']].merge(histogram)
+        switches[entry['stage']].append((entry['dpid'], histogram))
+
+    def line(label, histogram):
+        return "{:<16} {:>8} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}".format(
+            label, histogram.count, histogram.mean() * 1000, histogram.percentile(50) * 1000,
+            histogram.percentile(99) * 1000, histogram.maximum * 1000)
+
+    lines = ["Flow setup latency of the {} controller: {} flows traced, {} barriers lost".format(
+                 data['kind'], data['traced'], data['lost']),
+             "{:<16} {:>8} {:>10} {:>10} {:>10} {:>10}".format('stage', 'count', 'mean ms', 'p50 ms', 'p99 ms',
+                                                               'max ms')]
+    for stage in STAGES:
+        lines.append(line(stage, totals[stage]))
+        if per_switch:
+            for dpid, histogram in switches[stage]:
+                lines.append(line("  switch #{}".format(dpid), histogram))
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("Usage: python tracing.py <trace dump>")
+        sys.exit(1)
+    with open(sys.argv[1]) as f:
+        print(report(json.load(f)))
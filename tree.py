@@ -3,18 +3,38 @@ import pox.openflow.discovery
 import pox.openflow.libopenflow_01 as of
 from misc.generic import CentralController, SwitchController
 from misc.graph import *
+import misc.fabric
+from misc.maccodec import to_int, is_multicast
+from misc.linkcost import LinkCostMonitor
+from functools import partial
 
 log = core.getLogger()
 
 
+def tree_of(mac, count):
+    """
+    Return:
+    -------
+        The index of the tree of a MAC address (a 48-bit int) among count trees, the same on every switch.
+    """
+    if count == 1:
+        return 0
+    # Fibonacci hashing spreads the consecutive addresses over the trees
+    return (((mac * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> 32) % count
+
+
 class TreeSwitchController(SwitchController):
     """
     A TreeSwitchController instance handles the behavior of the controller for a
     given switch. It forwards packet when it knows the mapping between the destination address and the port, flood on
     the non-blocking ports otherwise.
+
+    With several trees, a unicast packet follows the tree of its destination and a broadcast the tree of its source
+    (see tree_of()), on every switch. The port of a MAC address is only learned from the packets following its own
+    tree, the one used to reach it, so that the MAC to port mapping holds one port of the right tree per address.
     """
 
-    def __init__(self, connection):
+    def __init__(self, connection, admission=None, tracer=None, capacity=None, dedup=None):
         """
         Initializes the switch controller.
 
@@ -22,15 +42,40 @@ class TreeSwitchController(SwitchController):
         -----------
         connection: Connection
                     A connection objet to the switch.
+        admission: AdmissionControl
+                    Admission layer in front of the PacketIn handler, None to handle every PacketIn.
+        tracer: FlowTracer
+                    Flow setup latency tracer, None to disable tracing.
+        capacity: CapacityManager
+                    Flow table capacity manager, None to install every flow as is.
+        dedup: FloodDedup
+                    Fabric-wide flood handling, None to flood hop by hop.
         """
-        super(TreeSwitchController, self).__init__(connection)
+        super(TreeSwitchController, self).__init__(connection, admission, tracer, capacity, dedup)
 
-        self.mac_to_port = {}
-        self.blocked_ports = []
+        self.mac_to_port = {}   # MAC address as a 48-bit int -> port, in the tree of the address
+        self.trees = []         # Blocked ports of each tree
+        self._compile()
+
+    def _compile(self):
+        """
+        Precomputes the flood ports for each tree and input port, so that the PacketIn handler only does list and dict
+        lookups.
+        """
+        self._blocked = []
+        self._flood = []
+        self._flood_all = []
+        for ports in self.trees or [[]]:
+            blocked = frozenset(ports)
+            allowed = tuple(p for p in self.ports if p not in blocked)
+            self._blocked.append(blocked)
+            self._flood.append(dict((in_port, tuple(p for p in allowed if p != in_port)) for in_port in self.ports))
+            # Packets coming from a port which is not in the list (e.g. the local port)
+            self._flood_all.append(allowed)
 
     def block_ports(self, ports):
         """
-        Blocks the ports given by the user and reset the learned destination-port mapping.
+        Blocks the ports given by the user, as the only tree, and reset the learned destination-port mapping.
 
         Parameters:
         -----------
@@ -38,10 +83,35 @@ class TreeSwitchController(SwitchController):
             List of the switch ports to block.
 
         """
-        log.debug('Switch #{} - Blocked ports: {}'.format(self.connection.dpid, ports))
-        self.blocked_ports = ports
+        self.block_trees([ports])
+
+    def block_trees(self, trees):
+        """
+        Blocks the ports of every tree and reset the learned destination-port mapping.
+
+        Parameters:
+        -----------
+        trees: list
+            List of the switch ports to block in each tree.
+
+        """
+        log.debug('Switch #{} - Blocked ports: {}'.format(self.connection.dpid, trees))
+        self.trees = trees
+        self._compile()
         # Reset the mapping to let the switch to adapt learn the new topology
         self.mac_to_port = {}
+        if self.dedup is not None:
+            self.dedup.invalidate()
+
+    def tree_ports(self, tree):
+        """
+        Return:
+        -------
+            The ports a packet of a tree is flooded on, None if the tree is not applied on the switch.
+        """
+        if tree >= len(self.trees):
+            return None
+        return self._flood_all[tree]
 
     def _handle_PacketIn(self, event):
         """
@@ -55,15 +125,35 @@ class TreeSwitchController(SwitchController):
         """
         packet = event.parsed
         packet_in = event.ofp
+        src, dst = to_int(packet.src), to_int(packet.dst)
 
-        # Update the mac to port binding only if the packet is coming from a non blocking port
-        if packet_in not in self.blocked_ports:
-            self.mac_to_port[packet.src] = packet_in.in_port
+        # Unicast packets follow the tree of their destination, broadcasts the one of their source
+        count = len(self._flood)
+        if count == 1:
+            tree = src_tree = 0
+        else:
+            src_tree = tree_of(src, count)
+            tree = src_tree if is_multicast(dst) else tree_of(dst, count)
+
+        # The echoes of a packet already flooded in the whole fabric are dropped
+        if self.dedup is not None and self.dedup.duplicate(self, packet_in, tree):
+            return
+        if self.tracer is not None:
+            self.tracer.packet_in(event)
+        if self.admission is not None and not self.admission.admit(event, self._handle_PacketIn,
+                                                                   dst in self.mac_to_port):
+            if self.tracer is not None:
+                self.tracer.rejected(event)
+            return
+
+        # Update the mac to port binding only if the packet is coming from a non blocking port of the source tree
+        in_port = packet_in.in_port
+        if tree == src_tree and in_port not in self._blocked[tree]:
+            self.mac_to_port[src] = in_port
 
         # If we know how to reach the destination
-        if packet.dst in self.mac_to_port:
-            out_port = self.mac_to_port[packet.dst]
-
+        out_port = self.mac_to_port.get(dst)
+        if out_port is not None:
             # Forward the packet
             self._send_packet_out(packet_in, out_port)
 
@@ -71,16 +161,22 @@ class TreeSwitchController(SwitchController):
             self._flow_mod_msg(packet.src, packet.dst, out_port, hard_timeout=10)
         # If we do not know the destination
         else:
+            # The ingress switch floods the packet in the whole fabric at once
+            if self.dedup is not None and self.dedup.flood(self, packet_in, tree, src if tree == src_tree else None):
+                return
+
             # Tell the switch to broadcast the packet except on incoming port, blocking ports
-            for port in [p for p in self.ports if (p != packet_in.in_port and p not in self.blocked_ports)]:
+            flood = self._flood[tree].get(in_port, self._flood_all[tree])
+            for port in flood:
                 self._send_packet_out(packet_in, port)
-            log.debug("switch #{} flood on ports [{}]".format(self.connection.dpid, [p for p in self.ports if (p != packet_in.in_port and p not in self.blocked_ports)]))
+            log.debug("switch #%s flood on ports %s", self.connection.dpid, flood)
 
 
 class TreeController(CentralController):
     """
     A TreController that initializes and keeps track of one TreeSwitchController per switch connection.
     """
+    shared_applies = ('_apply_spanning_tree', '_apply_trees')
 
     def __init__(self, core_ids):
         """
@@ -94,6 +190,14 @@ class TreeController(CentralController):
         """
         super(TreeController, self).__init__(core_ids)
 
+        self.blocked_ports = {}     # dpid -> blocked ports of each tree
+        self.spanning_tree = None
+        # Number of trees, see enable_multi_tree()
+        self.tree_count = 1
+        # Link costs of the weighted spanning tree, None for the unweighted one, see enable_weighted_tree()
+        self.link_costs = None
+        self.hysteresis = 0.2
+
     def _handle_ConnectionUp(self, event):
         """
         Handle new switch connections.
@@ -104,11 +208,21 @@ class TreeController(CentralController):
             Event that triggered this function.
 
         """
-        self.switch_controllers.append(TreeSwitchController(event.connection))
+        if not self._owns(event.connection.dpid):
+            log.debug("Switch #{} belongs to another shard".format(event.connection.dpid))
+            return
+
+        switch = TreeSwitchController(event.connection, self.admission, self.tracer, self.capacity, self.dedup)
+        self.switch_controllers.append(switch)
+
+        # The tree may be known before the switch connects (e.g. restored from a snapshot)
+        if event.connection.dpid in self.blocked_ports:
+            switch.block_trees(self.blocked_ports[event.connection.dpid])
+        self._restore_switch(switch)
 
     def _handle_LinkEvent(self, event):
         """
-        Handles links going up or down. The spanning tree is recomputed each time.
+        Handles links going up or down. The spanning tree is recomputed each time, outside of the event loop.
 
         Parameters:
         -----------
@@ -116,18 +230,157 @@ class TreeController(CentralController):
             Event that triggered this function.
 
         """
-        super(TreeController, self)._handle_LinkEvent(event)
+        if not super(TreeController, self)._handle_LinkEvent(event):
+            return
 
-        self.spanning_tree, blocked_ports = self.topology.spanning_tree()
+        if self.tree_count > 1:
+            self._submit(partial(self._multi_trees, count=self.tree_count), self._apply_trees)
+        else:
+            self._submit(self._tree_function(), self._apply_spanning_tree)
+
+    def enable_multi_tree(self, count):
+        """
+        Spreads the traffic over several loop-free trees, one rooted at each core switch, so that every core link
+        carries traffic. The packets are assigned to the trees by hashing their MAC addresses, see TreeSwitchController.
+
+        Parameters:
+        -----------
+        count: int
+            Number of trees. The core switches are reused round robin if there are less of them than trees.
+
+        """
+        self.tree_count = count
+
+    @staticmethod
+    def _multi_trees(topology, count):
+        """
+        Computes the trees of the multi-tree mode: the tree i is the rooted tree of the i-th core switch fully
+        connected to the edge switches. Without such core switch, every tree is the spanning tree.
+
+        Parameters:
+        -----------
+        topology: Topology
+            Snapshot of the topology.
+        count: int
+            Number of trees.
+
+        Return:
+        -------
+            The list of the trees and the mapping between the id of the switches and the blocked ports of each tree.
+        """
+        cores = topology.fully_connected_core()
+        if cores:
+            rooted = dict((core_id, topology.rooted_tree(core_id)) for core_id in cores)
+            trees = [rooted[cores[i % len(cores)]] for i in range(count)]
+        else:
+            trees = [topology.spanning_tree()] * count
+
+        blocked_ports = dict((node_id, [ports[node_id] for t, ports in trees]) for node_id in topology.nodes)
+        return [t for t, ports in trees], blocked_ports
+
+    def enable_weighted_tree(self, interval, hysteresis):
+        """
+        Computes a minimum-cost spanning tree, with link costs measured from the port statistics (utilization, drops
+        and errors), and re-evaluates it periodically, see LinkCostMonitor and Topology.weighted_spanning_tree().
+
+        Parameters:
+        -----------
+        interval: float
+            Delay in seconds between two measures of the link costs and re-evaluations of the tree.
+        hysteresis: float
+            Minimum relative gain on the cost of the tree required to replace the current one.
+
+        """
+        self.hysteresis = hysteresis
+        self.link_costs = LinkCostMonitor(self.topology, self._reevaluate_tree, interval)
+
+    def _tree_function(self):
+        """
+        Return:
+        -------
+            The tree computation to submit, called with a snapshot of the topology.
+        """
+        if self.link_costs is None:
+            return Topology.spanning_tree
+        current = self.spanning_tree.links() if self.spanning_tree is not None else None
+        return partial(Topology.weighted_spanning_tree, current=current, hysteresis=self.hysteresis)
+
+    def _reevaluate_tree(self):
+        """
+        Recomputes the weighted spanning tree with the last link costs. The tree only changes if the new one is cheaper
+        by more than the hysteresis.
+        """
+        if self.channel is not None and not self.channel.writer:
+            return
+        if self.topology.nodes:
+            self._submit(self._tree_function(), self._apply_spanning_tree)
+
+    def _apply_spanning_tree(self, result):
+        """
+        Forwards the blocked ports of a new spanning tree to the switch controllers.
+
+        Parameters:
+        -----------
+        result: tuple
+            The spanning tree and the mapping between the id of the switches and the blocked ports.
+
+        """
+        self.spanning_tree, blocked_ports = result
+        self._roll_out(dict((dpid, [ports]) for dpid, ports in blocked_ports.items()))
+
+    def _apply_trees(self, result):
+        """
+        Forwards the blocked ports of the new trees of the multi-tree mode to the switch controllers.
+
+        Parameters:
+        -----------
+        result: tuple
+            Result of _multi_trees().
+
+        """
+        self.spanning_tree, blocked_ports = result
+        self._roll_out(blocked_ports)
+
+    def _roll_out(self, blocked_ports):
+        """
+        Applies new blocked ports on the switches, tree by tree.
+
+        Parameters:
+        -----------
+        blocked_ports: dict
+            The mapping between the id of the switches and the blocked ports of each tree.
+
+        """
+        self.blocked_ports = blocked_ports
 
         log.debug(blocked_ports)
+        updates = []
         for switch in self.switch_controllers:
             # "If" required because we could have established the connection to a switch but no links active right now
             if switch.connection.dpid in blocked_ports:
-                switch.block_ports(blocked_ports[switch.connection.dpid])
-
-
-def launch(core_ids):
+                new = blocked_ports[switch.connection.dpid]
+                if len(switch.trees) == len(new):
+                    current = switch.trees
+                    if all(set(c) == set(n) for c, n in zip(current, new)):
+                        continue
+                else:
+                    # No tree applied yet
+                    current = [()] * len(new)
+                # Block the new ports of each tree everywhere before unblocking the old ones, see BlockedPortsRollout
+                union = [sorted(set(c) | set(n)) for c, n in zip(current, new)]
+                blocked = set().union(*[set(n) - set(c) for c, n in zip(current, new)])
+                updates.append((switch.connection, blocked, partial(switch.block_trees, union),
+                                partial(switch.block_trees, new)))
+        # Nothing to roll out when a re-evaluation keeps the same trees
+        if updates:
+            self.rollout.start(updates)
+
+
+def launch(core_ids=None, warm_start=None, warm_start_interval=10, warm_start_grace=30,
+           fabric=None, fabric_grace=30, shards=None, shard_index=0, shard_socket=None,
+           admission_rate=None, trace=None, trace_sample=1, dampening_half_life=None, table_capacity=None,
+           capacity_interval=5, weighted_tree=False, weighted_interval=10, weighted_hysteresis=0.2, trees=1,
+           dedup_window=0):
     """
     Starts the controller component.
     """
@@ -135,9 +388,37 @@ def launch(core_ids):
     pox.openflow.discovery.launch()
 
     # Register the controller
+    if core_ids is None and fabric:
+        # The core switches are given by the fabric description
+        core_ids = ",".join(map(str, misc.fabric.load(fabric)[0]))
     try:
         core_ids = list(map(int, core_ids.split(",")))
-    except ValueError:
+    except (AttributeError, ValueError):
         raise ValueError('This controller requires the list of core ids separated by a comma. (e.g. --core_ids=1,2)')
     controller = TreeController(core_ids)
+    if admission_rate and float(admission_rate) > 0:
+        controller.enable_admission(float(admission_rate))
+    if dampening_half_life and float(dampening_half_life) > 0:
+        controller.enable_dampening(float(dampening_half_life))
+    if trace:
+        controller.enable_tracing('tree', trace, int(trace_sample))
+    # 0 trees for one tree per core switch
+    trees = int(trees) or len(core_ids)
+    if trees > 1:
+        if weighted_tree:
+            raise ValueError('The weighted tree only applies to a single tree. (e.g. --trees=1)')
+        controller.enable_multi_tree(trees)
+    elif weighted_tree:
+        controller.enable_weighted_tree(float(weighted_interval), float(weighted_hysteresis))
+    if table_capacity:
+        # 'auto' uses the capacity reported by the switches
+        controller.enable_capacity(None if table_capacity == 'auto' else int(table_capacity), float(capacity_interval))
+    if float(dedup_window) > 0:
+        controller.enable_dedup(float(dedup_window))
+    if shards:
+        controller.enable_sharding(int(shards), int(shard_index), shard_socket)
+    if fabric:
+        controller.load_fabric(fabric, float(fabric_grace))
+    if warm_start:
+        controller.enable_warm_start(warm_start, float(warm_start_interval), float(warm_start_grace))
     core.register(controller)
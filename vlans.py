@@ -3,10 +3,16 @@ import pox.openflow.discovery
 import pox.openflow.libopenflow_01 as of
 from misc.generic import CentralController, SwitchController
 from misc.graph import *
+import misc.fabric
+from misc.maccodec import to_int, to_eth
+from functools import partial
 import tenants
 
 log = core.getLogger()
 
+# VLAN of the hosts of tenants.py, keyed like the MAC tables
+host_vlans = dict((to_int(mac), vlan) for mac, vlan in tenants.hosts.items())
+
 
 class VLANSwitchController(SwitchController):
     """
@@ -15,7 +21,7 @@ class VLANSwitchController(SwitchController):
     according to the VLAN belonging of the packet, if floods on
     the non-blocking ports for this VLAN.
     """
-    def __init__(self, connection):
+    def __init__(self, connection, admission=None, tracer=None, capacity=None, dedup=None):
         """
         Initializes the switch controller.
 
@@ -23,12 +29,35 @@ class VLANSwitchController(SwitchController):
         -----------
         connection: Connection
                     A connection objet to the switch.
+        admission: AdmissionControl
+                    Admission layer in front of the PacketIn handler, None to handle every PacketIn.
+        tracer: FlowTracer
+                    Flow setup latency tracer, None to disable tracing.
+        capacity: CapacityManager
+                    Flow table capacity manager, None to install every flow as is.
+        dedup: FloodDedup
+                    Fabric-wide flood handling, None to flood hop by hop.
         """
-        super(VLANSwitchController, self).__init__(connection)
+        super(VLANSwitchController, self).__init__(connection, admission, tracer, capacity, dedup)
 
-        self.mac_to_port = {}
+        self.mac_to_port = {}   # MAC address as a 48-bit int -> port
         self.vlan_to_core = None
         self.core_to_ports = None
+        self._flood = {}
+
+    def _compile(self):
+        """
+        Precomputes the flood ports for each VLAN and input port, so that the PacketIn handler only does dict lookups.
+        """
+        self._flood = {}
+        dpid = self.connection.dpid
+        for vlan, core_id in self.vlan_to_core.items():
+            blocked = frozenset(self.core_to_ports[core_id].get(dpid, ()))
+            allowed = tuple(p for p in self.ports if p not in blocked)
+            flood = dict((in_port, tuple(p for p in allowed if p != in_port)) for in_port in self.ports)
+            # Packets coming from a port which is not in the list (e.g. the local port)
+            flood[None] = allowed
+            self._flood[vlan] = flood
 
     def block_ports_vlan(self, vlan_to_core, core_to_ports):
         """
@@ -44,8 +73,20 @@ class VLANSwitchController(SwitchController):
         """
         self.vlan_to_core = vlan_to_core
         self.core_to_ports = core_to_ports
+        self._compile()
         # Reset the mapping to let the switch to adapt learn the new topology
         self.mac_to_port = {}
+        if self.dedup is not None:
+            self.dedup.invalidate()
+
+    def tree_ports(self, vlan):
+        """
+        Return:
+        -------
+            The ports a packet of a VLAN is flooded on, None if the switch has no tree for the VLAN yet.
+        """
+        flood = self._flood.get(vlan)
+        return None if flood is None else flood[None]
 
     def _handle_PacketIn(self, event):
         """
@@ -60,14 +101,28 @@ class VLANSwitchController(SwitchController):
         # log.debug("On packet in %d: %s, %s" % (self.connection.dpid, event.parsed, event.ofp))
         packet = event.parsed
         packet_in = event.ofp
+        src, dst = to_int(packet.src), to_int(packet.dst)
+        # Determine the vlan whose belongs the packet
+        vlan = host_vlans.get(src, 'default')
+
+        # The echoes of a packet already flooded in the whole fabric are dropped
+        if self.dedup is not None and self.dedup.duplicate(self, packet_in, vlan):
+            return
+        if self.tracer is not None:
+            self.tracer.packet_in(event)
+        if self.admission is not None and not self.admission.admit(event, self._handle_PacketIn,
+                                                                   dst in self.mac_to_port):
+            if self.tracer is not None:
+                self.tracer.rejected(event)
+            return
 
         # Update the mac to port binding
-        self.mac_to_port[packet.src] = packet_in.in_port
+        in_port = packet_in.in_port
+        self.mac_to_port[src] = in_port
 
         # If we know how to reach the destination
-        if packet.dst in self.mac_to_port:
-            out_port = self.mac_to_port[packet.dst]
-
+        out_port = self.mac_to_port.get(dst)
+        if out_port is not None:
             # Forward the packet
             self._send_packet_out(packet_in, out_port)
 
@@ -75,25 +130,26 @@ class VLANSwitchController(SwitchController):
             self._flow_mod_msg(packet.src, packet.dst, out_port, hard_timeout=10)
         # If we do not know the destination
         else:
-            # Determine the vlan whose belongs the packet
-            if packet.src in tenants.hosts:
-                vlan = tenants.hosts[packet.src]
-            else:
-                vlan = 'default'
-
-            forwarding_core = self.vlan_to_core[vlan]
-            blocked_ports = (self.core_to_ports[forwarding_core])[self.connection.dpid]
+            flood = self._flood.get(vlan)
+            if flood is None:
+                log.debug("switch #%s has no tree for the VLAN of %s yet", self.connection.dpid, to_eth(src))
+                return
+            # The ingress switch floods the packet in the whole fabric at once
+            if self.dedup is not None and self.dedup.flood(self, packet_in, vlan, src):
+                return
+            flood = flood.get(in_port, flood[None])
 
             # Tell the switch to broadcast the packet according to the right vlan tree
-            for port in [p for p in self.ports if (p != packet_in.in_port and p not in blocked_ports)]:
+            for port in flood:
                 self._send_packet_out(packet_in, port)
-            log.debug("switch #{} flood on ports [{}]".format(self.connection.dpid, [p for p in self.ports if (p != packet_in.in_port and p not in blocked_ports)]))
+            log.debug("switch #%s flood on ports %s", self.connection.dpid, flood)
 
 
 class VLANController(CentralController):
     """
     A VLANController that initializes and keeps track of one VLANSwitchController per switch connection.
     """
+    shared_applies = ('_apply_vlan_trees',)
 
     def __init__(self, core_ids):
         """
@@ -107,6 +163,8 @@ class VLANController(CentralController):
         """
         super(VLANController, self).__init__(core_ids)
 
+        self.vlan_trees = None
+
     def _handle_ConnectionUp(self, event):
         """
         Handle new switch connections.
@@ -117,11 +175,21 @@ class VLANController(CentralController):
             Event that triggered this function.
 
         """
-        self.switch_controllers.append(VLANSwitchController(event.connection))
+        if not self._owns(event.connection.dpid):
+            log.debug("Switch #{} belongs to another shard".format(event.connection.dpid))
+            return
+
+        switch = VLANSwitchController(event.connection, self.admission, self.tracer, self.capacity, self.dedup)
+        self.switch_controllers.append(switch)
+
+        # The trees may be known before the switch connects (e.g. restored from a snapshot)
+        if self.vlan_trees is not None:
+            switch.block_ports_vlan(*self.vlan_trees)
+        self._restore_switch(switch)
 
     def _handle_LinkEvent(self, event):
         """
-        Handles links going up or down. The spanning tree is recomputed each time.
+        Handles links going up or down. The VLAN trees are recomputed each time, outside of the event loop.
 
         Parameters:
         -----------
@@ -129,38 +197,122 @@ class VLANController(CentralController):
             Event that triggered this function.
 
         """
-        super(VLANController, self)._handle_LinkEvent(event)
+        if not super(VLANController, self)._handle_LinkEvent(event):
+            return
 
+        self._submit(self._vlan_trees, self._apply_vlan_trees)
+
+    @staticmethod
+    def _vlan_trees(topology):
+        """
+        Computes the rooted tree of every VLAN.
+
+        Parameters:
+        -----------
+        topology: Topology
+            Snapshot of the topology.
+
+        Return:
+        -------
+            The mapping between the VLANs and their core switch and the mapping between the core switches and the
+            blocked ports of their rooted tree. None if no core switch is fully connected.
+        """
         # Check the information provided by the user in tenants.py
         vlans = list(set(tenants.hosts.values()))
         if len(vlans) != tenants.vlan_count:
             log.debug("The number of vlans defined by the user does not match with 'vlan_count' in tenants.py")
 
         # Get the list of the core switches that a are fully connected to the edge switches
-        principal_cores = self.topology.fully_connected_core()
+        principal_cores = topology.fully_connected_core()
 
         # This algorithm behaves well only if there is at least one core switch fully connected
-        if principal_cores:
-            # Create a mapping between each VLAN and the core in charge of it
-            vlan_to_core = {}
-            t = 0
-            for vlan in vlans:
-                vlan_to_core[vlan] = principal_cores[t]
-                t = (t+1) % len(principal_cores)
-            vlan_to_core['default'] = principal_cores[t]
-
-            # Get the blocked ports for every VLAN tree
-            core_to_ports = {}
-            for core in principal_cores:
-                t, p = self.topology.rooted_tree(core)
-                core_to_ports[core] = p
-
-            # Forward this information to the switch controllers
-            for switch_controller in self.switch_controllers:
-                switch_controller.block_ports_vlan(vlan_to_core, core_to_ports)
-
-
-def launch(core_ids):
+        if not principal_cores:
+            return None
+
+        # Create a mapping between each VLAN and the core in charge of it
+        vlan_to_core = {}
+        t = 0
+        for vlan in vlans:
+            vlan_to_core[vlan] = principal_cores[t]
+            t = (t+1) % len(principal_cores)
+        vlan_to_core['default'] = principal_cores[t]
+
+        # Get the blocked ports for every VLAN tree
+        core_to_ports = {}
+        for core in principal_cores:
+            t, p = topology.rooted_tree(core)
+            core_to_ports[core] = p
+
+        return vlan_to_core, core_to_ports
+
+    def _apply_vlan_trees(self, result):
+        """
+        Forwards the VLAN trees to the switch controllers.
+
+        Parameters:
+        -----------
+        result: tuple
+            Result of _vlan_trees().
+
+        """
+        if result is None:
+            return
+
+        self.vlan_trees = result
+        vlan_to_core, core_to_ports = result
+        updates = []
+        for switch in self.switch_controllers:
+            if switch.vlan_to_core == vlan_to_core and switch.core_to_ports == core_to_ports:
+                continue
+            # Block the ports of the new trees everywhere before unblocking the old ones, see BlockedPortsRollout
+            vlans, union, blocked = self._union_trees(switch.vlan_to_core, switch.core_to_ports, vlan_to_core,
+                                                      core_to_ports, switch.connection.dpid)
+            updates.append((switch.connection, blocked, partial(switch.block_ports_vlan, vlans, union),
+                            partial(switch.block_ports_vlan, vlan_to_core, core_to_ports)))
+        if updates:
+            self.rollout.start(updates)
+
+    @staticmethod
+    def _union_trees(current_vlans, current_trees, vlan_to_core, core_to_ports, dpid):
+        """
+        Merges, VLAN by VLAN, the blocked ports of the tree applied on a switch and of the new tree. A VLAN may move to
+        another core switch, so the trees are merged per VLAN and not per core.
+
+        Parameters:
+        -----------
+        current_vlans: dict
+            The mapping between the VLANs and their core switch applied on the switch, None if there is none yet.
+        current_trees: dict
+            The mapping between the core switches and the blocked ports of their tree applied on the switch.
+        vlan_to_core: dict
+            The mapping between the VLANs and their new core switch.
+        core_to_ports: dict
+            The same mapping as current_trees for the new trees.
+        dpid: int
+            Id of the switch.
+
+        Return:
+        -------
+            The arguments of block_ports_vlan() blocking, for each VLAN, the ports blocked by its current or new tree
+            on the switch (every VLAN gets its own tree, keyed by the VLAN), and the set of the ports newly blocked in
+            at least one VLAN.
+        """
+        union = {}
+        blocked = set()
+        for vlan, core_id in vlan_to_core.items():
+            before = set()
+            if current_vlans is not None and vlan in current_vlans:
+                before = set(current_trees[current_vlans[vlan]].get(dpid, ()))
+            after = set(core_to_ports[core_id].get(dpid, ()))
+            union[vlan] = {dpid: sorted(before | after)}
+            blocked |= after - before
+        return dict((vlan, vlan) for vlan in union), union, blocked
+
+
+def launch(core_ids=None, warm_start=None, warm_start_interval=10, warm_start_grace=30,
+           fabric=None, fabric_grace=30, shards=None, shard_index=0, shard_socket=None,
+           admission_rate=None, trace=None, trace_sample=1, dampening_half_life=None, table_capacity=None,
+           capacity_interval=5, dedup_window=0):
     """
     Starts the controller component.
     """
@@ -168,9 +320,29 @@ def launch(core_ids):
     pox.openflow.discovery.launch()
 
     # Register the controller
+    if core_ids is None and fabric:
+        # The core switches are given by the fabric description
+        core_ids = ",".join(map(str, misc.fabric.load(fabric)[0]))
     try:
         core_ids = list(map(int, core_ids.split(",")))
-    except ValueError:
+    except (AttributeError, ValueError):
         raise ValueError('This controller requires the list of core ids separated by a comma. (e.g. --core_ids=1,2)')
     controller = VLANController(core_ids)
+    if admission_rate and float(admission_rate) > 0:
+        controller.enable_admission(float(admission_rate))
+    if dampening_half_life and float(dampening_half_life) > 0:
+        controller.enable_dampening(float(dampening_half_life))
+    if trace:
+        controller.enable_tracing('vlan', trace, int(trace_sample))
+    if table_capacity:
+        # 'auto' uses the capacity reported by the switches
+        controller.enable_capacity(None if table_capacity == 'auto' else int(table_capacity), float(capacity_interval))
+    if float(dedup_window) > 0:
+        controller.enable_dedup(float(dedup_window))
+    if shards:
+        controller.enable_sharding(int(shards), int(shard_index), shard_socket)
+    if fabric:
+        controller.load_fabric(fabric, float(fabric_grace))
+    if warm_start:
+        controller.enable_warm_start(warm_start, float(warm_start_interval), float(warm_start_grace))
     core.register(controller)
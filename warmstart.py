@@ -0,0 +1,181 @@
+import os
+import struct
+from pox.core import core
+from pox.lib.recoco import Timer
+from misc.maccodec import to_raw, from_raw
+
+log = core.getLogger()
+
+# The file starts with a header followed by fixed size records, each one prefixed by its kind
+HEADER = b'CLOSWS\x01'
+LINK = b'L'     # dpid1, port1, dpid2, port2
+MAC = b'M'      # dpid, MAC address, port (learned MAC to port mappings)
+HOST = b'H'     # dpid, MAC address, port (hosts discovered by the host tracker)
+LOAD = b'W'     # dpid, port, last load, last counter (link load history of an edge port)
+FORMATS = {LINK: struct.Struct('!QHQH'), MAC: struct.Struct('!Q6sH'), HOST: struct.Struct('!Q6sH'),
+           LOAD: struct.Struct('!QHqq')}
+
+
+def write(path, records):
+    """
+    Writes a state snapshot. The records are streamed to a temporary file which is synced to disk, then replaces the
+    previous snapshot, so that a crash while writing never leaves a truncated snapshot behind.
+
+    Parameters:
+    -----------
+    path: str
+        Path of the snapshot file.
+    records: iterable of (bytes, tuple)
+        The kind of each record and its fields. MAC addresses are 48-bit ints, see maccodec.py.
+    """
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(HEADER)
+        for kind, fields in records:
+            if kind == MAC or kind == HOST:
+                fields = (fields[0], to_raw(fields[1]), fields[2])
+            f.write(kind)
+            f.write(FORMATS[kind].pack(*fields))
+        # The data must be on disk before the rename, or a crash may leave an empty snapshot in place of the previous one
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp, path)
+
+    # Persists the rename itself
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def read(path):
+    """
+    Reads a state snapshot record by record.
+
+    Parameters:
+    -----------
+    path: str
+        Path of the snapshot file.
+
+    Return:
+    -------
+        A generator of (kind, fields) tuples, as given to write().
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(HEADER)) != HEADER:
+            raise ValueError("{} is not a snapshot file".format(path))
+
+        while True:
+            kind = f.read(1)
+            if not kind:
+                return
+            if kind not in FORMATS:
+                raise ValueError("Unknown record kind {!r} in {}".format(kind, path))
+            fields = FORMATS[kind].unpack(f.read(FORMATS[kind].size))
+            if kind == MAC or kind == HOST:
+                fields = (fields[0], from_raw(fields[1]), fields[2])
+            yield kind, fields
+
+
+class RestoredLink(object):
+    """
+    Stand-in for the links of openflow.discovery, for the links restored from a snapshot.
+    """
+
+    def __init__(self, dpid1, port1, dpid2, port2):
+        self.dpid1 = dpid1
+        self.port1 = port1
+        self.dpid2 = dpid2
+        self.port2 = port2
+
+    @property
+    def uni(self):
+        """
+        The same link with the smallest end first.
+        """
+        if (self.dpid1, self.port1) <= (self.dpid2, self.port2):
+            return self
+        return RestoredLink(self.dpid2, self.port2, self.dpid1, self.port1)
+
+    def key(self):
+        """
+        Return:
+        -------
+            A hashable identifier, the same for both directions of the link.
+        """
+        uni = self.uni
+        return (uni.dpid1, uni.port1, uni.dpid2, uni.port2)
+
+
+class RestoredLinkEvent(object):
+    """
+    Stand-in for the LinkEvent of openflow.discovery, to replay restored links through the usual handlers.
+    """
+
+    def __init__(self, dpid1, port1, dpid2, port2, added):
+        self.link = RestoredLink(dpid1, port1, dpid2, port2)
+        self.added = added
+        self.removed = not added
+
+
+def link_key(link):
+    """
+    Return:
+    -------
+        A hashable identifier of a discovery link, the same for both directions of the link.
+    """
+    return RestoredLink(link.dpid1, link.port1, link.dpid2, link.port2).key()
+
+
+class WarmStart(object):
+    """
+    Periodically saves the state of a controller to disk, and on shutdown, so that it can be restored when the
+    controller restarts.
+    """
+
+    def __init__(self, path, interval, dump):
+        """
+        Initializes the object and starts the periodic snapshots.
+
+        Parameters:
+        -----------
+        path: str
+            Path of the snapshot file.
+        interval: float
+            Delay in seconds between two snapshots.
+        dump: callable
+            Returns the records of the state to save, see write().
+        """
+        self.path = path
+        self.dump = dump
+
+        self.timer = Timer(interval, self.save, recurring=True)
+        core.addListenerByName("GoingDownEvent", lambda event: self.save())
+
+    def save(self):
+        """
+        Writes the current state of the controller.
+        """
+        try:
+            write(self.path, self.dump())
+        except (IOError, OSError) as e:
+            log.warning("Could not write the snapshot {}: {}".format(self.path, e))
+
+    def load(self):
+        """
+        Return:
+        -------
+            The list of records of the last snapshot, empty if there is no valid snapshot.
+        """
+        if not os.path.exists(self.path):
+            return []
+
+        try:
+            records = list(read(self.path))
+        except (IOError, OSError, ValueError, struct.error) as e:
+            log.warning("Could not read the snapshot {}: {}".format(self.path, e))
+            return []
+
+        log.info("Restored {} records from {}".format(len(records), self.path))
+        return records